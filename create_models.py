@@ -1,166 +1,325 @@
-import subprocess
 import os
-from typing import Tuple, List
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from typing import Dict, Tuple
 import ollama
 
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Models')
+
+
+def find_modelfile(model_dir: str) -> str:
+    """
+    Find the Modelfile of a model directory, whatever its capitalization
+
+    Args:
+        model_dir (str): Directory holding the Modelfile
+
+    Returns:
+        str: Path of the Modelfile (the default name if none exists)
+    """
+    for name in ('ModelFile', 'Modelfile'):
+        path = os.path.join(model_dir, name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(model_dir, 'ModelFile')
+
+
+def parse_modelfile(content: str) -> Dict:
+    """
+    Extract the base model, system prompt and parameters of a Modelfile
+
+    Args:
+        content (str): Modelfile text, as written locally or as rendered by `ollama show`
+
+    Returns:
+        Dict: 'from', 'system' and 'parameters' (name -> list of values)
+    """
+    system = re.search(r'^SYSTEM\s+"""(.*?)"""', content, re.MULTILINE | re.DOTALL)
+    if system:
+        rest = content[:system.start()] + content[system.end():]
+        system_text = system.group(1)
+    else:
+        system = re.search(r'^SYSTEM\s+(.+)$', content, re.MULTILINE)
+        rest = content
+        system_text = system.group(1) if system else ''
+
+    base = re.search(r'^FROM\s+(\S+)', rest, re.MULTILINE)
+    parameters = {}
+    for name, value in re.findall(r'^PARAMETER\s+(\S+)\s+(.+?)\s*$', rest, re.MULTILINE):
+        parameters.setdefault(name.lower(), []).append(value.strip('"'))
+    return {
+        'from': base.group(1) if base else None,
+        'system': system_text.strip(),
+        'parameters': parameters
+    }
+
+
+def modelfile_digest(parsed: Dict) -> str:
+    """Hash of the parts of a Modelfile that define the model's behaviour"""
+    payload = json.dumps({'system': parsed['system'], 'parameters': parsed['parameters']}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _parameter_value(value: str):
+    """Convert a Modelfile parameter to the type the create API expects"""
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
 class ModelInitializer:
     """
     A class to handle the initialization and management of Ollama models.
-    This class handles model installation, checking, and creation.
+
+    Readiness is checked through the Ollama HTTP API: the installed models are
+    listed with /api/tags and each required model's system prompt and
+    parameters, from /api/show, are compared with its Modelfile. The result is
+    cached for `ready_ttl` seconds. Pulling the base model and creating the
+    models are explicit steps (`python create_models.py`) or run in a
+    background thread, never on import.
     """
-    
-    def __init__(self):
-        """Initialize the ModelInitializer class"""
+
+    def __init__(self, host=None, models_dir=MODELS_DIR, ready_ttl=30, timeout=5):
+        """
+        Initialize the ModelInitializer class
+
+        Args:
+            host (str, optional): Ollama server URL (defaults to OLLAMA_HOST)
+            models_dir (str): Directory with one sub-directory and Modelfile per model
+            ready_ttl (int): Seconds a readiness check result is reused
+            timeout (float): Timeout in seconds of the readiness check requests
+        """
         self.required_models = ['sqls', 'checker']
         self.base_model = 'llama3.2'
-        
-    def setup_ollama(self) -> bool:
+        self.models_dir = models_dir
+        self.ready_ttl = ready_ttl
+        self.client = ollama.Client(host=host, timeout=timeout)
+        # Pulls and creates can take minutes
+        self.admin_client = ollama.Client(host=host, timeout=None)
+
+        self._status = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @staticmethod
+    def _tag(model_name: str) -> str:
+        """Add the implicit ':latest' tag to a model name"""
+        return model_name if ':' in model_name else f"{model_name}:latest"
+
+    def modelfile_path(self, model_name: str) -> str:
+        """Get the Modelfile path of a required model"""
+        return find_modelfile(os.path.join(self.models_dir, model_name))
+
+    def load_modelfile(self, model_name: str) -> Dict:
         """
-        Install ollama package if not already installed
-        
+        Read and parse the Modelfile of a required model
+
+        Args:
+            model_name (str): Name of the model
+
         Returns:
-            bool: True if setup was successful, False otherwise
+            Dict: Parsed Modelfile with its digest
         """
-        try:
-            import ollama
-            return True
-        except ImportError:
+        with open(self.modelfile_path(model_name)) as f:
+            parsed = parse_modelfile(f.read())
+        parsed['digest'] = modelfile_digest(parsed)
+        return parsed
+
+    def installed_models(self) -> set:
+        """
+        List the installed models through /api/tags
+
+        Returns:
+            set: Installed model names with their tag
+        """
+        return {self._tag(model.model) for model in self.client.list().models}
+
+    def _model_status(self, model_name: str, installed: set) -> str:
+        """Compare an installed model with its Modelfile: 'ready', 'missing' or 'outdated'"""
+        if self._tag(model_name) not in installed:
+            return 'missing'
+        local = self.load_modelfile(model_name)
+        remote = parse_modelfile(self.client.show(model_name).modelfile or '')
+        if remote['system'] != local['system']:
+            return 'outdated'
+        for name, values in local['parameters'].items():
+            if remote['parameters'].get(name) != values:
+                return 'outdated'
+        return 'ready'
+
+    def check_ready(self, max_age=None) -> Dict:
+        """
+        Check that the Ollama server is up and every required model matches its Modelfile
+
+        Args:
+            max_age (int, optional): Reuse a previous result younger than this many seconds
+                (defaults to ready_ttl, 0 forces a new check)
+
+        Returns:
+            Dict: 'ready' flag, per-model status, whether Ollama is reachable and when it was checked
+        """
+        max_age = self.ready_ttl if max_age is None else max_age
+        with self._lock:
+            if self._status and time.time() - self._status['checked_at'] < max_age:
+                return self._status
+
+            status = {'ready': False, 'ollama': False, 'models': {}, 'error': None}
             try:
-                subprocess.run(['pip', 'install', 'ollama'], check=True)
-                return True
-            except subprocess.CalledProcessError as e:
-                print(f"Error installing ollama: {str(e)}")
-                return False
-    
+                installed = self.installed_models()
+                status['ollama'] = True
+                status['base_model'] = 'ready' if self._tag(self.base_model) in installed else 'missing'
+                for model_name in self.required_models:
+                    status['models'][model_name] = self._model_status(model_name, installed)
+                status['ready'] = all(state == 'ready' for state in status['models'].values())
+            except Exception as e:
+                status['error'] = str(e)
+            status['checked_at'] = time.time()
+            self._status = status
+            return status
+
+    def loaded_models(self) -> Dict:
+        """
+        List the models currently loaded in memory through /api/ps
+
+        Returns:
+            Dict: Loaded model names with their tag -> time at which Ollama unloads them
+        """
+        return {self._tag(model.model): model.expires_at for model in self.client.ps().models}
+
+    def check_models_exist(self) -> Tuple[bool, list]:
+        """
+        Check if required models exist and match their Modelfiles
+
+        Returns:
+            Tuple[bool, list]: (all_models_ready, models that are missing or outdated)
+        """
+        status = self.check_ready(max_age=0)
+        pending = [name for name in self.required_models if status['models'].get(name) != 'ready']
+        return not pending, pending
+
     def pull_base_model(self) -> bool:
         """
-        Pull the base llama3.2 model from ollama
-        
+        Pull the base model if it is not installed
+
         Returns:
-            bool: True if pull was successful, False otherwise
+            bool: True if the base model is available, False otherwise
         """
         try:
-            subprocess.run(['ollama', 'pull', self.base_model], check=True)
+            if self._tag(self.base_model) in self.installed_models():
+                return True
+            print(f"Pulling base model {self.base_model}...")
+            self.admin_client.pull(self.base_model)
             return True
-        except subprocess.CalledProcessError as e:
+        except Exception as e:
             print(f"Error pulling base model: {str(e)}")
             return False
-    
-    def check_models_exist(self) -> Tuple[bool, List[str]]:
-        """
-        Check if required models exist in the system
-        
-        Returns:
-            Tuple[bool, List[str]]: (all_models_exist, missing_models)
+
+    def create_models(self, force=False) -> Tuple[bool, str]:
         """
-        try:
-            # Get list of installed models
-            result = subprocess.run(['ollama', 'list'], capture_output=True, text=True)
-            print("Ollama list output:", result.stdout)  # Debug print
-            
-            # Split by newlines and get model names
-            installed_models = []
-            for line in result.stdout.split('\n')[1:]:  # Skip header
-                if line.strip():  # Skip empty lines
-                    model_name = line.split()[0][:-7]  # First column is model name
-                    installed_models.append(model_name)
-            
-            print("Installed models:", installed_models)  # Debug print
-            print("Required models:", self.required_models)  # Debug print
-            
-            # Check for missing models
-            missing_models = [model for model in self.required_models if model not in installed_models]
-            print("Missing models:", missing_models)  # Debug print
-            
-            all_exist = len(missing_models) == 0
-            print("All models exist:", all_exist)  # Debug print
-            
-            return (all_exist, missing_models)
-            
-        except subprocess.CalledProcessError as e:
-            print(f"Error checking models: {str(e)}")
-            return (False, self.required_models)
-    
-    def create_models(self) -> Tuple[bool, str]:
-        """
-        Create SQL and checker models from Modelfiles if they don't exist
-        
+        Create the SQL and checker models that are missing or differ from their Modelfiles
+
+        Args:
+            force (bool): Recreate every model even if it is up to date
+
         Returns:
             Tuple[bool, str]: (success status, message)
         """
         try:
-            # First check if models already exist
-            models_exist, missing_models = self.check_models_exist()
-            print("In create_models - models_exist:", models_exist)  # Debug print
-            if models_exist:
-                print("Models already exist, skipping creation")  # Debug print
+            models_ready, pending = self.check_models_exist()
+            if force:
+                pending = list(self.required_models)
+            elif models_ready:
                 return True, "All required models already exist"
-            
-            # Get the current directory
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            
-            # Create only missing models
-            for model in missing_models:
-                if model == 'sqls':
-                    sql_model_path = os.path.join(current_dir, 'Models', 'sqls', 'Modelfile')
-                    if not os.path.exists(sql_model_path):
-                        return False, f"SQL Modelfile not found at {sql_model_path}"
-                    print("Creating SQL model...")  # Debug print
-                    subprocess.run(['ollama', 'create', 'sqls', '-f', sql_model_path], check=True)
-                    print("Created SQL model successfully")
-                
-                elif model == 'checker':
-                    checker_model_path = os.path.join(current_dir, 'Models', 'checker', 'Modelfile')
-                    if not os.path.exists(checker_model_path):
-                        return False, f"Checker Modelfile not found at {checker_model_path}"
-                    print("Creating checker model...")  # Debug print
-                    subprocess.run(['ollama', 'create', 'checker', '-f', checker_model_path], check=True)
-                    print("Created checker model successfully")
-            
+
+            for model_name in pending:
+                path = self.modelfile_path(model_name)
+                if not os.path.exists(path):
+                    return False, f"Modelfile for '{model_name}' not found at {path}"
+                modelfile = self.load_modelfile(model_name)
+                print(f"Creating {model_name} model...")
+                self.admin_client.create(
+                    model=model_name,
+                    from_=modelfile['from'] or self.base_model,
+                    system=modelfile['system'],
+                    parameters={
+                        name: [_parameter_value(v) for v in values] if len(values) > 1 else _parameter_value(values[0])
+                        for name, values in modelfile['parameters'].items()
+                    }
+                )
+                print(f"Created {model_name} model successfully")
+
+            self.check_ready(max_age=0)
             return True, "Models created successfully!"
-            
-        except subprocess.CalledProcessError as e:
-            return False, f"Error creating models: {str(e)}"
+
         except Exception as e:
-            return False, f"Unexpected error: {str(e)}"
-    
-    def initialize_models(self) -> Tuple[bool, str]:
-        """
-        Initialize all required models by:
-        1. Setting up ollama
-        2. Pulling base model
-        3. Checking for existing models
-        4. Creating missing models if needed
-        
+            return False, f"Error creating models: {str(e)}"
+
+    def initialize_models(self, force=False) -> Tuple[bool, str]:
+        """
+        Pull the base model and create the missing or outdated models
+
+        Args:
+            force (bool): Recreate every model even if it is up to date
+
         Returns:
             Tuple[bool, str]: (success status, message)
         """
         try:
-            # Setup ollama
-            if not self.setup_ollama():
-                return False, "Failed to setup ollama"
-            
-            # Pull base model
+            models_ready, _ = self.check_models_exist()
+            if models_ready and not force:
+                return True, "All required models are already installed"
+
             if not self.pull_base_model():
                 return False, "Failed to pull base model"
-            
-            # Check existing models
-            models_exist, missing_models = self.check_models_exist()
-            print("In initialize_models - models_exist:", models_exist)  # Debug print
-            
-            if models_exist:
-                print("All required models are already installed")  # Debug print
-                return True, "All required models are already installed"
-            
-            # Only create models if they don't exist
-            if missing_models:
-                print("Creating missing models:", missing_models)  # Debug print
-                success, message = self.create_models()
-                if not success:
-                    return False, message
-                return True, "Models initialized successfully"
-            
-            return True, "No models needed to be created"
-            
+            return self.create_models(force=force)
+
         except Exception as e:
             return False, f"Error during initialization: {str(e)}"
+
+    def start(self, setup=False):
+        """
+        Check readiness, and optionally set the models up, in a background thread
+
+        Args:
+            setup (bool): Pull and create missing models instead of only checking them
+        """
+        def run():
+            if setup:
+                success, message = self.initialize_models()
+                if not success:
+                    print(f"Warning: Model initialization failed: {message}")
+            status = self.check_ready(max_age=0)
+            if not status['ready']:
+                print(f"Warning: Ollama models are not ready: {status['models'] or status['error']}. "
+                      "Run `python create_models.py` to create them.")
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=run, name='model-initializer', daemon=True)
+            self._thread.start()
+
+
+if __name__ == '__main__':
+    # Run from the repository root: python create_models.py [--check] [--force]
+    parser = argparse.ArgumentParser(description='Pull the base model and create the Ollama models')
+    parser.add_argument('--check', action='store_true', help='only report whether the models are ready')
+    parser.add_argument('--force', action='store_true', help='recreate the models even if they are up to date')
+    parser.add_argument('--host', default=None, help='Ollama server URL (defaults to OLLAMA_HOST)')
+    args = parser.parse_args()
+
+    initializer = ModelInitializer(host=args.host)
+    if args.check:
+        status = initializer.check_ready(max_age=0)
+        print(json.dumps(status, indent=2))
+        sys.exit(0 if status['ready'] else 1)
+
+    success, message = initializer.initialize_models(force=args.force)
+    print(message)
+    sys.exit(0 if success else 1)
@@ -1,14 +1,39 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
+from werkzeug.wsgi import wrap_file
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import pandas as pd
-from sqlalchemy import inspect, text, create_engine
+from sqlalchemy import text, create_engine
+import asyncio
+import threading
+import contextvars
+import concurrent.futures
+import uuid
 import os
+from contextlib import nullcontext
 import sys
 from dotenv import load_dotenv
 from datetime import datetime
 from models.llm_ollama import *
+from models.llm_pool import OllamaClientPool, OllamaPoolFullError
 from utils.query_logger import QueryLogger
+from utils.query_cache import QueryCache, modelfile_fingerprint
+from utils.result_stream import STREAM_FORMATS, execute_streaming, ndjson_lines, json_array_chunks
+from utils.bulk_loader import BulkLoader
+from utils.value_dictionary import ValueDictionary
+from utils.schema_catalog import SchemaCatalog
+from utils.arrow_format import ARROW_FORMATS, arrow_available, arrow_ipc_chunks, parquet_file
+from utils.sql_validator import SQLValidator, sqlglot_available
+from utils.batch_runner import BatchRunner
+from utils.result_cache import ResultCache
+from utils.pagination import Paginator, PageTokenError
+from utils.query_guard import QueryGuard, QueryRejectedError, current_request_id
+from utils.db_engine import ReplicaRouter
+from utils.rollup import SalesRollup, ROLLUP_TABLES
+from utils.query_templates import TemplateMatcher
+from utils.metrics import (REGISTRY, CACHE_LOOKUPS, RESULT_CACHE_LOOKUPS, TEMPLATE_MATCHES, SPECULATIVE_QUERIES,
+                           CHECKER_DECISIONS, DB_ROWS, REQUESTS, QUERY_GUARD, ROLLUP_REWRITES, Gauge, StageTimer,
+                           record_llm_stats)
 from config import config
 
 # Add parent directory to Python path
@@ -27,41 +52,196 @@ app.config.from_object(config[config_name])
 
 # Initialize extensions
 CORS(app)
+# The engine of the primary is pooled with SQLALCHEMY_ENGINE_OPTIONS
 db = SQLAlchemy(app)
 
+# Generated queries read from the replicas, if any; loads and metadata queries use the primary
+with app.app_context():
+    read_router = ReplicaRouter(
+        db.engine,
+        app.config['DATABASE_REPLICA_URLS'],
+        engine_options=app.config['SQLALCHEMY_ENGINE_OPTIONS'],
+        retry_interval=app.config['DB_REPLICA_RETRY_INTERVAL']
+    )
+
 # Initialize query logger
-query_logger = QueryLogger()
+query_logger = QueryLogger(
+    log_dir=app.config['QUERY_LOG_DIR'],
+    background=app.config['QUERY_LOG_BACKGROUND'],
+    queue_size=app.config['QUERY_LOG_QUEUE_SIZE'],
+    batch_size=app.config['QUERY_LOG_BATCH_SIZE'],
+    flush_interval=app.config['QUERY_LOG_FLUSH_INTERVAL'],
+    fsync=app.config['QUERY_LOG_FSYNC'],
+    max_bytes=app.config['QUERY_LOG_MAX_BYTES'],
+    compression=app.config['QUERY_LOG_COMPRESSION'],
+    overflow=app.config['QUERY_LOG_OVERFLOW'],
+    echo=app.config['QUERY_LOG_ECHO']
+)
+REGISTRY.register(Gauge(
+    'nl2sql_query_log_dropped_entries', 'Query log entries dropped since startup (full queue, serialization or write errors)',
+    callback=lambda: query_logger.dropped
+))
+
+# Check the Ollama models in the background; creating them is `python create_models.py`
+model_initializer = ModelInitializer(ready_ttl=app.config['OLLAMA_READY_TTL'])
+if app.config['OLLAMA_MODEL_SETUP'] != 'off':
+    model_initializer.start(setup=app.config['OLLAMA_MODEL_SETUP'] == 'background')
+
+# Cached schema metadata, also the source of the schema in the LLM prompts
+with app.app_context():
+    schema_catalog = SchemaCatalog(db.engine, check_interval=app.config['SCHEMA_CHECK_INTERVAL'])
+
+# Distinct values of the categorical columns, refreshed in the background; their most
+# frequent values are the examples of the schema in the LLM prompts
+with app.app_context():
+    value_dictionary = ValueDictionary(
+        db.engine,
+        max_distinct=app.config['VALUE_DICT_MAX_DISTINCT'],
+        sample_threshold=app.config['VALUE_DICT_SAMPLE_THRESHOLD'],
+        refresh_interval=app.config['VALUE_DICT_REFRESH_INTERVAL'],
+        full_refresh_interval=app.config['VALUE_DICT_FULL_REFRESH_INTERVAL']
+    )
+value_dictionary.start()
+
+# Initialize LLM models, sharing a bounded pool of Ollama clients across requests
+llm_pool = OllamaClientPool(
+    size=app.config['OLLAMA_POOL_SIZE'],
+    max_queue=app.config['OLLAMA_MAX_QUEUE'],
+    timeout=app.config['OLLAMA_TIMEOUT']
+)
+llm_options = {
+    'num_ctx': app.config['OLLAMA_NUM_CTX'],
+    'num_thread': app.config['OLLAMA_NUM_THREAD'],
+    'num_predict': app.config['OLLAMA_NUM_PREDICT']
+}
+llm = AsyncOllamaLLM(
+    llm_pool,
+    schema_provider=lambda: schema_catalog.prompt_schema(
+        app.config['PROMPT_TABLES'], lambda: {value_dictionary.table: value_dictionary.samples()}
+    ),
+    keep_alive=app.config['OLLAMA_KEEP_ALIVE'],
+    options={name: value for name, value in llm_options.items() if value},
+    structured_output=app.config['OLLAMA_STRUCTURED_OUTPUT'],
+    prefix_priming=app.config['OLLAMA_PREFIX_PRIMING']
+)
+
+def warm_up_models():
+    """Load both models once at startup and report their load times"""
+    for stats in llm.warm_up().values():
+        record_llm_stats(stats)
+
+# Load both models in the background so the first requests skip the cold loads
+if app.config['OLLAMA_WARMUP']:
+    threading.Thread(target=warm_up_models, name='llm-warm-up', daemon=True).start()
+
+def models_loaded():
+    """Report for each model whether Ollama holds it in memory (0 after an eviction)"""
+    loaded = model_initializer.loaded_models()
+    return {(model,): int(ModelInitializer._tag(model) in loaded) for model in (llm.model, llm.checker_model)}
+
+REGISTRY.register(Gauge(
+    'nl2sql_llm_model_loaded', 'Whether Ollama currently holds the model in memory', ['model'],
+    callback=models_loaded
+))
+
+# Deterministic validation of the generated SQL, which lets valid queries skip the checker model
+sql_validator = None
+if app.config['SQL_FAST_PATH_ENABLED']:
+    if sqlglot_available():
+        with app.app_context():
+            sql_validator = SQLValidator(read_router, schema_catalog, explain=app.config['SQL_FAST_PATH_EXPLAIN'])
+    else:
+        print("Warning: sqlglot is not installed, every query goes through the checker model")
+
+# Initialize NL->SQL cache, keyed on the models, their Modelfiles and the schema version
+query_cache = None
+if app.config['QUERY_CACHE_ENABLED']:
+    models_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Models')
+    embed_model = app.config['QUERY_CACHE_EMBED_MODEL']
+    model_fingerprint = modelfile_fingerprint({
+        'sqls': os.path.join(models_dir, 'sqls', 'ModelFile'),
+        'checker': os.path.join(models_dir, 'checker', 'ModelFile')
+    })
+    query_cache = QueryCache(
+        max_entries=app.config['QUERY_CACHE_MAX_ENTRIES'],
+        ttl_seconds=app.config['QUERY_CACHE_TTL'],
+        db_path=app.config['QUERY_CACHE_PATH'] or None,
+        fingerprint=lambda: model_fingerprint + (schema_catalog.refresh() or ''),
+        embed_fn=(lambda text: llm.embed(text, embed_model)) if embed_model else None,
+        similarity_threshold=app.config['QUERY_CACHE_SIMILARITY']
+    )
+
+# SQL templates for common question shapes, using the value dictionary to recognize filter values
+query_templates = TemplateMatcher(value_dictionary) if app.config['QUERY_TEMPLATES_ENABLED'] else None
+
+# Limits on generated SQL: plan cost check, statement timeout, read-only transaction and cancellation
+query_guard = None
+if app.config['QUERY_GUARD_ENABLED']:
+    with app.app_context():
+        query_guard = QueryGuard(
+            read_router,
+            max_cost=app.config['QUERY_GUARD_MAX_COST'],
+            max_rows=app.config['QUERY_GUARD_MAX_ROWS'],
+            statement_timeout=app.config['QUERY_STATEMENT_TIMEOUT'],
+            on_outcome=lambda outcome: QUERY_GUARD.inc(outcome=outcome)
+        )
 
-# Initialize model initializer
-model_initializer = ModelInitializer()
+# Results of executed SQL, invalidated when the tables they read change
+result_cache = None
+# Table versions are read from the primary's statistics, which say nothing of what a lagging replica returns
+if app.config['RESULT_CACHE_ENABLED'] and read_router.replicas:
+    print("Result cache disabled: it cannot tell when results read from the replicas are current")
+elif app.config['RESULT_CACHE_ENABLED']:
+    with app.app_context():
+        result_cache = ResultCache(
+            db.engine,
+            max_bytes=app.config['RESULT_CACHE_MAX_BYTES'],
+            max_entry_bytes=app.config['RESULT_CACHE_MAX_ENTRY_BYTES'],
+            check_interval=app.config['RESULT_CACHE_CHECK_INTERVAL'],
+            listen=app.config['RESULT_CACHE_LISTEN']
+        )
 
-# Check and initialize models
-success, message = model_initializer.initialize_models()
-if not success:
-    print(f"Warning: Model initialization failed: {message}")
-    print("The application may not function properly without the required models.")
+# Pre-aggregated sales by day, region, rep and item, answering eligible aggregate queries
+rollup = None
+if app.config['ROLLUP_ENABLED']:
+    with app.app_context():
+        rollup = SalesRollup(db.engine, auto_refresh=app.config['ROLLUP_AUTO_REFRESH'])
 
-# Initialize LLM models
-llm = OllamaLLM()
+def rollup_sql(sql_query):
+    """
+    Get the SQL to execute for a generated query, reading the rollup instead of sampledb when possible
 
-# Global variable to store unique values
-column_unique_values = {}
+    Returns:
+        tuple: SQL to execute, and whether it reads the rollup. The rollup was found up to date on the
+            primary, so rewritten queries must run there (read_router.primary_only()), not on a lagging replica
+    """
+    if not rollup:
+        return sql_query, False
+    executed_sql, outcome = rollup.rewrite(sql_query)
+    ROLLUP_REWRITES.inc(result=outcome)
+    if outcome == 'rewritten':
+        print(f"Answering from {ROLLUP_TABLES[0]}: {executed_sql}")
+    return executed_sql, outcome == 'rewritten'
 
 def run_query(sql_query):
+    """Run a SQL query, or reuse the cached results of the same SQL, and return the results as JSON"""
+    if not result_cache:
+        return execute_query(sql_query)
+    result = result_cache.get_or_execute(sql_query, execute_query)
+    RESULT_CACHE_LOOKUPS.inc(result='hit' if result.get('cached') else 'miss')
+    return result
+
+def execute_query(sql_query):
     """Run a SQL query and return the results as JSON"""
     print(f"Running query: {sql_query}")
     try:
         with app.app_context():
-            with db.engine.connect() as conn:
+            with query_guard.connection(sql_query) if query_guard else read_router.connect() as conn:
                 result = conn.execute(text(sql_query))
                 # Get column names and convert to list
                 columns = list(result.keys())
-                # Fetch all rows
-                rows = result.fetchall()
-                # Convert rows to list of dictionaries
-                data = []
-                for row in rows:
-                    data.append(dict(zip(columns, row)))
+                # Convert rows to list of dictionaries as they are fetched
+                data = [dict(zip(columns, row)) for row in result]
                 print(f"Query executed successfully")
                 return {
                     'success': True,
@@ -69,6 +249,13 @@ def run_query(sql_query):
                     'data': data,
                     'count': len(data)
                 }
+    except QueryRejectedError as e:
+        print(f"Query rejected by the guard: {str(e)}")
+        return {
+            'success': False,
+            'error': str(e),
+            'rejected': e.reason
+        }
     except Exception as e:
         # Log the error and return an error response
         print(f"Error executing query: {str(e)}")
@@ -76,61 +263,196 @@ def run_query(sql_query):
             'success': False,
             'error': str(e)
         }
-        
+
+# Paged retrieval of results, with a cap on the rows returned per query
+with app.app_context():
+    paginator = Paginator(
+        read_router,
+        schema_catalog,
+        app.config['SECRET_KEY'],
+        run_query,
+        page_size=app.config['RESULT_PAGE_SIZE'],
+        max_rows=app.config['RESULT_MAX_ROWS'],
+        token_ttl=app.config['RESULT_PAGE_TOKEN_TTL'],
+        max_cursors=app.config['RESULT_MAX_HELD_CURSORS'],
+        cursor_idle=app.config['RESULT_CURSOR_IDLE'],
+        guard=query_guard
+    )
+paginator.start()
+REGISTRY.register(Gauge(
+    'nl2sql_held_cursors', 'Server-side cursors held open between result pages',
+    callback=lambda: paginator.stats()['held_cursors']
+))
+
+def execute_page(sql_query, page_size=None):
+    """Execute a generated query, from the rollup if it can be, and return the first page of its results"""
+    executed_sql, rewritten = rollup_sql(sql_query)
+    with read_router.primary_only() if rewritten else nullcontext():
+        return paginator.first_page(executed_sql, page_size)
+
+# Speculative execution of the generated SQL while the checker runs, only under the guard's limits
+speculative_execution = app.config['SPECULATIVE_EXECUTION_ENABLED'] and query_guard is not None
+if app.config['SPECULATIVE_EXECUTION_ENABLED'] and not query_guard:
+    print("Speculative execution disabled: it requires QUERY_GUARD_ENABLED")
+
+def speculative_request_id(request_id):
+    """Get the guard request id of the speculative query of a request, cancellable on its own"""
+    return f"{request_id}:speculative"
+
+def execute_speculative_page(sql_query, page_size, request_id):
+    """Execute a query as the speculative query of a request (runs in a thread with a copy of the context)"""
+    current_request_id.set(request_id)
+    return execute_page(sql_query, page_size)
+
+def start_speculative_query(sql_query, page_size=None):
+    """
+    Start executing a generated query before the checker has reviewed it
+
+    Args:
+        sql_query (str): SQL generated by the sqls model
+        page_size (int, optional): Rows of the first page
+
+    Returns:
+        dict: SQL, guard request id and future of the speculative query
+    """
+    request_id = speculative_request_id(current_request_id.get() or uuid.uuid4().hex)
+    # A thread of its own rather than a task of the request's event loop, which is closed when the
+    # request ends: the query, and the discarding of its held cursor, must be able to outlive it
+    future = concurrent.futures.Future()
+    context = contextvars.copy_context()
+
+    def run():
+        # A running future cannot be cancelled by whoever awaits it, so its result always gets discarded or used
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(context.run(execute_speculative_page, sql_query, page_size, request_id))
+        except Exception as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='speculative-query', daemon=True).start()
+    return {'sql_query': sql_query, 'request_id': request_id, 'future': future}
+
+def discard_speculative_page(future):
+    """Close the cursor held by the results of an unused speculative query (runs in the query's thread)"""
+    if not future.cancelled() and future.exception() is None and future.result()['success']:
+        paginator.discard(future.result())
+
+async def finish_speculative_query(speculative, final_sql, timer):
+    """
+    Use the results of a speculative query if the checker kept its SQL, or cancel it
+
+    Args:
+        speculative (dict): Result of start_speculative_query()
+        final_sql (str): SQL returned by the checker, None if it failed
+        timer (StageTimer): Collects the time spent waiting for the query
+
+    Returns:
+        dict: First page of the results as returned by execute_page(), or None if the query was cancelled
+    """
+    if final_sql is not None and final_sql.strip().rstrip(';') == speculative['sql_query'].strip().rstrip(';'):
+        try:
+            with timer.stage('speculative_wait'):
+                results = await asyncio.wrap_future(speculative['future'])
+        except BaseException:
+            # The request is going away (e.g. the client disconnected): the page will never be returned
+            speculative['future'].add_done_callback(discard_speculative_page)
+            raise
+        SPECULATIVE_QUERIES.inc(result='used')
+        return results
+    # Registered before anything is awaited; runs right away if the query already finished
+    speculative['future'].add_done_callback(discard_speculative_page)
+    SPECULATIVE_QUERIES.inc(result='cancelled')
+    await asyncio.to_thread(query_guard.cancel, speculative['request_id'])
+    return None
+
+def requested_page_size(data):
+    """Get the page size asked for by the client, None for the configured default"""
+    try:
+        page_size = int(data.get('page_size') or 0)
+    except (TypeError, ValueError):
+        return None
+    return page_size if page_size > 0 else None
+
+
+def open_query_stream(sql_query):
+    """
+    Execute a SQL query with a server-side cursor, leaving the rows to be consumed lazily
+
+    Args:
+        sql_query (str): SQL query to execute
+
+    Returns:
+        dict: Columns, a lazy row iterator and a close callback, or an error
+    """
+    print(f"Streaming query: {sql_query}")
+    conn = None
+
+    def close():
+        if query_guard:
+            query_guard.release(conn)
+        conn.close()
+
+    try:
+        conn = read_router.connect()
+        if query_guard:
+            query_guard.begin(conn, sql_query)
+        result = execute_streaming(conn, sql_query, app.config['STREAM_CHUNK_SIZE'])
+        return {
+            'success': True,
+            'columns': list(result.keys()),
+            'rows': result,
+            'close': close
+        }
+    except Exception as e:
+        if conn is not None:
+            close()
+        if query_guard and not isinstance(e, QueryRejectedError):
+            e = query_guard.translate_error(e)
+        print(f"Error executing query: {str(e)}")
+        return {
+            'success': False,
+            'error': str(e)
+        }
+
+def requested_result_format(data):
+    """
+    Get the streaming or binary result format asked for by the client, if any
+
+    Args:
+        data (dict): Request body
+
+    Returns:
+        str: Key of STREAM_FORMATS or ARROW_FORMATS, or None for a regular JSON response
+    """
+    if data.get('format') in STREAM_FORMATS or data.get('format') in ARROW_FORMATS:
+        return data['format']
+    if data.get('stream'):
+        return 'ndjson'
+    best = request.accept_mimetypes.best
+    for name, mimetype in [('ndjson', STREAM_FORMATS['ndjson'])] + list(ARROW_FORMATS.items()):
+        if best == mimetype:
+            return name
+    return None
 
 def init_db():
     """Initialize the database with tables based on SampleDB.csv"""
     try:
-        # Read the CSV file
-        df = pd.read_csv('SampleDB.csv')
-        
-        # Convert OrderDate to datetime
-        df['OrderDate'] = pd.to_datetime(df['OrderDate'])
-        
         with app.app_context():
+            loader = BulkLoader(db.engine, chunk_size=app.config['LOAD_CHUNK_SIZE'])
+            loader.create_table()
+
+            # Bulk load the sample data if the table is empty
             with db.engine.connect() as conn:
-                # Create a single sampledb table
-                conn.execute(text("""
-                    CREATE TABLE IF NOT EXISTS sampledb (
-                        id SERIAL PRIMARY KEY,
-                        order_date DATE,
-                        region VARCHAR(50),
-                        rep VARCHAR(100),
-                        item VARCHAR(100),
-                        units INTEGER,
-                        unit_cost DECIMAL(10,2),
-                        total DECIMAL(10,2)
-                    );
-                """))
-                
-                # Check if table is empty
-                result = conn.execute(text("SELECT COUNT(*) FROM sampledb"))
-                if result.scalar() == 0:
-                    # Insert data from CSV
-                    for _, row in df.iterrows():
-                        conn.execute(text("""
-                            INSERT INTO sampledb (order_date, region, rep, item, units, unit_cost, total)
-                            VALUES (:date, :region, :rep, :item, :units, :cost, :total)
-                        """), {
-                            'date': row['OrderDate'],
-                            'region': row['Region'],
-                            'rep': row['Rep'],
-                            'item': row['Item'],
-                            'units': row['Units'],
-                            'cost': row['UnitCost'],
-                            'total': row['Total']
-                        })
-                
-                # Store unique values only for categorical columns
-                for column in ['region', 'rep', 'item']:
-                    result = conn.execute(text(f"SELECT DISTINCT {column} FROM sampledb ORDER BY {column}"))
-                    values = [str(row[0]) for row in result.fetchall()]
-                    # Print the values to verify they are unique
-                    print(f"Unique {column} values: {values}")
-                    # Store unique values as a list with no duplicates
-                    column_unique_values[column] = list(set(values))
-                
-                conn.commit()
+                is_empty = conn.execute(text("SELECT COUNT(*) FROM sampledb")).scalar() == 0
+            if is_empty:
+                summary = loader.load('SampleDB.csv')
+                if not summary['success']:
+                    return False
+                value_dictionary.notify_load()
+
+            if rollup:
+                rollup.create()
+                rollup.refresh()
             
     except Exception as e:
         print(f"Error initializing database: {str(e)}")
@@ -146,34 +468,122 @@ def index():
 def get_schema():
     """Get database schema information"""
     try:
-        inspector = inspect(db.engine)
-        tables = inspector.get_table_names()
+        catalog = schema_catalog.snapshot()
         schema_info = {}
+        details = {}
         
-        for table in tables:
-            columns = inspector.get_columns(table)
+        for table, info in catalog['tables'].items():
+            if table in ROLLUP_TABLES:
+                continue
             schema_info[table] = [
                 {
                     'name': col['name'],
-                    'type': str(col['type']),
-                    'nullable': col.get('nullable', True)
+                    'type': col['type'],
+                    'nullable': col['nullable']
                 }
-                for col in columns
+                for col in info['columns']
             ]
+            details[table] = {
+                'primary_key': info['primary_key'],
+                'indexes': info['indexes'],
+                'row_estimate': info['row_estimate']
+            }
         
-        return jsonify({'success': True, 'schema': schema_info})
+        response = jsonify({
+            'success': True,
+            'schema': schema_info,
+            'details': details,
+            'version': catalog['version']
+        })
+        response.set_etag(catalog['version'])
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/unique-values', methods=['GET'])
 def get_unique_values():
-    """Get unique values for all columns"""
+    """Get unique values for the categorical columns"""
     try:
-        return jsonify({'success': True, 'unique_values': column_unique_values})
+        snapshot = value_dictionary.snapshot()
+        response = jsonify({
+            'success': True,
+            'unique_values': snapshot['unique_values'],
+            'counts': snapshot['counts'],
+            'approximate': snapshot['approximate']
+        })
+        response.set_etag(snapshot['etag'])
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-def process_user_query(user_query, columns, selected_values):
+@app.route('/api/unique-values/refresh', methods=['POST'])
+def refresh_unique_values():
+    """Refresh the unique values now, incrementally unless ?full=true is given"""
+    try:
+        value_dictionary.refresh(full=request.args.get('full', 'false').lower() == 'true')
+        snapshot = value_dictionary.snapshot()
+        return jsonify({
+            'success': True,
+            'columns': list(snapshot['unique_values']),
+            'etag': snapshot['etag']
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Report whether the database and the Ollama models are ready to serve queries"""
+    models = model_initializer.check_ready()
+    try:
+        with app.app_context():
+            with db.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        database = {'ready': True, 'error': None}
+    except Exception as e:
+        database = {'ready': False, 'error': str(e)}
+    database['pools'] = read_router.stats()
+
+    ready = models['ready'] and database['ready']
+    return jsonify({
+        'success': True,
+        'status': 'ok' if ready else 'degraded',
+        'database': database,
+        'models': models
+    }), 200 if ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose the request, stage and LLM metrics in the Prometheus text format"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Get NL->SQL cache, query result cache and template match statistics"""
+    return jsonify({
+        'success': True,
+        'enabled': bool(query_cache),
+        'stats': query_cache.stats() if query_cache else None,
+        'results': {
+            'enabled': bool(result_cache),
+            'stats': result_cache.stats() if result_cache else None
+        },
+        'templates': {
+            'enabled': bool(query_templates),
+            'stats': query_templates.stats() if query_templates else None
+        }
+    })
+
+def record_llm_response(response, timer, llm_stats):
+    """Report the Ollama metadata of an LLM stage and add its JSON parse time to the timer"""
+    stats = response.pop('llm_stats', None)
+    if not stats:
+        return
+    record_llm_stats(stats)
+    llm_stats.append(stats)
+    if stats.get('parse_ms') is not None:
+        timer.record('json_parse', stats['parse_ms'] / 1000.0)
+
+async def process_user_query(user_query, columns, selected_values, timer=None, speculate=False, page_size=None):
     """
     Process user query using the LLM pipeline
     
@@ -181,42 +591,114 @@ def process_user_query(user_query, columns, selected_values):
         user_query (str): Natural language query
         columns (list): Selected columns
         selected_values (dict): Selected filter values
+        timer (StageTimer, optional): Collects the duration of each stage
+        speculate (bool): Execute the initial SQL while the checker runs, if speculative execution is enabled
+        page_size (int, optional): Rows of the first page of the speculative results
         
     Returns:
-        dict: Response containing SQL query and status
+        dict: Response containing SQL query and status, with the Ollama metadata under 'llm_stats' and,
+            when the checker kept the speculatively executed SQL, its first page under 'query_results'
     """
+    timer = timer or StageTimer()
+    llm_stats = []
+    query_results = None
     try:
         # Generate initial SQL query
         print("columns: ", columns)
         print("selected_values: ", selected_values)
 
-        initial_response = llm.generate_initial_sql(user_query)
+        # Answer common question shapes from templates, without the LLMs
+        if query_templates:
+            with timer.stage('template_match'):
+                template = query_templates.match(user_query, columns, selected_values)
+            outcome = 'matched' if template else 'unmatched'
+            if template and sql_validator:
+                with timer.stage('sql_check'):
+                    check = await asyncio.to_thread(sql_validator.check, template['sql_query'], columns, selected_values)
+                if not check['valid']:
+                    print(f"Template SQL rejected: {check['reason']}")
+                    template, outcome = None, 'rejected'
+            TEMPLATE_MATCHES.inc(result=outcome)
+            if template:
+                print("Template match: ", template['template'])
+                return {
+                    'success': True,
+                    'sql_query': template['sql_query'],
+                    'initial_query': template['sql_query'],
+                    'comments': f"Answered by the '{template['template']}' template",
+                    'llm_stats': llm_stats
+                }
+
+        # Serve repeated questions from the cache instead of the LLMs
+        if query_cache:
+            with timer.stage('cache_lookup'):
+                cached_response = await asyncio.to_thread(query_cache.get, user_query, columns, selected_values)
+            CACHE_LOOKUPS.inc(result=cached_response['cache'] if cached_response else 'miss')
+            if cached_response:
+                print("Cache hit: ", cached_response['cache'])
+                return cached_response
+
+        with timer.stage('initial_sql'):
+            initial_response = await llm.generate_initial_sql(user_query)
+        record_llm_response(initial_response, timer, llm_stats)
         if not initial_response['success']:
-            return initial_response
+            return dict(initial_response, llm_stats=llm_stats)
             
         initial_query = initial_response['sql_query']  # Store the initial query
         print("Initial query: ", initial_query)
         
-        # Create query object for validation
-        query_obj = llm.create_query_object(
-            user_query,
-            initial_query,
-            columns,
-            selected_values
-        )
+        # Skip the checker model when the SQL provably satisfies the selections
+        check = None
+        if sql_validator:
+            with timer.stage('sql_check'):
+                check = await asyncio.to_thread(sql_validator.check, initial_query, columns, selected_values)
+            CHECKER_DECISIONS.inc(decision='skipped' if check['valid'] else 'escalated')
+            print("Local SQL check: ", check)
 
-        print("Query object: ", query_obj)
-        
-        # Validate and update SQL
-        final_response = llm.validate_and_update_sql(query_obj)
+        if check and check['valid']:
+            final_response = {
+                'success': True,
+                'sql_query': initial_query,
+                'comments': 'Validated locally, checker skipped'
+            }
+        else:
+            # Create query object for validation
+            query_obj = llm.create_query_object(
+                user_query,
+                initial_query,
+                columns,
+                selected_values
+            )
+
+            print("Query object: ", query_obj)
+
+            # Run the initial SQL meanwhile, the checker most often returns it unchanged
+            speculative = start_speculative_query(initial_query, page_size) if speculate and speculative_execution else None
+            final_response = None
+            try:
+                # Validate and update SQL
+                with timer.stage('checker'):
+                    final_response = await llm.validate_and_update_sql(query_obj)
+            finally:
+                if speculative:
+                    final_sql = final_response.get('sql_query') if final_response and final_response['success'] else None
+                    query_results = await finish_speculative_query(speculative, final_sql, timer)
+            record_llm_response(final_response, timer, llm_stats)
 
         print("Final query: ", final_response['sql_query'])
         print("comments: ", final_response['comments'])
         
         # Add initial query to the response
         final_response['initial_query'] = initial_query
-        return final_response
-        
+
+        if query_cache and final_response['success']:
+            await asyncio.to_thread(query_cache.set, user_query, columns, selected_values, final_response)
+        if query_results is not None:
+            return dict(final_response, llm_stats=llm_stats, query_results=query_results)
+        return dict(final_response, llm_stats=llm_stats)
+
+    except OllamaPoolFullError:
+        raise
     except Exception as e:
         print(f"Error in process_user_query: {str(e)}")  # Add detailed error logging
         return {
@@ -224,12 +706,30 @@ def process_user_query(user_query, columns, selected_values):
             'error': str(e),
             'comments': 'Error occurred during query processing',
             'sql_query': '',
-            'initial_query': ''
+            'initial_query': '',
+            'llm_stats': llm_stats
         }
 
+def log_submission(user_query, selected_columns, selected_values, query_response, timer, error=None, row_count=None):
+    """Write the query log entry of a submission, with its stage timings and LLM metadata"""
+    query_logger.log_query(
+        success=query_response.get('success', False) and not error,
+        user_query=user_query,
+        selected_columns=selected_columns,
+        selected_values=selected_values,
+        initial_query=query_response.get('initial_query', ''),
+        final_query=query_response.get('sql_query', ''),
+        comments=query_response.get('comments', ''),
+        error=error or query_response.get('error', ''),
+        timings=timer.timings,
+        llm_stats=query_response.get('llm_stats'),
+        row_count=row_count
+    )
+
 @app.route('/api/submit-selections', methods=['POST'])
-def submit_selections():
+async def submit_selections():
     """Accept selections from the frontend and handle them"""
+    timer = StageTimer()
     try:
         data = request.get_json()
         
@@ -237,53 +737,151 @@ def submit_selections():
         selected_columns = data.get('columns', [])
         selected_values = data.get('selected_values', {})
         user_query = data.get('user_query', '')
+        result_format = requested_result_format(data)
+        # Chosen by the client to be able to cancel the request with /api/cancel/<request_id>
+        request_id = str(data.get('request_id') or uuid.uuid4().hex)
+        current_request_id.set(request_id)
 
         print("selected_columns: ", selected_columns)
         print("selected_values: ", selected_values)
         print("user_query: ", user_query)
+
+        if result_format in ARROW_FORMATS and not arrow_available():
+            REQUESTS.inc(outcome='not_acceptable')
+            return jsonify({
+                'success': False,
+                'error': f"The '{result_format}' format requires pyarrow on the server"
+            }), 406
         
         # Process the query through the LLM pipeline
-        query_response = process_user_query(user_query, selected_columns, selected_values)
-        
-        # Log the entire query response
-        query_logger.log_query(
-            success=query_response['success'],
-            user_query=user_query,
-            selected_columns=selected_columns,
-            selected_values=selected_values,
-            initial_query=query_response.get('initial_query', ''),
-            final_query=query_response.get('sql_query', ''),
-            comments=query_response.get('comments', ''),
-            error=query_response.get('error', '')
-        )
+        page_size = requested_page_size(data)
+        query_response = await process_user_query(user_query, selected_columns, selected_values, timer,
+                                                  speculate=not result_format, page_size=page_size)
         
         if not query_response['success']:
+            REQUESTS.inc(outcome='llm_error')
+            log_submission(user_query, selected_columns, selected_values, query_response, timer)
             return jsonify({
                 'success': False,
                 'error': query_response.get('error', 'Failed to process query')
             }), 400
+
+        # Stream large results row by row instead of building them in memory
+        if result_format:
+            with timer.stage('db_execution'):
+                executed_sql, rewritten = rollup_sql(query_response['sql_query'])
+                with read_router.primary_only() if rewritten else nullcontext():
+                    stream = open_query_stream(executed_sql)
+            if not stream['success']:
+                REQUESTS.inc(outcome='db_error')
+                log_submission(user_query, selected_columns, selected_values, query_response, timer,
+                               error=stream['error'])
+                return jsonify({
+                    'success': False,
+                    'error': stream['error']
+                }), 400
+            chunk_size = app.config['STREAM_CHUNK_SIZE']
+            max_rows = app.config['RESULT_MAX_ROWS']
+            metadata = {'user_query': user_query, 'sql_query': query_response['sql_query']}
+
+            # Parquet is encoded whole before responding, so its outcome is known before it is recorded
+            if result_format == 'parquet':
+                try:
+                    body, truncated = parquet_file(stream['columns'], stream['rows'], chunk_size, metadata, max_rows)
+                except Exception as e:
+                    print(f"Error encoding the Parquet file: {str(e)}")
+                    REQUESTS.inc(outcome='db_error')
+                    log_submission(user_query, selected_columns, selected_values, query_response, timer,
+                                   error=str(e))
+                    return jsonify({
+                        'success': False,
+                        'error': str(e)
+                    }), 500
+                finally:
+                    stream['close']()
+                REQUESTS.inc(outcome='ok')
+                log_submission(user_query, selected_columns, selected_values, query_response, timer)
+                response = Response(wrap_file(request.environ, body), mimetype=ARROW_FORMATS['parquet'],
+                                    direct_passthrough=True)
+                response.headers['X-Result-Truncated'] = str(truncated).lower()
+                return response
+
+            # Rows are fetched while the response is sent, so only the query start is timed; an error
+            # while streaming is reported at the end of the stream
+            REQUESTS.inc(outcome='ok')
+            log_submission(user_query, selected_columns, selected_values, query_response, timer)
+            if result_format in ARROW_FORMATS:
+                # Build columnar batches straight from the cursor
+                response = Response(
+                    arrow_ipc_chunks(stream['columns'], stream['rows'], chunk_size, metadata, max_rows),
+                    mimetype=ARROW_FORMATS['arrow']
+                )
+            else:
+                header = {
+                    'success': True,
+                    'message': 'Query processed successfully!',
+                    'request_id': request_id,
+                    'user_query': user_query,
+                    'sql_query': query_response['sql_query'],
+                    'columns': stream['columns'],
+                    'timings': timer.timings
+                }
+                encoder = ndjson_lines if result_format == 'ndjson' else json_array_chunks
+                response = Response(
+                    encoder(header, stream['rows'], chunk_size, max_rows),
+                    mimetype=STREAM_FORMATS[result_format]
+                )
+            response.call_on_close(stream['close'])
+            return response
             
-        # Execute the final SQL query
-        query_results = run_query(query_response['sql_query'])
+        # Execute the final SQL query, returning the first page of the results, unless it already ran speculatively
+        query_results = query_response.get('query_results')
+        if query_results is None:
+            with timer.stage('db_execution'):
+                query_results = execute_page(query_response['sql_query'], page_size)
         
         if not query_results['success']:
+            REQUESTS.inc(outcome='rejected' if query_results.get('rejected') else 'db_error')
+            log_submission(user_query, selected_columns, selected_values, query_response, timer,
+                           error=query_results['error'])
             return jsonify({
                 'success': False,
-                'error': query_results['error']
+                'error': query_results['error'],
+                'rejected': query_results.get('rejected'),
+                'request_id': request_id
             }), 400
             
         # Return the complete response
-        return jsonify({
-            'success': True,
-            'message': 'Query processed successfully!',
-            'user_query': user_query,
-            'sql_query': query_response['sql_query'],
-            'columns': query_results['columns'],
-            'data': query_results['data'],
-            'count': query_results['count']
-        })
+        DB_ROWS.observe(query_results['count'])
+        with timer.stage('serialization'):
+            response = jsonify({
+                'success': True,
+                'message': 'Query processed successfully!',
+                'request_id': request_id,
+                'user_query': user_query,
+                'sql_query': query_response['sql_query'],
+                'columns': query_results['columns'],
+                'data': query_results['data'],
+                'count': query_results['count'],
+                'has_more': query_results['has_more'],
+                'next_token': query_results['next_token'],
+                'truncated': query_results['truncated'],
+                'timings': timer.timings
+            })
+        REQUESTS.inc(outcome='ok')
+        log_submission(user_query, selected_columns, selected_values, query_response, timer,
+                       row_count=query_results['count'])
+        return response
             
+    except OllamaPoolFullError as e:
+        REQUESTS.inc(outcome='busy')
+        print(f"Rejected submit-selections: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'The server is busy, please retry shortly'
+        }), 503
     except Exception as e:
+        REQUESTS.inc(outcome='error')
         # Log error
         query_logger.log_query(
             success=False,
@@ -293,7 +891,8 @@ def submit_selections():
             initial_query='',
             final_query='',
             comments='',
-            error=str(e)
+            error=str(e),
+            timings=timer.timings
         )
         print(f"Error in submit-selections: {str(e)}")
         return jsonify({
@@ -301,6 +900,85 @@ def submit_selections():
             'error': str(e)
         }), 500
 
+@app.route('/api/cancel/<request_id>', methods=['POST'])
+def cancel_request(request_id):
+    """Cancel a submitted request: stop its running query and refuse to start one"""
+    if not query_guard:
+        return jsonify({'success': False, 'error': 'Query cancellation requires QUERY_GUARD_ENABLED'}), 400
+    try:
+        cancelled = query_guard.cancel(request_id) + query_guard.cancel(speculative_request_id(request_id))
+        return jsonify({'success': True, 'request_id': request_id, 'cancelled_queries': cancelled})
+    except Exception as e:
+        print(f"Error cancelling request {request_id}: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/results/next', methods=['POST'])
+def next_results_page():
+    """Get the next page of a result from the 'next_token' of the previous page"""
+    data = request.get_json() or {}
+    token = data.get('next_token')
+    if not token:
+        return jsonify({'success': False, 'error': "'next_token' is required"}), 400
+    try:
+        page = paginator.next_page(token)
+    except PageTokenError as e:
+        return jsonify({'success': False, 'error': str(e)}), 410
+    if not page['success']:
+        return jsonify(page), 400
+    DB_ROWS.observe(page['count'])
+    return jsonify(page)
+
+async def process_batch_item(user_query, columns, selected_values):
+    """Run one distinct question of a batch through the LLM pipeline and log it"""
+    timer = StageTimer()
+    query_response = await process_user_query(user_query, columns, selected_values, timer)
+    log_submission(user_query, columns, selected_values, query_response, timer)
+    return dict(query_response, timings=timer.timings)
+
+# Batches of questions, deduplicated, fanned out to the LLMs and executed once per distinct SQL
+batch_runner = BatchRunner(
+    process_batch_item,
+    execute_page,
+    concurrency=app.config['BATCH_CONCURRENCY'],
+    db_concurrency=app.config['BATCH_DB_CONCURRENCY'],
+    job_ttl=app.config['BATCH_JOB_TTL'],
+    discard_fn=paginator.discard
+)
+
+@app.route('/api/submit-batch', methods=['POST'])
+async def submit_batch():
+    """Accept a list of questions, answering inline or with a job id to poll when 'async' is set"""
+    try:
+        data = request.get_json() or {}
+        items = data.get('items')
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'error': "'items' must be a non-empty list"}), 400
+        if len(items) > app.config['BATCH_MAX_ITEMS']:
+            return jsonify({
+                'success': False,
+                'error': f"At most {app.config['BATCH_MAX_ITEMS']} items are accepted per batch"
+            }), 400
+        if not all(isinstance(item, dict) and item.get('user_query') for item in items):
+            return jsonify({'success': False, 'error': "Every item needs a 'user_query'"}), 400
+
+        if data.get('async'):
+            job_id = batch_runner.submit(items)
+            return jsonify({'success': True, 'job_id': job_id, 'status': 'running'}), 202
+
+        result = await batch_runner.run(items)
+        return jsonify(dict(result, success=True))
+    except Exception as e:
+        print(f"Error in submit-batch: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/batch/<job_id>', methods=['GET'])
+def get_batch(job_id):
+    """Poll a batch job submitted with 'async'"""
+    job = batch_runner.get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown or expired job'}), 404
+    return jsonify(dict(job, success=True))
+
 if __name__ == '__main__':
     # Initialize database with sample data
     if init_db():
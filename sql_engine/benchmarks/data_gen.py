@@ -0,0 +1,125 @@
+import os
+import time
+import argparse
+import pandas as pd
+from sqlalchemy import text
+from utils.bulk_loader import BulkLoader, SAMPLEDB_COLUMNS
+from utils.result_cache import CHANGES_CHANNEL
+from utils.rollup import SalesRollup
+
+# Row counts of the standard benchmark sizes
+SIZES = {'10k': 10000, '1m': 1000000, '10m': 10000000}
+
+# Random rows drawn from the profile of the sample data, generated inside Postgres
+GENERATE_SQL = """
+    WITH picks AS (
+        SELECT 1 + floor(random() * :reps)::int AS r,
+               1 + floor(random() * :items)::int AS i,
+               floor(random() * :days)::int AS d,
+               1 + floor(random() * 95)::int AS u
+        FROM generate_series(1, :rows)
+    )
+    INSERT INTO sampledb (order_date, region, rep, item, units, unit_cost, total)
+    SELECT CAST(:start AS date) + d,
+           (CAST(:rep_regions AS text[]))[r],
+           (CAST(:rep_names AS text[]))[r],
+           (CAST(:item_names AS text[]))[i],
+           u,
+           (CAST(:item_costs AS numeric[]))[i],
+           u * (CAST(:item_costs AS numeric[]))[i]
+    FROM picks
+"""
+
+
+def parse_size(size):
+    """Row count of a size given as 10k, 1m, 10m or a number"""
+    return SIZES.get(str(size).lower()) or int(size)
+
+
+def sample_profile(path='SampleDB.csv'):
+    """
+    Get the reps with their region, and the items with their unit cost, of the sample data
+
+    Args:
+        path (str): Sample CSV file
+
+    Returns:
+        dict: Parameters of GENERATE_SQL other than the row count and dates
+    """
+    df = pd.read_csv(path).rename(columns=SAMPLEDB_COLUMNS)
+    reps = df.groupby('rep')['region'].agg(lambda regions: regions.mode().iloc[0])
+    items = df.groupby('item')['unit_cost'].median().round(2)
+    return {
+        'reps': len(reps),
+        'rep_names': list(reps.index),
+        'rep_regions': list(reps.values),
+        'items': len(items),
+        'item_names': list(items.index),
+        'item_costs': [float(cost) for cost in items.values]
+    }
+
+
+def generate(engine, rows, replace=False, days=730, end_date='2025-12-31', batch_size=1000000,
+             sample_path='SampleDB.csv', refresh_rollup=True):
+    """
+    Fill sampledb with synthetic rows following the sample data
+
+    Args:
+        engine (Engine): SQLAlchemy engine of the database
+        rows (int): Number of rows to add
+        replace (bool): Empty the table first
+        days (int): Number of days the order dates are spread over
+        end_date (str): Last order date, YYYY-MM-DD
+        batch_size (int): Rows inserted per transaction
+        sample_path (str): Sample CSV file the values are drawn from
+        refresh_rollup (bool): Refresh the daily rollup afterwards
+
+    Returns:
+        dict: Rows added, final row count and duration
+    """
+    start = time.time()
+    profile = sample_profile(sample_path)
+    first_day = (pd.Timestamp(end_date) - pd.Timedelta(days=days - 1)).date()
+    BulkLoader(engine).create_table()
+    if replace:
+        with engine.begin() as conn:
+            conn.execute(text("TRUNCATE sampledb RESTART IDENTITY"))
+
+    added = 0
+    while added < rows:
+        batch = min(batch_size, rows - added)
+        with engine.begin() as conn:
+            conn.execute(text(GENERATE_SQL), dict(profile, rows=batch, days=days, start=first_day))
+            conn.execute(text("SELECT pg_notify(:channel, 'sampledb')"), {'channel': CHANGES_CHANNEL})
+        added += batch
+        print(f"Inserted {added}/{rows} rows ({time.time() - start:.1f}s)")
+
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text("ANALYZE sampledb"))
+        total = conn.execute(text("SELECT COUNT(*) FROM sampledb")).scalar()
+    if refresh_rollup:
+        rollup = SalesRollup(engine)
+        rollup.create()
+        rollup.refresh(full=replace)
+    return {'rows': added, 'total_rows': total, 'seconds': time.time() - start}
+
+
+if __name__ == '__main__':
+    # Run from sql_engine/: python -m benchmarks.data_gen --rows 1m --replace
+    from config import config
+    from utils.db_engine import get_engine
+
+    parser = argparse.ArgumentParser(description='Generate synthetic sampledb rows for benchmarks')
+    parser.add_argument('--rows', default='10k', help='10k, 1m, 10m or a row count')
+    parser.add_argument('--replace', action='store_true', help='empty sampledb first')
+    parser.add_argument('--days', type=int, default=730, help='number of days the orders are spread over')
+    parser.add_argument('--end-date', default='2025-12-31')
+    parser.add_argument('--batch-size', type=int, default=1000000)
+    parser.add_argument('--no-rollup', action='store_true', help='skip refreshing the daily rollup')
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    settings = config[os.getenv('FLASK_CONFIG', 'default')]
+    engine = get_engine(args.database_url or settings.SQLALCHEMY_DATABASE_URI, settings.SQLALCHEMY_ENGINE_OPTIONS)
+    print(generate(engine, parse_size(args.rows), replace=args.replace, days=args.days, end_date=args.end_date,
+                   batch_size=args.batch_size, refresh_rollup=not args.no_rollup))
@@ -0,0 +1,277 @@
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from create_models import MODELS_DIR, find_modelfile
+
+RECORDINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recordings.json')
+
+
+def load_recordings(path=RECORDINGS):
+    """
+    Load the recorded questions and model answers
+
+    Args:
+        path (str): JSON file with a list of recordings
+
+    Returns:
+        list: Recordings with 'user_query', 'columns', 'selected_values', 'initial_query',
+            'final_query' and 'comments'
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def recordings_from_logs(log_dir, limit=None):
+    """
+    Build recordings from the successful entries of the query logs
+
+    Args:
+        log_dir (str): Directory written by QueryLogger
+        limit (int, optional): Maximum number of distinct questions
+
+    Returns:
+        list: Recordings, one per distinct question
+    """
+    from utils.log_reader import list_log_files, iter_log_entries
+
+    recordings = {}
+    for entry in iter_log_entries(list_log_files(log_dir)):
+        if not entry.get('success') or not entry.get('final_query') or entry.get('user_query') in recordings:
+            continue
+        recordings[entry['user_query']] = {
+            'user_query': entry['user_query'],
+            'columns': entry.get('selected_columns') or [],
+            'selected_values': entry.get('selected_values') or {},
+            'initial_query': entry.get('initial_query') or entry['final_query'],
+            'final_query': entry['final_query'],
+            'comments': entry.get('comments') or ''
+        }
+        if limit and len(recordings) >= limit:
+            break
+    return list(recordings.values())
+
+
+class MockOllama:
+    """
+    A stand-in for the Ollama HTTP API replaying recorded answers.
+
+    /api/generate answers the `sqls` model with the recorded initial SQL and
+    the `checker` model with the recorded final SQL of the question found in
+    the prompt, after the configured latency. Streamed generations spread the
+    answer over that latency. The token counts and durations the app turns
+    into metrics are derived from the prompt and answer lengths. Like Ollama,
+    each model keeps the prefix shared with its previous prompt "cached": only
+    the rest is counted in prompt_eval_count, and the prompt evaluation (a
+    quarter of the latency) shrinks accordingly. /api/show
+    returns the local Modelfiles so the app considers the models ready.
+    """
+    def __init__(self, recordings, latency=None, jitter=0.2, load_ms=0):
+        """
+        Initialize the MockOllama class
+
+        Args:
+            recordings (list): Recorded questions and answers
+            latency (dict, optional): Mean generation latency in milliseconds per model
+            jitter (float): Relative random variation of the latency
+            load_ms (float): Extra latency of the first generation of each model
+        """
+        self.recordings = recordings
+        self.latency = {'sqls': 800, 'checker': 400, **(latency or {})}
+        self.jitter = jitter
+        self.load_ms = load_ms
+        self.loaded = set()
+        self.prompts = {}
+        self.generations = 0
+        self._lock = threading.Lock()
+
+    def _recording(self, prompt):
+        """Recording of the question contained in a prompt, the longest match first"""
+        matches = [recording for recording in self.recordings if recording['user_query'] in prompt]
+        if matches:
+            return max(matches, key=lambda recording: len(recording['user_query']))
+        return self.recordings[0]
+
+    def _latency(self, model, prompt):
+        """Seconds to wait for a generation, whether it is a cold load and the share of the prompt evaluated"""
+        base = model.split(':')[0]
+        with self._lock:
+            self.generations += 1
+            cold = base not in self.loaded
+            self.loaded.add(base)
+            previous = '' if cold else self.prompts.get(base, '')
+            if prompt:
+                self.prompts[base] = prompt
+        evaluated = 1 - len(os.path.commonprefix([previous, prompt])) / len(prompt) if prompt else 1
+        seconds = self.latency.get(base, 0) * random.uniform(1 - self.jitter, 1 + self.jitter) / 1000
+        seconds *= 0.75 + 0.25 * evaluated
+        return seconds + (self.load_ms / 1000 if cold else 0), cold, evaluated
+
+    def generate(self, body):
+        """
+        Answer a generate request
+
+        Args:
+            body (dict): Request body
+
+        Returns:
+            tuple: (answer text, seconds to spend, response metadata)
+        """
+        model = body.get('model', '')
+        prompt = body.get('prompt') or ''
+        seconds, cold, evaluated = self._latency(model, prompt)
+        if not prompt:
+            # Empty prompts only load the model
+            answer = ''
+        else:
+            recording = self._recording(prompt)
+            if model.startswith('checker'):
+                answer = json.dumps({'updated_sql': recording['final_query'], 'comments': recording['comments']})
+            else:
+                answer = json.dumps({'sql_ans': recording['initial_query']})
+        total_ns = int(seconds * 1e9)
+        load_ns = int(self.load_ms * 1e6) if cold else 0
+        prompt_tokens = max(int(len(prompt) * evaluated) // 4, 1)
+        prompt_ns = int((total_ns - load_ns) / (3 + evaluated) * evaluated)
+        metadata = {
+            'model': model,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'done': True,
+            'done_reason': 'stop',
+            'total_duration': total_ns,
+            'load_duration': load_ns,
+            'prompt_eval_count': prompt_tokens,
+            'prompt_eval_duration': prompt_ns,
+            'eval_count': max(len(answer) // 4, 1),
+            'eval_duration': total_ns - load_ns - prompt_ns
+        }
+        return answer, seconds, metadata
+
+
+def embedding(text, dimensions=64):
+    """Deterministic pseudo-random embedding, so that only identical texts are similar"""
+    generator = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+    return [generator.gauss(0, 1) for _ in range(dimensions)]
+
+
+def make_handler(mock):
+    """Request handler class serving a MockOllama"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, payload, status=200):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, answer, seconds, metadata):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            # Like Ollama, only the final line carries the token counts and durations
+            parts = [answer[i:i + 16] for i in range(0, len(answer), 16)]
+            lines = [{'model': metadata['model'], 'created_at': metadata['created_at'], 'response': part, 'done': False}
+                     for part in parts] + [dict(metadata, response='')]
+            try:
+                for line in lines:
+                    time.sleep(seconds / len(lines))
+                    data = (json.dumps(line) + '\n').encode('utf-8')
+                    self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # The app stops reading once the JSON answer is complete
+                self.close_connection = True
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/api/generate':
+                answer, seconds, metadata = mock.generate(body)
+                if body.get('stream', True):
+                    return self._stream(answer, seconds, metadata)
+                time.sleep(seconds)
+                return self._send_json(dict(metadata, response=answer))
+            if self.path == '/api/show':
+                name = (body.get('model') or body.get('name') or '').split(':')[0]
+                path = find_modelfile(os.path.join(MODELS_DIR, name))
+                if not os.path.exists(path):
+                    return self._send_json({'error': f"model '{name}' not found"}, 404)
+                with open(path, 'r', encoding='utf-8') as f:
+                    return self._send_json({'modelfile': f.read(), 'parameters': '', 'template': '',
+                                            'details': {}, 'model_info': {}})
+            if self.path == '/api/embed':
+                inputs = body.get('input')
+                inputs = inputs if isinstance(inputs, list) else [inputs]
+                return self._send_json({'model': body.get('model'), 'embeddings': [embedding(text) for text in inputs]})
+            if self.path in ('/api/create', '/api/pull'):
+                return self._send_json({'status': 'success'})
+            return self._send_json({'error': 'not found'}, 404)
+
+        def do_GET(self):
+            models = [{'name': f"{name}:latest", 'model': f"{name}:latest"} for name in ('sqls', 'checker')]
+            if self.path == '/api/tags':
+                return self._send_json({'models': models})
+            if self.path == '/api/ps':
+                return self._send_json({'models': [dict(model, expires_at='2100-01-01T00:00:00Z')
+                                                   for model in models if model['name'].split(':')[0] in mock.loaded]})
+            if self.path == '/api/version':
+                return self._send_json({'version': 'mock'})
+            return self._send_json({'error': 'not found'}, 404)
+
+    return Handler
+
+
+def serve(mock, host='127.0.0.1', port=11435):
+    """
+    Serve a MockOllama until interrupted
+
+    Args:
+        mock (MockOllama): Mock to serve
+        host (str): Address to listen on
+        port (int): Port to listen on
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(mock))
+    server.daemon_threads = True
+    print(f"Mock Ollama listening on http://{host}:{port} with {len(mock.recordings)} recordings")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    # Run from sql_engine/: python -m benchmarks.mock_ollama --port 11435 --latency sqls=800,checker=400
+    parser = argparse.ArgumentParser(description='Mock Ollama server replaying recorded answers')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--recordings', default=RECORDINGS, help='JSON recordings file')
+    parser.add_argument('--from-logs', default=None, help='build the recordings from a query log directory instead')
+    parser.add_argument('--latency', default='', help='mean milliseconds per model, e.g. sqls=800,checker=400')
+    parser.add_argument('--jitter', type=float, default=0.2, help='relative random variation of the latency')
+    parser.add_argument('--load-ms', type=float, default=0, help='extra latency of the first generation per model')
+    args = parser.parse_args()
+
+    recordings = recordings_from_logs(args.from_logs) if args.from_logs else load_recordings(args.recordings)
+    if not recordings:
+        sys.exit('No recordings to replay')
+    latency = {name: float(value) for name, value in
+               (item.split('=', 1) for item in args.latency.split(',') if item)}
+    serve(MockOllama(recordings, latency, args.jitter, args.load_ms), args.host, args.port)
@@ -0,0 +1,193 @@
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from benchmarks.mock_ollama import RECORDINGS, load_recordings
+
+SCENARIOS = ('submit', 'schema', 'unique-values')
+
+
+def percentile(values, share):
+    """Nearest-rank percentile of a list of numbers, None if it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)]
+
+
+def summarize(values):
+    """Count and p50/p95/p99 of a list of durations in milliseconds"""
+    return {
+        'count': len(values),
+        'p50': percentile(values, 0.50),
+        'p95': percentile(values, 0.95),
+        'p99': percentile(values, 0.99)
+    }
+
+
+class BenchmarkDriver:
+    """
+    Send requests to a running instance of the app at a fixed concurrency.
+
+    Each scenario sends `requests` requests from `concurrency` threads, each
+    with its own HTTP session. Besides the client-side latency and the
+    throughput, the stage timings returned by /api/submit-selections are
+    collected, so a regression can be traced to the LLM stages or the database.
+    """
+    def __init__(self, base_url, recordings, vary_questions=False, timeout=120):
+        """
+        Initialize the BenchmarkDriver class
+
+        Args:
+            base_url (str): URL of the app, e.g. http://127.0.0.1:5000
+            recordings (list): Questions submitted in turn, with their columns and selected values
+            vary_questions (bool): Make every submitted question unique, bypassing the NL->SQL cache
+            timeout (float): Seconds before a request is counted as failed
+        """
+        self.base_url = base_url.rstrip('/')
+        self.recordings = recordings
+        self.vary_questions = vary_questions
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self):
+        """HTTP session of the current thread"""
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _request(self, scenario, index):
+        """Send one request, returning (ok, milliseconds, stage timings)"""
+        session = self._session()
+        start = time.perf_counter()
+        try:
+            if scenario == 'submit':
+                recording = self.recordings[index % len(self.recordings)]
+                question = recording['user_query']
+                if self.vary_questions:
+                    question = f"{question} (run {index})"
+                response = session.post(f"{self.base_url}/api/submit-selections", timeout=self.timeout, json={
+                    'user_query': question,
+                    'columns': recording.get('columns', []),
+                    'selected_values': recording.get('selected_values', {})
+                })
+            else:
+                response = session.get(f"{self.base_url}/api/{scenario}", timeout=self.timeout)
+            body = response.json()
+        except (requests.RequestException, ValueError):
+            return False, (time.perf_counter() - start) * 1000, {}
+        elapsed = (time.perf_counter() - start) * 1000
+        return response.ok and body.get('success', False), elapsed, body.get('timings') or {}
+
+    def run(self, scenario, concurrency, total, warmup=0):
+        """
+        Run a scenario
+
+        Args:
+            scenario (str): 'submit', 'schema' or 'unique-values'
+            concurrency (int): Number of requests in flight
+            total (int): Number of measured requests
+            warmup (int): Requests sent first and left out of the results
+
+        Returns:
+            dict: Throughput, errors, client latency and stage timing percentiles
+        """
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda index: self._request(scenario, index), range(warmup)))
+            start = time.perf_counter()
+            results = list(executor.map(lambda index: self._request(scenario, index), range(warmup, warmup + total)))
+            seconds = time.perf_counter() - start
+
+        stages = {}
+        for ok, _, timings in results:
+            if ok:
+                for stage, ms in timings.items():
+                    stages.setdefault(stage, []).append(ms)
+        return {
+            'scenario': scenario,
+            'concurrency': concurrency,
+            'requests': total,
+            'errors': sum(1 for ok, _, _ in results if not ok),
+            'seconds': seconds,
+            'throughput': total / seconds if seconds else 0.0,
+            'latency': summarize([ms for ok, ms, _ in results if ok]),
+            'stages': {stage: summarize(values) for stage, values in sorted(stages.items())}
+        }
+
+
+def _ms(value):
+    return f"{value:9.1f}" if value is not None else f"{'-':>9}"
+
+
+def print_results(results):
+    """Print one block per scenario and concurrency, with the latency and stage percentiles"""
+    for result in results:
+        print(f"\n{result['scenario']} x{result['concurrency']}: {result['throughput']:.1f} req/s, "
+              f"{result['errors']}/{result['requests']} errors")
+        print(f"  {'stage':<16} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        rows = [('total', result['latency'])] + list(result['stages'].items())
+        for stage, stats in rows:
+            print(f"  {stage:<16} {stats['count']:>6} {_ms(stats['p50'])} {_ms(stats['p95'])} {_ms(stats['p99'])}")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Find the scenarios slower than in a baseline run
+
+    Args:
+        results (list): Results of this run
+        baseline (list): Results of a previous run, as saved with --output
+        tolerance (float): Allowed relative increase of p95 latency and decrease of throughput
+
+    Returns:
+        list: Descriptions of the regressions
+    """
+    previous = {(result['scenario'], result['concurrency']): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['scenario'], result['concurrency']))
+        if not before:
+            continue
+        name = f"{result['scenario']} x{result['concurrency']}"
+        p95, p95_before = result['latency']['p95'], before['latency']['p95']
+        if p95 is not None and p95_before and p95 > p95_before * (1 + tolerance):
+            regressions.append(f"{name}: p95 {p95_before:.1f} -> {p95:.1f} ms")
+        if result['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput']:.1f} -> {result['throughput']:.1f} req/s")
+    return regressions
+
+
+if __name__ == '__main__':
+    # Run from sql_engine/: python -m benchmarks.run --concurrency 1,8,32 --requests 200
+    parser = argparse.ArgumentParser(description='Benchmark a running instance of the app')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma-separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', default='1,8,32', help='comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario and level')
+    parser.add_argument('--warmup', type=int, default=10, help='requests sent before measuring')
+    parser.add_argument('--recordings', default=RECORDINGS, help='questions to submit, as given to the mock')
+    parser.add_argument('--vary-questions', action='store_true', help='make every question unique to bypass the NL->SQL cache')
+    parser.add_argument('--output', default=None, help='save the results as JSON')
+    parser.add_argument('--baseline', default=None, help='results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression against the baseline')
+    args = parser.parse_args()
+
+    driver = BenchmarkDriver(args.base_url, load_recordings(args.recordings), args.vary_questions)
+    results = []
+    for scenario in args.scenarios.split(','):
+        for concurrency in (int(level) for level in args.concurrency.split(',')):
+            results.append(driver.run(scenario, concurrency, args.requests, args.warmup))
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        sys.exit(1 if regressions else 0)
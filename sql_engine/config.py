@@ -9,7 +9,114 @@ class Config:
     # Common settings
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev')
-    
+
+    # Connection pool of each database engine, per worker process
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))  # seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # seconds before a connection is replaced
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'True').lower() == 'true'
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+    # Comma-separated URLs of read replicas for the generated queries, empty to read from the primary
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    DB_REPLICA_RETRY_INTERVAL = int(os.getenv('DB_REPLICA_RETRY_INTERVAL', 30))  # seconds a failing replica is skipped
+
+    # Ollama client pool settings
+    OLLAMA_POOL_SIZE = int(os.getenv('OLLAMA_POOL_SIZE', 4))  # concurrent generations
+    OLLAMA_MAX_QUEUE = int(os.getenv('OLLAMA_MAX_QUEUE', 64))  # requests waiting for a client
+    OLLAMA_TIMEOUT = float(os.getenv('OLLAMA_TIMEOUT', 120))
+    OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')  # e.g. 30m, or seconds with -1 = never unload
+    OLLAMA_NUM_CTX = int(os.getenv('OLLAMA_NUM_CTX', 4096))  # context size, fits the checker prompt
+    OLLAMA_NUM_THREAD = int(os.getenv('OLLAMA_NUM_THREAD', 0))  # 0 leaves the choice to Ollama
+    OLLAMA_NUM_PREDICT = int(os.getenv('OLLAMA_NUM_PREDICT', 384))  # maximum generated tokens, enough for a SQL answer
+    OLLAMA_STRUCTURED_OUTPUT = os.getenv('OLLAMA_STRUCTURED_OUTPUT', 'True').lower() == 'true'  # JSON schema answers
+    OLLAMA_WARMUP = os.getenv('OLLAMA_WARMUP', 'True').lower() == 'true'  # load both models at startup
+    OLLAMA_PREFIX_PRIMING = os.getenv('OLLAMA_PREFIX_PRIMING', 'True').lower() == 'true'  # schema prefix kept in the KV cache
+    OLLAMA_MODEL_SETUP = os.getenv('OLLAMA_MODEL_SETUP', 'check')  # check, background (pull/create) or off
+    OLLAMA_READY_TTL = int(os.getenv('OLLAMA_READY_TTL', 30))  # seconds a readiness check is reused
+
+    # Rows fetched per round trip when streaming results
+    STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 1000))
+
+    # Limits on the execution of generated SQL
+    QUERY_GUARD_ENABLED = os.getenv('QUERY_GUARD_ENABLED', 'True').lower() == 'true'
+    QUERY_GUARD_MAX_COST = float(os.getenv('QUERY_GUARD_MAX_COST', 1e7))  # planner cost units, 0 disables
+    QUERY_GUARD_MAX_ROWS = float(os.getenv('QUERY_GUARD_MAX_ROWS', 5e7))  # estimated plan rows, 0 disables
+    QUERY_STATEMENT_TIMEOUT = int(os.getenv('QUERY_STATEMENT_TIMEOUT', 30000))  # milliseconds, 0 disables
+
+    # Paged results of the JSON responses
+    RESULT_PAGE_SIZE = int(os.getenv('RESULT_PAGE_SIZE', 1000))  # default and maximum rows per page
+    RESULT_MAX_ROWS = int(os.getenv('RESULT_MAX_ROWS', 100000))  # rows returned across all pages of a query
+    RESULT_PAGE_TOKEN_TTL = int(os.getenv('RESULT_PAGE_TOKEN_TTL', 3600))  # seconds
+    RESULT_MAX_HELD_CURSORS = int(os.getenv('RESULT_MAX_HELD_CURSORS', 8))  # per worker, for non-keyset queries
+    RESULT_CURSOR_IDLE = int(os.getenv('RESULT_CURSOR_IDLE', 300))  # seconds before an unused cursor is closed
+
+    # Rows per COPY chunk / transaction when bulk loading
+    LOAD_CHUNK_SIZE = int(os.getenv('LOAD_CHUNK_SIZE', 100000))
+
+    # Daily sales rollup answering eligible aggregate queries
+    ROLLUP_ENABLED = os.getenv('ROLLUP_ENABLED', 'True').lower() == 'true'
+    ROLLUP_AUTO_REFRESH = os.getenv('ROLLUP_AUTO_REFRESH', 'True').lower() == 'true'  # refresh when a query finds it stale
+
+    # Categorical value dictionary settings
+    VALUE_DICT_MAX_DISTINCT = int(os.getenv('VALUE_DICT_MAX_DISTINCT', 1000))
+    VALUE_DICT_SAMPLE_THRESHOLD = int(os.getenv('VALUE_DICT_SAMPLE_THRESHOLD', 1000000))  # rows
+    VALUE_DICT_REFRESH_INTERVAL = int(os.getenv('VALUE_DICT_REFRESH_INTERVAL', 300))  # seconds, 0 disables
+    VALUE_DICT_FULL_REFRESH_INTERVAL = int(os.getenv('VALUE_DICT_FULL_REFRESH_INTERVAL', 86400))
+
+    # Schema catalog settings
+    SCHEMA_CHECK_INTERVAL = int(os.getenv('SCHEMA_CHECK_INTERVAL', 5))  # seconds between DDL checks
+    PROMPT_TABLES = os.getenv('PROMPT_TABLES', 'sampledb').split(',')  # tables described to the LLMs
+
+    # Local SQL validation: skip the checker model when the generated SQL passes
+    SQL_FAST_PATH_ENABLED = os.getenv('SQL_FAST_PATH_ENABLED', 'True').lower() == 'true'
+    SQL_FAST_PATH_EXPLAIN = os.getenv('SQL_FAST_PATH_EXPLAIN', 'True').lower() == 'true'  # also EXPLAIN the SQL
+
+    # Question templates: answer common question shapes without the LLMs
+    QUERY_TEMPLATES_ENABLED = os.getenv('QUERY_TEMPLATES_ENABLED', 'True').lower() == 'true'
+
+    # Speculative execution: run the generated SQL while the checker model reviews it (requires the query guard)
+    SPECULATIVE_EXECUTION_ENABLED = os.getenv('SPECULATIVE_EXECUTION_ENABLED', 'False').lower() == 'true'
+
+    # Batch API settings
+    BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 500))
+    BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 4))  # questions in the LLM stages at once
+    BATCH_DB_CONCURRENCY = int(os.getenv('BATCH_DB_CONCURRENCY', 4))  # statements executing at once
+    BATCH_JOB_TTL = int(os.getenv('BATCH_JOB_TTL', 3600))  # seconds finished job results are kept
+
+    # Query log settings
+    QUERY_LOG_DIR = os.getenv('QUERY_LOG_DIR', 'logs')
+    QUERY_LOG_BACKGROUND = os.getenv('QUERY_LOG_BACKGROUND', 'True').lower() == 'true'
+    QUERY_LOG_QUEUE_SIZE = int(os.getenv('QUERY_LOG_QUEUE_SIZE', 10000))
+    QUERY_LOG_BATCH_SIZE = int(os.getenv('QUERY_LOG_BATCH_SIZE', 100))
+    QUERY_LOG_FLUSH_INTERVAL = float(os.getenv('QUERY_LOG_FLUSH_INTERVAL', 1.0))  # seconds
+    QUERY_LOG_FSYNC = os.getenv('QUERY_LOG_FSYNC', 'False').lower() == 'true'
+    QUERY_LOG_MAX_BYTES = int(os.getenv('QUERY_LOG_MAX_BYTES', 100 * 1024 * 1024))  # 0 disables rotation
+    QUERY_LOG_COMPRESSION = os.getenv('QUERY_LOG_COMPRESSION', 'gzip') or None  # gzip, zstd or empty
+    QUERY_LOG_OVERFLOW = os.getenv('QUERY_LOG_OVERFLOW', 'drop')  # drop or block
+    QUERY_LOG_ECHO = os.getenv('QUERY_LOG_ECHO', 'True').lower() == 'true'
+
+    # NL->SQL cache settings
+    QUERY_CACHE_ENABLED = os.getenv('QUERY_CACHE_ENABLED', 'True').lower() == 'true'
+    QUERY_CACHE_MAX_ENTRIES = int(os.getenv('QUERY_CACHE_MAX_ENTRIES', 512))
+    QUERY_CACHE_TTL = int(os.getenv('QUERY_CACHE_TTL', 3600))
+    QUERY_CACHE_PATH = os.getenv('QUERY_CACHE_PATH', '')  # e.g. cache/query_cache.db
+    QUERY_CACHE_EMBED_MODEL = os.getenv('QUERY_CACHE_EMBED_MODEL', '')  # e.g. nomic-embed-text
+    QUERY_CACHE_SIMILARITY = float(os.getenv('QUERY_CACHE_SIMILARITY', 0.97))
+
+    # Query result cache settings
+    RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'True').lower() == 'true'
+    RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv('RESULT_CACHE_MAX_ENTRY_BYTES', 8 * 1024 * 1024))
+    RESULT_CACHE_CHECK_INTERVAL = float(os.getenv('RESULT_CACHE_CHECK_INTERVAL', 2))  # seconds
+    RESULT_CACHE_LISTEN = os.getenv('RESULT_CACHE_LISTEN', 'True').lower() == 'true'
+
     @staticmethod
     def init_app(app):
         pass
@@ -23,10 +130,13 @@ class ProductionConfig(Config):
     """Production configuration"""
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
+    QUERY_LOG_ECHO = os.getenv('QUERY_LOG_ECHO', 'False').lower() == 'true'
 
 class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
+    QUERY_CACHE_ENABLED = False
+    RESULT_CACHE_ENABLED = False
     SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URL', 'postgresql://prabal@localhost:5432/prabal_test')
 
 # Configuration dictionary
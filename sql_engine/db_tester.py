@@ -1,5 +1,10 @@
 # PostgreSQL database configuration
-from sqlalchemy import create_engine,text
+import os
+from config import config
+from utils.db_engine import get_engine
+from utils.result_stream import execute_streaming
+
+settings = config[os.getenv('FLASK_CONFIG', 'default')]
 
 # query = '''
 # SELECT region, SUM(total) AS total_sales 
@@ -14,41 +19,36 @@ FROM sampledb
 WHERE rep IN ('Gill', 'Kivell') AND item IN ('Desk', 'Pen Set')
 GROUP BY region, rep'''
 
-def execute_sql_query(query):
+def execute_sql_query(query, chunk_size=1000):
     """
     Execute a SQL query on the PostgreSQL database and return the results
     
     Args:
         query (str): SQL query to execute
+        chunk_size (int): Number of rows fetched per round trip
         
     Returns:
-        dict: Dictionary containing query results with columns and data
+        dict: Dictionary containing query results with columns and rows as arrays
     """
     try:
-        # Import SQLAlchemy create_engine
-        # Create database engine
-        engine = create_engine('postgresql://prabal@localhost:5432/prabal')
+        # Reuse the pooled engine shared with the rest of the process
+        engine = get_engine(settings.SQLALCHEMY_DATABASE_URI, settings.SQLALCHEMY_ENGINE_OPTIONS)
         
-        # Execute query and fetch results
+        # Execute query with a server-side cursor and fetch results in chunks
         with engine.connect() as connection:
-            result = connection.execute(text(query))
+            result = execute_streaming(connection, query, chunk_size)
             
             # Get column names
-            columns = result.keys()
-            
-            # Fetch all rows
-            rows = result.fetchall()
+            columns = list(result.keys())
             
-            # Convert rows to list of dictionaries
-            data = []
-            for row in rows:
-                data.append(dict(zip(columns, row)))
+            # Keep rows as compact arrays instead of one dictionary per row
+            rows = [list(row) for row in result]
                 
             return {
                 'success': True,
                 'columns': columns,
-                'data': data,
-                'count': len(data)
+                'rows': rows,
+                'count': len(rows)
             }
             
     except Exception as e:
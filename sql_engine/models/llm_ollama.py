@@ -1,50 +1,409 @@
 import ollama
 import json
+import time
+import threading
+from types import SimpleNamespace
+from models.llm_pool import OllamaPoolFullError
+
+# Structured-output schemas enforcing the answer shape of each model
+SQL_ANSWER_SCHEMA = {
+    'type': 'object',
+    'properties': {'sql_ans': {'type': 'string'}},
+    'required': ['sql_ans']
+}
+CHECKER_ANSWER_SCHEMA = {
+    'type': 'object',
+    'properties': {'updated_sql': {'type': 'string'}, 'comments': {'type': 'string'}},
+    'required': ['updated_sql', 'comments']
+}
+
+# Seconds before a failed prompt prefix priming is retried
+PREFIX_PRIMING_RETRY = 60
+# Typical characters per token of English and SQL, to size a prefix Ollama did not have to evaluate
+CHARS_PER_TOKEN = 4
+# Evaluated tokens a generation needs for its prompt evaluation time per token to replace a known one
+MIN_RATE_TOKENS = 16
+
+# Metadata fields of the final chunk of a generation
+STATS_FIELDS = ('prompt_eval_count', 'eval_count', 'total_duration', 'load_duration',
+                'prompt_eval_duration', 'eval_duration', 'done_reason')
+
+
+class JsonStreamCollector:
+    """
+    Collect streamed generation chunks until the first JSON object closes.
+
+    Tracks brace depth outside of string literals so the generation can be
+    stopped at the closing brace instead of waiting for the model to end it
+    (models tend to pad a JSON answer with whitespace up to num_predict).
+    A few trailing chunks are still read so the final chunk, which carries
+    Ollama's timings, is kept when the model ends right after the object.
+    """
+    def __init__(self, max_trailing_chunks=4):
+        """
+        Initialize the JsonStreamCollector class
+
+        Args:
+            max_trailing_chunks (int): Chunks read after the object closed while waiting for the final one
+        """
+        self.max_trailing_chunks = max_trailing_chunks
+        self.pieces = []
+        self.chunks = 0
+        self.final = None
+        self.closed = False
+        self._trailing = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def add(self, part):
+        """
+        Add a streamed chunk
+
+        Args:
+            part (GenerateResponse): Chunk of a streamed generate call
+
+        Returns:
+            bool: True once the JSON object is complete and the stream can be stopped
+        """
+        self.chunks += 1
+        if part.done:
+            self.final = part
+        text = part.response or ''
+        if self.closed:
+            self._trailing += 1
+            return bool(part.done) or bool(text.strip()) or self._trailing >= self.max_trailing_chunks
+        for index, char in enumerate(text):
+            if self._escape:
+                self._escape = False
+            elif self._in_string:
+                if char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = self._depth > 0
+            elif char == '{':
+                self._depth += 1
+            elif char == '}' and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.pieces.append(text[:index + 1])
+                    self.closed = True
+                    return bool(part.done) or self.max_trailing_chunks == 0
+        self.pieces.append(text)
+        return bool(part.done)
+
+    def response(self):
+        """
+        Build a response equivalent to a non-streamed generate call
+
+        Returns:
+            SimpleNamespace: Collected text from the first '{', with the final chunk's metadata if
+                the model finished on its own, or the number of chunks and done_reason 'json_closed'
+                if the stream was stopped at the closing brace
+        """
+        text = ''.join(self.pieces)
+        start = text.find('{')
+        metadata = {field: getattr(self.final, field, None) for field in STATS_FIELDS}
+        if self.final is None:
+            metadata.update(eval_count=self.chunks, done_reason='json_closed' if self.closed else None)
+        return SimpleNamespace(response=text[start:] if start >= 0 else text, **metadata)
+
 
 class OllamaLLM:
     """
     A class to handle interactions with the Ollama LLM model and SQL query validation.
     This class combines the functionality of both OllamaLLM and SQLQueryValidator.
     """
-    def __init__(self, model_name="sqls"):
+    def __init__(self, model_name="sqls", checker_model="checker", schema_provider=None,
+                 keep_alive=None, options=None, structured_output=True, prefix_priming=True):
         """
         Initialize the OllamaLLM class
 
         Args:
-            model_name (str): Name of the Ollama model to use
+            model_name (str): Name of the Ollama model used to generate SQL
+            checker_model (str): Name of the Ollama model used to validate SQL
+            schema_provider (callable, optional): Returns the schema block sent with every prompt
+            keep_alive (str or int, optional): How long Ollama keeps a model loaded after a call
+                (a duration such as '30m', or seconds with -1 meaning forever)
+            options (dict, optional): Model options sent with every call (num_ctx, num_thread, num_predict...)
+            structured_output (bool): Constrain answers with a JSON schema (requires Ollama 0.5+)
+            prefix_priming (bool): Evaluate the prompt prefix when warming up and after it changes, so that
+                requests find it in Ollama's KV cache
         """
         # Initialize the Ollama client
         self.client = ollama.Client()
         self.model = model_name
+        self.checker_model = checker_model
+        self.schema_provider = schema_provider
+        if isinstance(keep_alive, str) and keep_alive.lstrip('-').isdigit():
+            keep_alive = int(keep_alive)
+        self.keep_alive = keep_alive
+        self.options = options or None
+        self.structured_output = structured_output
+        self.prefix_priming = prefix_priming
+        # Per model: last primed prompt prefix, its token count and the prompt evaluation time per token
+        self._prefixes = {}
+        self._priming = {}
+        self._prefix_lock = threading.Lock()
+
+    def _generate_kwargs(self, model, prompt, answer_schema):
+        """Build the arguments of a streamed generate call"""
+        return {
+            'model': model,
+            'prompt': prompt,
+            'format': answer_schema if self.structured_output else None,
+            'keep_alive': self.keep_alive,
+            'options': self.options
+        }
 
-    def generate_response(self, prompt):
+    def generate_response(self, prompt, model=None, stats=None, answer_schema=None):
         """
-        Generate a response from the Ollama model
+        Generate a response from the Ollama model, stopping as soon as the JSON answer is complete
         
         Args:
             prompt (str): The input prompt to send to the model
+            model (str, optional): Model to use, defaults to the SQL generation model
+            stats (dict, optional): Filled with the generation metadata reported by Ollama
+            answer_schema (dict, optional): JSON schema the answer must follow
             
         Returns:
             dict: Parsed JSON response from the model
         """
         try:
             # Send the query to the model
-            print("Model being used: ", self.model)
-            response = self.client.generate(model=self.model, prompt=prompt)
-            
-            # Get the response text and clean it
-            resp = str(response.response).strip()
-            print("Response inside generate_response function: ", resp)
-            # Parse and return JSON response
-            return json.loads(resp)
+            model = model or self.model
+            print("Model being used: ", model)
+            collector = JsonStreamCollector()
+            stream = self.client.generate(stream=True, **self._generate_kwargs(model, prompt, answer_schema))
+            try:
+                for part in stream:
+                    if collector.add(part):
+                        break
+            finally:
+                # Closing the stream early makes Ollama stop generating
+                stream.close()
+            result = self._parse_response(collector.response(), model, stats)
+            self._prefix_stats(model, prompt, stats)
+            return result
             
         except Exception as e:
             print(f"Error generating response: {str(e)}")
             return None
 
+    @staticmethod
+    def _response_stats(model, response):
+        """
+        Extract the token counts and durations Ollama reports with a generation
+
+        Args:
+            model (str): Model that produced the response
+            response (GenerateResponse): Response returned by the Ollama client
+
+        Returns:
+            dict: Token counts, and durations converted from nanoseconds to milliseconds
+        """
+        def to_ms(nanoseconds):
+            return round(nanoseconds / 1e6, 3) if nanoseconds is not None else None
+
+        return {
+            'model': model,
+            'prompt_tokens': getattr(response, 'prompt_eval_count', None),
+            'eval_tokens': getattr(response, 'eval_count', None),
+            'total_ms': to_ms(getattr(response, 'total_duration', None)),
+            'load_ms': to_ms(getattr(response, 'load_duration', None)),
+            'prompt_eval_ms': to_ms(getattr(response, 'prompt_eval_duration', None)),
+            'eval_ms': to_ms(getattr(response, 'eval_duration', None)),
+            'done_reason': getattr(response, 'done_reason', None)
+        }
+
+    @staticmethod
+    def _parse_response(response, model=None, stats=None):
+        """
+        Parse the JSON answer out of an Ollama generate response
+
+        Args:
+            response (GenerateResponse): Response returned by the Ollama client
+            model (str, optional): Model that produced the response
+            stats (dict, optional): Filled with the generation metadata and the parse time
+
+        Returns:
+            dict: Parsed JSON response from the model
+        """
+        # Get the response text and clean it
+        resp = str(response.response).strip()
+        print("Response inside generate_response function: ", resp)
+        if stats is not None:
+            stats.update(OllamaLLM._response_stats(model, response))
+        # Parse and return JSON response
+        start = time.perf_counter()
+        try:
+            return json.loads(resp)
+        finally:
+            if stats is not None:
+                stats['parse_ms'] = round((time.perf_counter() - start) * 1000, 3)
+
+    def _load_options(self, prompt):
+        """Options of a load call, generating a single token when a prompt prefix is evaluated"""
+        if not prompt:
+            return self.options
+        return dict(self.options or {}, num_predict=1)
+
+    def _load_model(self, model, prompt=''):
+        """Ask Ollama to load a model: a generate call with an empty prompt only loads the weights"""
+        return self.client.generate(model=model, prompt=prompt, keep_alive=self.keep_alive,
+                                    options=self._load_options(prompt))
+
+    def prime_prefix(self, model):
+        """
+        Load a model and evaluate the prompt prefix, so that the next requests find it in Ollama's KV cache
+
+        Args:
+            model (str): Model to prime
+
+        Returns:
+            dict: Generation stats of the priming call, including the load time
+        """
+        prefix = self._prompt_prefix()
+        stats = self._response_stats(model, self._load_model(model, prefix))
+        if prefix and stats['prompt_tokens']:
+            # A prefix already in the KV cache (e.g. sent by a request) is only partly evaluated
+            tokens = max(stats['prompt_tokens'], len(prefix) // CHARS_PER_TOKEN)
+            with self._prefix_lock:
+                previous = self._prefixes.get(model) or {}
+                self._prefixes[model] = {'prefix': prefix, 'tokens': tokens,
+                                         'ms_per_token': previous.get('ms_per_token', 0.0)}
+                self._update_rate(self._prefixes[model], stats)
+        return stats
+
+    @staticmethod
+    def _update_rate(entry, stats):
+        """Update the prompt evaluation time per token of a prefix entry from a generation (lock must be held)"""
+        if stats.get('prompt_eval_ms') and (stats['prompt_tokens'] >= MIN_RATE_TOKENS or not entry['ms_per_token']):
+            entry['ms_per_token'] = stats['prompt_eval_ms'] / stats['prompt_tokens']
+
+    def _prime_in_background(self, model):
+        """Prime a model with the current prompt prefix in a thread, unless an attempt is recent"""
+        with self._prefix_lock:
+            if time.time() - self._priming.get(model, 0) < PREFIX_PRIMING_RETRY:
+                return
+            self._priming[model] = time.time()
+
+        def prime():
+            try:
+                stats = self.prime_prefix(model)
+                print(f"Primed the prompt prefix of {model} ({stats['prompt_tokens']} tokens evaluated)")
+            except Exception as e:
+                print(f"Error priming the prompt prefix of {model}: {str(e)}")
+
+        threading.Thread(target=prime, name=f'llm-prime-{model}', daemon=True).start()
+
+    def _prefix_stats(self, model, prompt, stats):
+        """
+        Add the prompt prefix reuse to the stats of a generation
+
+        Ollama reports in prompt_eval_count only the tokens it had to evaluate,
+        so a count below the token count of the primed prefix means the prefix
+        came from the KV cache. The time saved is estimated from the prompt
+        evaluation time per token of the latest generations.
+
+        Args:
+            model (str): Model that produced the response
+            prompt (str): Prompt sent to the model
+            stats (dict): Stats of the generation, updated in place
+        """
+        if stats is None or not stats.get('prompt_tokens'):
+            return
+        with self._prefix_lock:
+            entry = self._prefixes.get(model)
+            if entry is not None and prompt.startswith(entry['prefix']):
+                cached = stats['prompt_tokens'] < entry['tokens']
+                self._update_rate(entry, stats)
+                stats.update(
+                    prefix_tokens=entry['tokens'],
+                    prefix_cached=cached,
+                    prompt_eval_saved_ms=round(entry['tokens'] * entry['ms_per_token'], 3) if cached else 0.0
+                )
+                return
+        if entry is not None:
+            # The prefix changed since it was primed: it was evaluated again
+            stats.update(prefix_tokens=0, prefix_cached=False, prompt_eval_saved_ms=0.0)
+        # The prefix changed (schema change, restart of Ollama...) or was never primed
+        if self.prefix_priming and self.schema_provider:
+            self._prime_in_background(model)
+
+    def warm_up(self):
+        """
+        Load the SQL and checker models so the first requests do not pay for cold loads
+
+        Returns:
+            dict: Generation stats of each model, including the load time
+        """
+        results = {}
+        for model in (self.model, self.checker_model):
+            try:
+                if self.prefix_priming:
+                    results[model] = self.prime_prefix(model)
+                else:
+                    results[model] = self._response_stats(model, self._load_model(model))
+                print(f"Warmed up {model} (load {results[model]['load_ms']} ms)")
+            except Exception as e:
+                print(f"Error warming up {model}: {str(e)}")
+        return results
+
+    def embed(self, text, model_name):
+        """
+        Compute an embedding for a piece of text
+
+        Args:
+            text (str): Text to embed
+            model_name (str): Name of the Ollama embedding model to use
+
+        Returns:
+            list: Embedding vector
+        """
+        response = self.client.embed(model=model_name, input=text)
+        return list(response.embeddings[0])
+
+    def _prompt_prefix(self):
+        """Static start of every prompt: the table schema, empty without a schema provider"""
+        if not self.schema_provider:
+            return ''
+        return f"{self.schema_provider()}\n\n"
+
+    def _with_schema(self, label, body):
+        """
+        Prefix a prompt with the table schema, so the Modelfiles do not hard-code it
+
+        Everything that varies between requests comes after the schema, so that
+        after the system prompt of the Modelfile the prompts of a model share
+        the schema as a prefix, which Ollama reuses from its KV cache instead of
+        evaluating it again.
+
+        Args:
+            label (str): Label introducing the request-specific part
+            body (str): Request-specific part of the prompt
+
+        Returns:
+            str: Prompt sent to the model
+        """
+        prefix = self._prompt_prefix()
+        if not prefix:
+            return body
+        return f"{prefix}{label}: {body}"
+
+    def _initial_sql_prompt(self, user_query):
+        """Build the prompt for the SQL generation model"""
+        return self._with_schema("Question", user_query)
+
+    def _validation_prompt(self, query_object):
+        """Build the prompt for the checker model, with the query object as compact JSON"""
+        return self._with_schema("Input", json.dumps(query_object, separators=(',', ':'), ensure_ascii=False))
+
     def set_model(self, model_name):
         """
-        Change the model being used
+        Change the default model used for SQL generation
         
         Args:
             model_name (str): New model name to use
@@ -62,8 +421,22 @@ class OllamaLLM:
             dict: Response containing success status and SQL query
         """
         # Use the existing generate_response method with SQL model
-        response = self.generate_response(user_query)
-        
+        stats = {}
+        response = self.generate_response(self._initial_sql_prompt(user_query), stats=stats,
+                                          answer_schema=SQL_ANSWER_SCHEMA)
+        return dict(self._initial_sql_result(response), llm_stats=stats)
+
+    @staticmethod
+    def _initial_sql_result(response):
+        """
+        Build the generate_initial_sql result from the parsed model answer
+
+        Args:
+            response (dict): Parsed JSON response from the SQL model
+
+        Returns:
+            dict: Response containing success status and SQL query
+        """
         if not response or 'sql_ans' not in response:
             return {
                 'success': False,
@@ -114,35 +487,148 @@ class OllamaLLM:
             dict: Response containing success status and updated SQL query
         """
         try:
-            # Switch to checker model for validation
-            self.set_model("checker")
-            query_str = json.dumps(query_object)
+            query_str = self._validation_prompt(query_object)
             print("Query string: ", query_str)
-            response = self.generate_response(query_str)
-
-            print("Response: ", response)
+            stats = {}
+            response = self.generate_response(query_str, model=self.checker_model, stats=stats,
+                                              answer_schema=CHECKER_ANSWER_SCHEMA)
+            return dict(self._validation_result(response, query_object), llm_stats=stats)
             
-            if not response or 'updated_sql' not in response:
-                return {
-                    'success': False,
-                    'error': 'Failed to validate SQL query'
-                }
-                
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    @staticmethod
+    def _validation_result(response, query_object):
+        """
+        Build the validate_and_update_sql result from the parsed model answer
+
+        Args:
+            response (dict): Parsed JSON response from the checker model
+            query_object (dict): Query object that was validated
+
+        Returns:
+            dict: Response containing success status and updated SQL query
+        """
+        print("Response: ", response)
+        
+        if not response or 'updated_sql' not in response:
             return {
-                'success': True,
-                'sql_query': response['updated_sql'],
-                'initial_query': query_object['generated_sql'],
-                'comments': response['comments']
+                'success': False,
+                'error': 'Failed to validate SQL query'
             }
             
+        return {
+            'success': True,
+            'sql_query': response['updated_sql'],
+            'initial_query': query_object['generated_sql'],
+            'comments': response.get('comments', '')
+        }
+
+
+class AsyncOllamaLLM(OllamaLLM):
+    """
+    Asynchronous variant of OllamaLLM.
+
+    Generations go through a shared OllamaClientPool, and the model is passed
+    on every call rather than stored on the instance, so a single instance can
+    serve many concurrent requests.
+    """
+    def __init__(self, pool, model_name="sqls", checker_model="checker", schema_provider=None,
+                 keep_alive=None, options=None, structured_output=True, prefix_priming=True):
+        """
+        Initialize the AsyncOllamaLLM class
+
+        Args:
+            pool (OllamaClientPool): Pool used for all generate calls
+            model_name (str): Name of the Ollama model used to generate SQL
+            checker_model (str): Name of the Ollama model used to validate SQL
+            schema_provider (callable, optional): Returns the schema block sent with every prompt
+            keep_alive (str or int, optional): How long Ollama keeps a model loaded after a call
+            options (dict, optional): Model options sent with every call
+            structured_output (bool): Constrain answers with a JSON schema (requires Ollama 0.5+)
+            prefix_priming (bool): Evaluate the prompt prefix when warming up and after it changes
+        """
+        super().__init__(model_name=model_name, checker_model=checker_model, schema_provider=schema_provider,
+                         keep_alive=keep_alive, options=options, structured_output=structured_output,
+                         prefix_priming=prefix_priming)
+        self.pool = pool
+
+    def _load_model(self, model, prompt=''):
+        """Load a model through the pool, blocking until it is loaded"""
+        return self.pool.generate_sync(model=model, prompt=prompt, keep_alive=self.keep_alive,
+                                       options=self._load_options(prompt))
+
+    async def generate_response(self, prompt, model=None, stats=None, answer_schema=None):
+        """
+        Generate a response from the Ollama model, stopping as soon as the JSON answer is complete
+        
+        Args:
+            prompt (str): The input prompt to send to the model
+            model (str, optional): Model to use, defaults to the SQL generation model
+            stats (dict, optional): Filled with the generation metadata reported by Ollama
+            answer_schema (dict, optional): JSON schema the answer must follow
+            
+        Returns:
+            dict: Parsed JSON response from the model
+        """
+        try:
+            model = model or self.model
+            print("Model being used: ", model)
+            collector = JsonStreamCollector()
+            await self.pool.generate_stream(collector.add, **self._generate_kwargs(model, prompt, answer_schema))
+            result = self._parse_response(collector.response(), model, stats)
+            self._prefix_stats(model, prompt, stats)
+            return result
+
+        except OllamaPoolFullError:
+            raise
+        except Exception as e:
+            print(f"Error generating response: {str(e)}")
+            return None
+
+    async def generate_initial_sql(self, user_query):
+        """
+        Generate initial SQL query based on user's natural language query.
+        
+        Args:
+            user_query (str): Natural language query from user
+            
+        Returns:
+            dict: Response containing success status and SQL query
+        """
+        stats = {}
+        response = await self.generate_response(self._initial_sql_prompt(user_query), stats=stats,
+                                                answer_schema=SQL_ANSWER_SCHEMA)
+        return dict(self._initial_sql_result(response), llm_stats=stats)
+
+    async def validate_and_update_sql(self, query_object):
+        """
+        Validate and update SQL query based on user selections.
+        
+        Args:
+            query_object (dict): Query object containing user selections and SQL
+            
+        Returns:
+            dict: Response containing success status and updated SQL query
+        """
+        try:
+            query_str = self._validation_prompt(query_object)
+            print("Query string: ", query_str)
+            stats = {}
+            response = await self.generate_response(query_str, model=self.checker_model, stats=stats,
+                                                    answer_schema=CHECKER_ANSWER_SCHEMA)
+            return dict(self._validation_result(response, query_object), llm_stats=stats)
+
+        except OllamaPoolFullError:
+            raise
         except Exception as e:
             return {
                 'success': False,
                 'error': str(e)
             }
-        finally:
-            # Reset model back to default
-            self.set_model("sqls")
 
 # # Example usage:
 # llm = OllamaLLM()
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import ollama
+
+
+class OllamaPoolFullError(Exception):
+    """Raised when the pool's wait queue is full and a request cannot be accepted"""
+    pass
+
+
+class OllamaClientPool:
+    """
+    A bounded pool of ollama.AsyncClient instances.
+
+    The clients live on a dedicated event loop running in a background thread,
+    so they can be shared by every request thread and every per-request event
+    loop of the process. At most `size` generations are in flight at once;
+    further requests wait in FIFO order, and once `max_queue` requests are
+    waiting new ones are rejected with OllamaPoolFullError.
+    """
+    def __init__(self, host=None, size=4, max_queue=64, timeout=None):
+        """
+        Initialize the OllamaClientPool class
+
+        Args:
+            host (str, optional): Ollama server URL (defaults to OLLAMA_HOST)
+            size (int): Maximum number of concurrent generations
+            max_queue (int): Maximum number of requests waiting for a client
+            timeout (float, optional): HTTP timeout in seconds for each request
+        """
+        self.size = size
+        self.max_queue = max_queue
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='ollama-pool', daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._create_clients(host, timeout), self._loop).result()
+
+    async def _create_clients(self, host, timeout):
+        """Create the clients on the pool's own event loop"""
+        self._clients = asyncio.Queue()
+        for _ in range(self.size):
+            self._clients.put_nowait(ollama.AsyncClient(host=host, timeout=timeout))
+
+    async def _call(self, method, **kwargs):
+        """Borrow a client, run one request on it and give it back"""
+        client = await self._clients.get()
+        try:
+            return await getattr(client, method)(**kwargs)
+        finally:
+            self._clients.put_nowait(client)
+
+    async def _stream(self, on_part, **kwargs):
+        """Borrow a client and feed a streamed generation to on_part until it returns True"""
+        client = await self._clients.get()
+        try:
+            stream = await client.generate(stream=True, **kwargs)
+            try:
+                async for part in stream:
+                    if on_part(part):
+                        break
+            finally:
+                # Closing the stream early makes Ollama stop generating
+                await stream.aclose()
+        finally:
+            self._clients.put_nowait(client)
+
+    def _submit(self, call, *args, **kwargs):
+        """Schedule a request on the pool's loop, enforcing the queue limit"""
+        with self._lock:
+            if self._pending >= self.size + self.max_queue:
+                raise OllamaPoolFullError(
+                    f"Ollama pool is saturated ({self.size} in flight, {self.max_queue} queued)"
+                )
+            self._pending += 1
+        future = asyncio.run_coroutine_threadsafe(call(*args, **kwargs), self._loop)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    async def generate(self, **kwargs):
+        """
+        Run a generate request from any event loop
+
+        Args:
+            **kwargs: Arguments passed to ollama.AsyncClient.generate
+
+        Returns:
+            GenerateResponse: Response from the Ollama server
+        """
+        return await asyncio.wrap_future(self._submit(self._call, 'generate', **kwargs))
+
+    async def generate_stream(self, on_part, **kwargs):
+        """
+        Run a streamed generate request from any event loop
+
+        Args:
+            on_part (callable): Called with every chunk, on the pool's loop; returning True
+                stops the generation
+            **kwargs: Arguments passed to ollama.AsyncClient.generate
+        """
+        await asyncio.wrap_future(self._submit(self._stream, on_part, **kwargs))
+
+    def generate_sync(self, **kwargs):
+        """
+        Run a generate request from synchronous code, blocking until it completes
+
+        Args:
+            **kwargs: Arguments passed to ollama.AsyncClient.generate
+
+        Returns:
+            GenerateResponse: Response from the Ollama server
+        """
+        return self._submit(self._call, 'generate', **kwargs).result()
+
+    def stats(self):
+        """
+        Get pool statistics
+
+        Returns:
+            dict: Pool size, queue limit, and requests in flight or waiting
+        """
+        with self._lock:
+            pending = self._pending
+        return {
+            'size': self.size,
+            'max_queue': self.max_queue,
+            'in_flight': min(pending, self.size),
+            'queued': max(pending - self.size, 0)
+        }
@@ -56,13 +56,24 @@ function setupSubmitButton() {
         console.log("HI : Selected Values:", selectedValues);
         console.log("User Query:", userQuery);
 
+        // Id under which the running query can be cancelled
+        const requestId = Date.now().toString(36) + Math.random().toString(36).slice(2);
+
         // Construct JSON to send to the backend
         let data = {
             columns: selectedColumns,
             selected_values: selectedValues,
-            user_query: userQuery  // Add the user query to the data object
+            user_query: userQuery,  // Add the user query to the data object
+            request_id: requestId
         };
 
+        $('#results-container').html(`
+            <div class="alert alert-secondary d-flex justify-content-between align-items-center">
+                <span>Running query...</span>
+                <button id="cancel-query" class="btn btn-sm btn-outline-danger" data-request-id="${requestId}">Cancel</button>
+            </div>
+        `);
+
         // Send JSON data to the new Flask route
         $.ajax({
             url: '/api/submit-selections',
@@ -94,7 +105,7 @@ function setupSubmitButton() {
                         resultsHtml += `
                             <div class="card">
                                 <div class="card-header bg-light">
-                                    <h5 class="mb-0">Query Results (${response.count} rows)</h5>
+                                    <h5 class="mb-0">Query Results (<span id="results-count">${response.count}</span>${response.has_more ? '+' : ''} rows)</h5>
                                 </div>
                                 <div class="card-body">
                                     <div class="table-responsive">
@@ -111,22 +122,17 @@ function setupSubmitButton() {
                         resultsHtml += `
                                                 </tr>
                                             </thead>
-                                            <tbody>
+                                            <tbody id="results-body">
                         `;
 
                         // Add data rows
-                        response.data.forEach(row => {
-                            resultsHtml += '<tr>';
-                            response.columns.forEach(column => {
-                                resultsHtml += `<td>${row[column] || ''}</td>`;
-                            });
-                            resultsHtml += '</tr>';
-                        });
+                        resultsHtml += resultRowsHtml(response.columns, response.data);
 
                         resultsHtml += `
                                             </tbody>
                                         </table>
                                     </div>
+                                    ${loadMoreHtml(response)}
                                 </div>
                             </div>
                         `;
@@ -160,6 +166,68 @@ function setupSubmitButton() {
     });
 }
 
+function resultRowsHtml(columns, rows) {
+    let html = '';
+    rows.forEach(row => {
+        html += '<tr>';
+        columns.forEach(column => {
+            html += `<td>${row[column] || ''}</td>`;
+        });
+        html += '</tr>';
+    });
+    return html;
+}
+
+function loadMoreHtml(page) {
+    if (page.has_more) {
+        return `<button id="load-more" class="btn btn-outline-secondary mt-2" data-token="${page.next_token}">Load more rows</button>`;
+    }
+    if (page.truncated) {
+        return '<div class="text-muted mt-2">Row limit reached, refine the query to see the remaining rows.</div>';
+    }
+    return '';
+}
+
+// Stop the query of a running request
+$(document).on('click', '#cancel-query', function () {
+    $(this).prop('disabled', true);
+    $.ajax({
+        url: `/api/cancel/${$(this).data('request-id')}`,
+        method: 'POST'
+    });
+});
+
+// Fetch the next page of the results with the token of the previous one
+$(document).on('click', '#load-more', function () {
+    const button = $(this);
+    button.prop('disabled', true);
+    $.ajax({
+        url: '/api/results/next',
+        method: 'POST',
+        contentType: 'application/json',
+        data: JSON.stringify({ next_token: button.data('token') }),
+        success: function (page) {
+            $('#results-body').append(resultRowsHtml(page.columns, page.data));
+            const count = parseInt($('#results-count').text(), 10) + page.count;
+            $('#results-count').text(count);
+            if (!page.has_more) {
+                $('#results-count').parent().html(`Query Results (<span id="results-count">${count}</span> rows)`);
+            }
+            button.replaceWith(loadMoreHtml(page));
+        },
+        error: function (xhr) {
+            button.prop('disabled', false);
+            let errorMessage = 'Failed to load more rows.';
+            try {
+                errorMessage = JSON.parse(xhr.responseText).error || errorMessage;
+            } catch (e) {
+                // Keep the default message
+            }
+            showError(errorMessage);
+        }
+    });
+});
+
 function loadSchema() {
 $.ajax({
     url: '/api/schema',
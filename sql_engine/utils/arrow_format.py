@@ -0,0 +1,198 @@
+import tempfile
+from itertools import islice
+from utils.result_stream import RowLimit
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, only needed for the binary result formats
+    pa = None
+    pq = None
+
+# Binary result formats accepted by the submit endpoint
+ARROW_FORMATS = {
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+# Parquet files larger than this are spooled to a temporary file instead of memory
+PARQUET_SPOOL_SIZE = 8 * 1024 * 1024
+
+
+def arrow_available():
+    """
+    Check whether pyarrow is installed
+
+    Returns:
+        bool: True if the binary result formats can be produced
+    """
+    return pa is not None
+
+
+class _ChunkSink:
+    """File-like object collecting what the Arrow writer emits until it is drained"""
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _infer_schema(columns, batch, metadata=None):
+    """
+    Build the stream schema from the first batch of rows.
+
+    Decimals are widened to the maximum precision so later batches with larger
+    values still fit, and columns that are entirely NULL in the first batch
+    fall back to strings.
+    """
+    fields = []
+    for name, values in zip(columns, batch):
+        field_type = pa.array(values).type
+        if pa.types.is_decimal(field_type):
+            field_type = pa.decimal128(38, field_type.scale)
+        elif pa.types.is_null(field_type):
+            field_type = pa.string()
+        fields.append(pa.field(name, field_type))
+    return pa.schema(fields, metadata=metadata)
+
+
+def _to_array(values, field_type):
+    """Convert one column of a batch to the schema type"""
+    if pa.types.is_string(field_type):
+        values = [None if v is None else str(v) for v in values]
+    try:
+        return pa.array(values, type=field_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array(values).cast(field_type)
+
+
+def record_batches(columns, rows, batch_size, metadata=None):
+    """
+    Convert query result rows to Arrow record batches, one fetch at a time
+
+    Args:
+        columns (list): Column names of the result
+        rows (iterable): Rows of the result, ideally from a server-side cursor
+        batch_size (int): Number of rows per record batch
+        metadata (dict, optional): Key/value metadata attached to the schema
+
+    Yields:
+        tuple: (schema, RecordBatch) for every non-empty batch, or (schema, None)
+        once if the result has no rows
+    """
+    schema = None
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+        batch = list(zip(*chunk))
+        if schema is None:
+            schema = _infer_schema(columns, batch, metadata)
+        arrays = [_to_array(list(values), field.type) for values, field in zip(batch, schema)]
+        yield schema, pa.RecordBatch.from_arrays(arrays, schema=schema)
+    if schema is None:
+        yield pa.schema([pa.field(name, pa.string()) for name in columns], metadata=metadata), None
+
+
+def arrow_ipc_chunks(columns, result, batch_size, metadata=None, max_rows=0):
+    """
+    Encode a query result as an Arrow IPC stream, emitting bytes after each batch
+
+    When rows beyond `max_rows` are left out, the stream ends with an empty
+    record batch whose custom metadata holds truncated=true. The response is
+    already under way when a row fails to be fetched or converted, so the
+    stream then ends with an empty record batch whose custom metadata holds
+    the error, like the trailer of the JSON streams.
+
+    Args:
+        columns (list): Column names of the result
+        result (CursorResult): Query result
+        batch_size (int): Number of rows per record batch
+        metadata (dict, optional): Key/value metadata attached to the schema
+        max_rows (int): Maximum number of rows encoded, 0 for no limit
+
+    Yields:
+        bytes: Chunks of the IPC stream
+    """
+    sink = _ChunkSink()
+    writer = None
+    rows = RowLimit(result, max_rows)
+    trailer = {}
+    try:
+        for schema, batch in record_batches(columns, rows, batch_size, metadata):
+            if writer is None:
+                writer = pa.ipc.new_stream(sink, schema)
+            if batch is not None:
+                writer.write_batch(batch)
+            yield sink.drain()
+    except Exception as e:
+        print(f"Error encoding the Arrow stream: {str(e)}")
+        trailer['error'] = str(e)
+        if writer is None:
+            schema = pa.schema([pa.field(name, pa.string()) for name in columns], metadata=metadata)
+            writer = pa.ipc.new_stream(sink, schema)
+    if rows.truncated:
+        trailer['truncated'] = 'true'
+    if trailer:
+        writer.write_batch(pa.RecordBatch.from_pylist([], schema=schema), custom_metadata=trailer)
+    writer.close()
+    yield sink.drain()
+
+
+def parquet_file(columns, result, batch_size, metadata=None, max_rows=0):
+    """
+    Encode a query result as a Parquet file, one row group per batch
+
+    The file is kept in memory up to PARQUET_SPOOL_SIZE bytes and spooled to a
+    temporary file beyond, which is deleted when closed. When rows beyond
+    `max_rows` are left out, the file metadata holds truncated=true. A row
+    failing to be fetched or converted raises, with nothing sent yet.
+
+    Args:
+        columns (list): Column names of the result
+        result (CursorResult): Query result
+        batch_size (int): Number of rows per row group
+        metadata (dict, optional): Key/value metadata attached to the schema
+        max_rows (int): Maximum number of rows encoded, 0 for no limit
+
+    Returns:
+        tuple: (file object positioned at the start of the Parquet content, truncated)
+    """
+    sink = tempfile.SpooledTemporaryFile(max_size=PARQUET_SPOOL_SIZE)
+    writer = None
+    try:
+        rows = RowLimit(result, max_rows)
+        for schema, batch in record_batches(columns, rows, batch_size, metadata):
+            if writer is None:
+                writer = pq.ParquetWriter(sink, schema)
+            if batch is not None:
+                writer.write_batch(batch)
+        if rows.truncated:
+            writer.add_key_value_metadata({'truncated': 'true'})
+        writer.close()
+        sink.seek(0)
+        return sink, rows.truncated
+    except Exception:
+        # Close the writer while its sink is open, rather than when it is garbage collected
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception:
+                pass
+        sink.close()
+        raise
@@ -0,0 +1,194 @@
+import time
+import uuid
+import asyncio
+import threading
+from utils.query_cache import normalize_query, normalize_selections
+from utils.sql_text import normalize_sql
+
+
+def batch_key(item):
+    """Key under which identical questions of a batch are processed once"""
+    return normalize_query(item.get('user_query', '')) + '\n' + \
+        normalize_selections(item.get('columns', []), item.get('selected_values', {}))
+
+
+class BatchRunner:
+    """
+    Run many questions through the NL->SQL pipeline at once.
+
+    Questions with the same normalized text and selections are processed
+    once, the LLM stages of the distinct questions run concurrently up to
+    `concurrency`, and each distinct SQL statement is executed once, at most
+    `db_concurrency` at a time. Statements are told apart by their
+    whitespace-normalized text, but the SQL of the first question producing it is what
+    executes. Items hold the first page of their results only: a
+    continuation would be shared by every item of the statement, so the
+    cursor held for it is released with `discard_fn`. Batches can run inline or as background jobs
+    whose results are kept for `job_ttl` seconds in this process.
+    """
+    def __init__(self, process_fn, execute_fn, concurrency=4, db_concurrency=4, job_ttl=3600, discard_fn=None):
+        """
+        Initialize the BatchRunner class
+
+        Args:
+            process_fn (callable): Coroutine function (user_query, columns, selected_values) -> pipeline response
+            execute_fn (callable): Function (sql_query) -> query results or their first page, run in a worker thread
+            concurrency (int): Maximum number of questions in the LLM stages at once
+            db_concurrency (int): Maximum number of SQL statements executing at once
+            job_ttl (int): Seconds the results of a finished job are kept
+            discard_fn (callable, optional): Function (result) releasing what a first page holds for the next ones
+        """
+        self.process_fn = process_fn
+        self.execute_fn = execute_fn
+        self.concurrency = concurrency
+        self.db_concurrency = db_concurrency
+        self.job_ttl = job_ttl
+        self.discard_fn = discard_fn
+
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    async def run(self, items, job=None):
+        """
+        Process a batch of questions
+
+        Args:
+            items (list): Dicts with 'user_query' and optional 'columns' and 'selected_values'
+            job (dict, optional): Job record whose 'completed' counter is updated as questions finish
+
+        Returns:
+            dict: Per-item results in request order, and dedup statistics
+        """
+        start = time.time()
+        keys = [batch_key(item) for item in items]
+        unique = {}
+        for key, item in zip(keys, items):
+            unique.setdefault(key, item)
+
+        # LLM stages, one per distinct question
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def process(item):
+            async with semaphore:
+                try:
+                    return await self.process_fn(
+                        item.get('user_query', ''), item.get('columns', []), item.get('selected_values', {})
+                    )
+                except Exception as e:
+                    return {'success': False, 'error': str(e)}
+                finally:
+                    if job is not None:
+                        job['completed'] += 1
+
+        responses = dict(zip(unique, await asyncio.gather(*(process(item) for item in unique.values()))))
+
+        # Execution, one per distinct SQL statement: the normalized text is only the key, since collapsing
+        # whitespace alters string literals and runs a -- comment into the lines after it
+        statements = {}
+        for response in responses.values():
+            if response['success']:
+                statements.setdefault(normalize_sql(response['sql_query']), response['sql_query'])
+        db_semaphore = asyncio.Semaphore(self.db_concurrency)
+
+        async def execute(sql_query):
+            async with db_semaphore:
+                result = await asyncio.to_thread(self.execute_fn, sql_query)
+                if self.discard_fn and result.get('next_token'):
+                    self.discard_fn(result)
+                return result
+
+        results = dict(zip(statements, await asyncio.gather(*(execute(sql) for sql in statements.values()))))
+
+        items_out = []
+        for index, (key, item) in enumerate(zip(keys, items)):
+            response = responses[key]
+            entry = {
+                'index': index,
+                'user_query': item.get('user_query', ''),
+                'sql_query': response.get('sql_query', ''),
+                'timings': response.get('timings')
+            }
+            if not response['success']:
+                entry.update(success=False, error=response.get('error', 'Failed to process query'))
+            else:
+                result = results[normalize_sql(response['sql_query'])]
+                if result['success']:
+                    entry.update(success=True, columns=result['columns'], data=result['data'], count=result['count'],
+                                 has_more=result.get('has_more', False))
+                else:
+                    entry.update(success=False, error=result['error'])
+            items_out.append(entry)
+
+        return {
+            'results': items_out,
+            'stats': {
+                'items': len(items),
+                'unique_questions': len(unique),
+                'unique_sql': len(statements),
+                'seconds': round(time.time() - start, 3)
+            }
+        }
+
+    def _expire_jobs(self):
+        """Forget finished jobs older than the TTL (lock must be held)"""
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job['finished_at'] and now - job['finished_at'] > self.job_ttl]:
+            del self._jobs[job_id]
+
+    def submit(self, items):
+        """
+        Process a batch in a background thread
+
+        Args:
+            items (list): Questions, as for run()
+
+        Returns:
+            str: Id of the job to poll with get_job()
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'status': 'running',
+            'total': len({batch_key(item) for item in items}),
+            'completed': 0,
+            'submitted_at': time.time(),
+            'finished_at': None,
+            'result': None,
+            'error': None
+        }
+        with self._lock:
+            self._expire_jobs()
+            self._jobs[job_id] = job
+
+        def run_job():
+            try:
+                job['result'] = asyncio.run(self.run(items, job))
+                job['status'] = 'done'
+            except Exception as e:
+                job['error'] = str(e)
+                job['status'] = 'failed'
+            job['finished_at'] = time.time()
+
+        threading.Thread(target=run_job, name=f'batch-{job_id[:8]}', daemon=True).start()
+        return job_id
+
+    def get_job(self, job_id):
+        """
+        Get the state of a background job
+
+        Args:
+            job_id (str): Id returned by submit()
+
+        Returns:
+            dict: Job status and progress, with the results once done, or None if unknown
+        """
+        with self._lock:
+            self._expire_jobs()
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        state = {key: job[key] for key in ('job_id', 'status', 'total', 'completed', 'error')}
+        if job['status'] == 'done':
+            state.update(job['result'])
+        return state
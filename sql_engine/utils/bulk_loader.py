@@ -0,0 +1,286 @@
+import io
+import os
+import time
+import argparse
+from collections import Counter
+import pandas as pd
+from sqlalchemy import text
+from utils.result_cache import CHANGES_CHANNEL
+
+# CSV/Parquet column -> sampledb column
+SAMPLEDB_COLUMNS = {
+    'OrderDate': 'order_date',
+    'Region': 'region',
+    'Rep': 'rep',
+    'Item': 'item',
+    'Units': 'units',
+    'UnitCost': 'unit_cost',
+    'Total': 'total'
+}
+
+# sampledb column -> coercion kind
+SAMPLEDB_TYPES = {
+    'order_date': 'date',
+    'region': 'text',
+    'rep': 'text',
+    'item': 'text',
+    'units': 'integer',
+    'unit_cost': 'decimal',
+    'total': 'decimal'
+}
+
+SAMPLEDB_DDL = """
+    CREATE TABLE IF NOT EXISTS sampledb (
+        id SERIAL PRIMARY KEY,
+        order_date DATE,
+        region VARCHAR(50),
+        rep VARCHAR(100),
+        item VARCHAR(100),
+        units INTEGER,
+        unit_cost DECIMAL(10,2),
+        total DECIMAL(10,2)
+    );
+"""
+
+# Column descriptions stored as comments, used by the schema catalog to build the LLM prompts
+SAMPLEDB_COMMENTS = {
+    'order_date': 'Date when the order was placed',
+    'region': 'Geographic region of the sale',
+    'rep': 'Sales representative name',
+    'item': 'Product item name',
+    'units': 'Number of units ordered',
+    'unit_cost': 'Cost per unit in dollars',
+    'total': 'Total cost of the order (units * unit_cost)'
+}
+
+
+def print_progress(summary):
+    """Default progress callback printing one line per loaded chunk"""
+    rate = summary['rows'] / summary['seconds'] if summary['seconds'] else 0
+    print(f"Loaded {summary['rows']} rows in {summary['chunks']} chunks "
+          f"({summary['seconds']:.1f}s, {rate:.0f} rows/s)")
+
+
+class BulkLoader:
+    """
+    A class to bulk load CSV and Parquet files into PostgreSQL.
+
+    Files are read in chunks, coerced to the table types with vectorized
+    pandas operations and sent with COPY FROM STDIN, committing once per chunk
+    so a large load never holds a single giant transaction.
+    """
+    def __init__(self, engine, table='sampledb', column_map=None, column_types=None,
+                 chunk_size=100000, progress=print_progress):
+        """
+        Initialize the BulkLoader class
+
+        Args:
+            engine (Engine): SQLAlchemy engine of the target database
+            table (str): Target table name
+            column_map (dict, optional): Source column -> table column mapping
+            column_types (dict, optional): Table column -> 'date'/'text'/'integer'/'decimal'
+            chunk_size (int): Number of rows per chunk / transaction
+            progress (callable, optional): Called with the running summary after each chunk
+        """
+        self.engine = engine
+        self.table = table
+        self.column_map = column_map or SAMPLEDB_COLUMNS
+        self.column_types = column_types or SAMPLEDB_TYPES
+        self.chunk_size = chunk_size
+        self.progress = progress
+
+    def create_table(self):
+        """Create the sampledb table if it does not exist"""
+        with self.engine.begin() as conn:
+            conn.execute(text(SAMPLEDB_DDL))
+            if self.table == 'sampledb':
+                for column, comment in SAMPLEDB_COMMENTS.items():
+                    conn.execute(text(f"COMMENT ON COLUMN sampledb.{column} IS '{comment}'"))
+
+    def get_watermark(self, column):
+        """
+        Get the current maximum value of the watermark column
+
+        Args:
+            column (str): Watermark column, e.g. order_date
+
+        Returns:
+            Current maximum value, or None if the table is empty
+        """
+        with self.engine.connect() as conn:
+            return conn.execute(text(f"SELECT MAX({column}) FROM {self.table}")).scalar()
+
+    def _natural_key(self, row, columns):
+        """Comparable key of a row, made of all its table columns"""
+        key = []
+        for column, value in zip(columns, row):
+            kind = self.column_types[column]
+            if value is None or pd.isna(value):
+                key.append(None)
+            elif kind == 'decimal':
+                key.append(round(float(value), 2))
+            elif kind == 'integer':
+                key.append(int(value))
+            elif kind == 'text':
+                key.append(str(value))
+            else:
+                key.append(value)
+        return tuple(key)
+
+    def get_boundary_rows(self, column, watermark, columns):
+        """
+        Count the rows of the table at the watermark value, by natural key
+
+        Args:
+            column (str): Watermark column
+            watermark: Current maximum value of the watermark column
+            columns (list): Table columns making up the natural key
+
+        Returns:
+            Counter: Natural key -> number of rows already loaded
+        """
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                text(f"SELECT {', '.join(columns)} FROM {self.table} WHERE {column} = :watermark"),
+                {'watermark': watermark}
+            )
+            return Counter(self._natural_key(row, columns) for row in rows)
+
+    def _iter_chunks(self, path):
+        """Read a CSV or Parquet file in chunks of DataFrames"""
+        if path.lower().endswith('.parquet'):
+            import pyarrow.parquet as pq
+            parquet_file = pq.ParquetFile(path)
+            for batch in parquet_file.iter_batches(batch_size=self.chunk_size):
+                yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(path, chunksize=self.chunk_size)
+
+    def _coerce(self, df):
+        """
+        Rename and coerce a chunk to the table types
+
+        Args:
+            df (DataFrame): Raw chunk
+
+        Returns:
+            DataFrame: Chunk with only the table columns, in table types
+        """
+        df = df.rename(columns=self.column_map)
+        df = df[[column for column in self.column_types if column in df.columns]].copy()
+        for column in df.columns:
+            kind = self.column_types[column]
+            if kind == 'date':
+                df[column] = pd.to_datetime(df[column], errors='coerce').dt.date
+            elif kind == 'integer':
+                df[column] = pd.to_numeric(df[column], errors='coerce').round().astype('Int64')
+            elif kind == 'decimal':
+                df[column] = pd.to_numeric(df[column], errors='coerce').round(2)
+            else:
+                df[column] = df[column].astype('string').str.strip()
+        return df
+
+    def _copy_chunk(self, df):
+        """Send one chunk with COPY FROM STDIN in its own transaction, announcing the change on commit"""
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False, na_rep='')
+        buffer.seek(0)
+
+        columns = ', '.join(df.columns)
+        raw_conn = self.engine.raw_connection()
+        try:
+            cursor = raw_conn.cursor()
+            cursor.copy_expert(f"COPY {self.table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+            # Delivered to the result cache listeners only if the transaction commits
+            cursor.execute("SELECT pg_notify(%s, %s)", (CHANGES_CHANNEL, self.table))
+            raw_conn.commit()
+        except Exception:
+            raw_conn.rollback()
+            raise
+        finally:
+            raw_conn.close()
+
+    def load(self, path, mode='append', watermark_column='order_date'):
+        """
+        Load a CSV or Parquet file into the table
+
+        Args:
+            path (str): File to load
+            mode (str): 'append' loads every row, 'incremental' only rows whose
+                watermark column is at least the current maximum in the table;
+                rows at the maximum are skipped when the table already holds a
+                row with the same values, so the rest of a partially loaded day
+                (or file) is still loaded
+            watermark_column (str): Column used as watermark in incremental mode
+
+        Returns:
+            dict: Load summary with row/chunk counts, duration and the new watermark
+        """
+        start = time.time()
+        summary = {'success': True, 'path': path, 'rows': 0, 'skipped': 0, 'chunks': 0, 'seconds': 0.0}
+
+        try:
+            self.create_table()
+            watermark = self.get_watermark(watermark_column) if mode == 'incremental' else None
+            loaded = None
+
+            for chunk in self._iter_chunks(path):
+                df = self._coerce(chunk)
+                if watermark is not None:
+                    keep = df[watermark_column].notna() & (df[watermark_column] >= watermark)
+                    boundary = keep & (df[watermark_column] == watermark)
+                    if boundary.any():
+                        # Rows sharing the watermark value may already be loaded, match them one for one
+                        columns = list(df.columns)
+                        if loaded is None:
+                            loaded = self.get_boundary_rows(watermark_column, watermark, columns)
+                        for index, row in zip(df.index[boundary], df[boundary].itertuples(index=False)):
+                            key = self._natural_key(row, columns)
+                            if loaded[key] > 0:
+                                loaded[key] -= 1
+                                keep.loc[index] = False
+                    summary['skipped'] += int((~keep).sum())
+                    df = df[keep]
+                if not df.empty:
+                    self._copy_chunk(df)
+                    summary['rows'] += len(df)
+                summary['chunks'] += 1
+                summary['seconds'] = time.time() - start
+                if self.progress:
+                    self.progress(summary)
+
+            summary['watermark'] = self.get_watermark(watermark_column)
+        except Exception as e:
+            print(f"Error loading {path}: {str(e)}")
+            summary.update({'success': False, 'error': str(e)})
+
+        summary['seconds'] = time.time() - start
+        return summary
+
+
+if __name__ == '__main__':
+    # Run from sql_engine/: python -m utils.bulk_loader data.csv --mode incremental
+    from config import config
+    from utils.db_engine import get_engine
+    from utils.rollup import SalesRollup
+
+    parser = argparse.ArgumentParser(description='Bulk load CSV/Parquet files into sampledb')
+    parser.add_argument('paths', nargs='+', help='CSV or Parquet files to load')
+    parser.add_argument('--mode', choices=['append', 'incremental'], default='append')
+    parser.add_argument('--watermark-column', default='order_date')
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--no-rollup', action='store_true', help='skip refreshing the daily rollup after loading')
+    args = parser.parse_args()
+
+    settings = config[os.getenv('FLASK_CONFIG', 'default')]
+    engine = get_engine(args.database_url or settings.SQLALCHEMY_DATABASE_URI, settings.SQLALCHEMY_ENGINE_OPTIONS)
+    loader = BulkLoader(engine, chunk_size=args.chunk_size)
+    for file_path in args.paths:
+        result = loader.load(file_path, mode=args.mode, watermark_column=args.watermark_column)
+        print(result)
+    if not args.no_rollup:
+        # Aggregate the loaded rows so aggregate queries keep being answered from the rollup
+        rollup = SalesRollup(engine)
+        rollup.create()
+        print(rollup.refresh())
@@ -0,0 +1,116 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import create_engine
+
+# Engines shared by everything in the process, one per URL and pool settings
+_engines = {}
+_lock = threading.Lock()
+
+# Set while the queries of the current context must read the primary
+_primary_only = ContextVar('primary_only', default=False)
+
+
+def get_engine(url, engine_options=None):
+    """
+    Get the shared engine of a database URL, creating it on first use
+
+    Args:
+        url (str): Database URL
+        engine_options (dict, optional): create_engine keyword arguments, e.g. SQLALCHEMY_ENGINE_OPTIONS
+
+    Returns:
+        Engine: Engine whose connection pool is reused across calls
+    """
+    key = (url, tuple(sorted((engine_options or {}).items())))
+    with _lock:
+        if key not in _engines:
+            _engines[key] = create_engine(url, **(engine_options or {}))
+        return _engines[key]
+
+
+class ReplicaRouter:
+    """
+    Route read-only queries across replica databases.
+
+    connect() hands out connections from the replica engines in round-robin
+    order, so the router can be used wherever an engine is only used to
+    connect. A replica that fails to connect is skipped for
+    `retry_interval` seconds; without a reachable replica, connections come
+    from the primary. Within primary_only(), connections come from the
+    primary, for queries whose results must match what was just read there.
+    Writes (loads, DDL) keep using the primary engine.
+    """
+    def __init__(self, primary, replica_urls=(), engine_options=None, retry_interval=30):
+        """
+        Initialize the ReplicaRouter class
+
+        Args:
+            primary (Engine): Engine of the primary database
+            replica_urls (list): Database URLs of the read replicas
+            engine_options (dict, optional): create_engine keyword arguments of the replica engines
+            retry_interval (int): Seconds a failing replica is skipped
+        """
+        self.primary = primary
+        self.replicas = [get_engine(url, engine_options) for url in replica_urls]
+        self.retry_interval = retry_interval
+
+        self._next = 0
+        self._down = {}
+        self._lock = threading.Lock()
+
+    def _candidates(self):
+        """Replicas in round-robin order, skipping the ones that recently failed"""
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % max(len(self.replicas), 1)
+            now = time.time()
+            order = self.replicas[start:] + self.replicas[:start]
+            return [engine for engine in order if now - self._down.get(engine, 0) > self.retry_interval]
+
+    def connect(self):
+        """
+        Open a connection for a read-only query
+
+        Returns:
+            Connection: Connection to a replica, or to the primary if none is reachable or within primary_only()
+        """
+        if _primary_only.get():
+            return self.primary.connect()
+        for engine in self._candidates():
+            try:
+                return engine.connect()
+            except Exception as e:
+                print(f"Replica {engine.url.render_as_string(hide_password=True)} unavailable: {str(e)}")
+                with self._lock:
+                    self._down[engine] = time.time()
+        return self.primary.connect()
+
+    @contextmanager
+    def primary_only(self):
+        """Send the connections opened in the current context (thread or task) to the primary"""
+        token = _primary_only.set(True)
+        try:
+            yield self.primary
+        finally:
+            _primary_only.reset(token)
+
+    def stats(self):
+        """
+        Get the pool status of every engine
+
+        Returns:
+            dict: Pool status of the primary and of each replica, and the replicas currently skipped
+        """
+        now = time.time()
+        return {
+            'primary': self.primary.pool.status(),
+            'replicas': {
+                engine.url.render_as_string(hide_password=True): {
+                    'pool': engine.pool.status(),
+                    'available': now - self._down.get(engine, 0) > self.retry_interval
+                }
+                for engine in self.replicas
+            }
+        }
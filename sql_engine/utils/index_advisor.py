@@ -0,0 +1,416 @@
+import os
+import json
+import hashlib
+import argparse
+from collections import Counter, defaultdict
+from sqlalchemy import inspect, text
+from utils.log_reader import list_log_files, iter_log_entries
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:  # sqlglot is optional for the app, but the advisor needs it to read the logged SQL
+    sqlglot = None
+    exp = None
+
+# Longest identifier Postgres keeps
+MAX_IDENTIFIER = 63
+
+
+def _conjuncts(condition):
+    """Split a condition on its top-level ANDs"""
+    if condition is None:
+        return []
+    condition = condition.unnest()
+    if isinstance(condition, exp.And):
+        return [part.unnest() for part in condition.flatten()]
+    return [condition]
+
+
+def _sources(select):
+    """Tables read directly by a SELECT (FROM and JOINs)"""
+    source = select.args.get('from') or select.args.get('from_')
+    nodes = ([source.this] if source else []) + [join.this for join in select.args.get('joins') or []]
+    return [node for node in nodes if isinstance(node, exp.Table)]
+
+
+def extract_access(sql_query, table, columns):
+    """
+    Get the columns of a table a query filters, joins, groups and sorts on
+
+    Args:
+        sql_query (str): Logged SQL query
+        table (str): Table of interest
+        columns (set): Lowercase column names of the table
+
+    Returns:
+        dict: 'equality' maps columns compared with = or IN (or joined) to the literal they are
+            compared with (None for IN lists and joins), 'range' lists range-filtered columns,
+            'group' and 'order' the grouping and sort columns; None if the query does not read the table
+    """
+    try:
+        tree = sqlglot.parse_one(sql_query, read='postgres')
+    except Exception:
+        return None
+
+    access = {'equality': {}, 'range': [], 'group': [], 'order': []}
+    found = False
+    for select in tree.find_all(exp.Select):
+        tables = _sources(select)
+        qualifiers = {source.alias_or_name.lower() for source in tables if source.name.lower() == table}
+        if not qualifiers:
+            continue
+        found = True
+
+        def own(node):
+            node = node.unnest() if node is not None else None
+            if not isinstance(node, exp.Column) or node.name.lower() not in columns:
+                return None
+            if node.table:
+                return node.name.lower() if node.table.lower() in qualifiers else None
+            return node.name.lower()
+
+        conditions = _conjuncts((select.args.get('where') or exp.Where()).this)
+        for join in select.args.get('joins') or []:
+            conditions += _conjuncts(join.args.get('on'))
+
+        for condition in conditions:
+            if isinstance(condition, exp.EQ):
+                for column, other in ((condition.this, condition.expression), (condition.expression, condition.this)):
+                    name = own(column)
+                    if name:
+                        literal = other.sql(dialect='postgres') if isinstance(other, exp.Literal) else None
+                        access['equality'].setdefault(name, literal)
+            elif isinstance(condition, exp.In) and not condition.args.get('query'):
+                name = own(condition.this)
+                if name:
+                    access['equality'][name] = None
+            elif isinstance(condition, (exp.GT, exp.GTE, exp.LT, exp.LTE, exp.Between)):
+                for column in (condition.this, condition.args.get('expression')):
+                    name = own(column)
+                    if name and name not in access['range']:
+                        access['range'].append(name)
+
+        for column in (select.args.get('group') or exp.Group()).expressions:
+            name = own(column)
+            if name and name not in access['group']:
+                access['group'].append(name)
+        for ordered in (select.args.get('order') or exp.Order()).expressions:
+            name = own(ordered.this)
+            if name and name not in access['order']:
+                access['order'].append(name)
+
+    return access if found else None
+
+
+class IndexAdvisor:
+    """
+    Propose indexes on a table from the queries in the query log.
+
+    Each successful logged query is reduced to the columns it compares with
+    = or IN, filters by range, groups and sorts by. Queries sharing the same
+    access pattern are weighted by their count and measured database time,
+    and the heaviest patterns become index candidates: equality columns
+    first (most selective first), then a range column, or the grouping and
+    sort columns. A literal that nearly every query of a pattern compares
+    with becomes the predicate of a partial index. Every candidate is checked
+    by comparing EXPLAIN costs of sample queries with and without it, using a
+    hypothetical index when the hypopg extension is installed and otherwise
+    building it in a transaction that is rolled back.
+    """
+    def __init__(self, engine, table='sampledb', partial_share=0.9, min_improvement=0.1, sample_queries=3,
+                 lock_timeout=5000):
+        """
+        Initialize the IndexAdvisor class
+
+        Args:
+            engine (Engine): SQLAlchemy engine of the database
+            table (str): Table to propose indexes for
+            partial_share (float): Share of a pattern's weight that must use the same literal for a partial index
+            min_improvement (float): Minimum relative reduction of the EXPLAIN cost for a candidate to be accepted
+            sample_queries (int): Logged queries EXPLAINed per candidate, the slowest first
+            lock_timeout (int): Milliseconds to wait for the table lock when building a candidate to verify it
+        """
+        if sqlglot is None:
+            raise ImportError("sqlglot is required by the index advisor")
+        self.engine = engine
+        self.table = table.lower()
+        self.partial_share = partial_share
+        self.min_improvement = min_improvement
+        self.sample_queries = sample_queries
+        self.lock_timeout = lock_timeout
+
+        with self.engine.connect() as conn:
+            inspector = inspect(conn)
+            self.columns = {column['name'].lower() for column in inspector.get_columns(self.table)}
+            self.existing = [[name.lower() for name in index['column_names'] if name]
+                             for index in inspector.get_indexes(self.table)]
+            self.existing.append([name.lower() for name in
+                                  inspector.get_pk_constraint(self.table).get('constrained_columns', [])])
+            self.distinct = self._distinct_estimates(conn)
+            self.hypopg = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'hypopg'")).scalar() is not None
+
+    def _distinct_estimates(self, conn):
+        """Estimated number of distinct values of each column, from pg_stats"""
+        rows = conn.execute(text(
+            "SELECT attname, n_distinct, "
+            "(SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)) "
+            "FROM pg_stats WHERE tablename = :table"
+        ), {'table': self.table}).fetchall()
+        # Negative values are a fraction of the row count
+        return {name: (-n_distinct * max(reltuples or 0, 1) if n_distinct < 0 else n_distinct)
+                for name, n_distinct, reltuples in rows}
+
+    def _key(self, access):
+        """Index columns serving an access pattern"""
+        keys = sorted(access['equality'], key=lambda column: (-self.distinct.get(column, 0), column))
+        if access['range']:
+            return tuple(keys + access['range'][:1])
+        return tuple(keys + [column for column in access['group'] + access['order'] if column not in keys])
+
+    def analyze(self, entries):
+        """
+        Weight the columns and access patterns of the logged queries
+
+        Args:
+            entries (iterable): Query log entries
+
+        Returns:
+            dict: 'queries' analyzed, 'columns' with their count and weight, and the access 'patterns'
+        """
+        columns = defaultdict(lambda: {'count': 0, 'weight': 0.0})
+        patterns = {}
+        analyzed = 0
+        for entry in entries:
+            sql_query = entry.get('final_query')
+            if not entry.get('success') or not sql_query:
+                continue
+            access = extract_access(sql_query, self.table, self.columns)
+            if not access:
+                continue
+            analyzed += 1
+            # Queries logged without timings count as one millisecond
+            latency = float((entry.get('timings') or {}).get('db_execution') or 1.0)
+            used = set(access['equality']) | set(access['range']) | set(access['group']) | set(access['order'])
+            for column in used:
+                columns[column]['count'] += 1
+                columns[column]['weight'] += latency
+
+            key = self._key(access)
+            if not key:
+                continue
+            pattern = patterns.setdefault(key, {'count': 0, 'weight': 0.0, 'literals': defaultdict(Counter),
+                                                'queries': defaultdict(lambda: [0, 0.0])})
+            pattern['count'] += 1
+            pattern['weight'] += latency
+            for column, literal in access['equality'].items():
+                pattern['literals'][column][literal] += latency
+            pattern['queries'][sql_query][0] += 1
+            pattern['queries'][sql_query][1] += latency
+
+        return {
+            'queries': analyzed,
+            'columns': sorted(({'column': name, **stats} for name, stats in columns.items()),
+                              key=lambda item: -item['weight']),
+            'patterns': patterns
+        }
+
+    def _name(self, columns, predicate):
+        """Index name from its columns, with a hash of the predicate of partial indexes"""
+        name = f"{self.table}_{'_'.join(columns)}"
+        suffix = f"_{hashlib.sha1(predicate.encode('utf-8')).hexdigest()[:8]}_idx" if predicate else '_idx'
+        if len(name) + len(suffix) > MAX_IDENTIFIER:
+            name = name[:MAX_IDENTIFIER - len(suffix) - 9] + '_' + hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]
+        return name + suffix
+
+    def candidates(self, analysis, top=5):
+        """
+        Turn the heaviest access patterns into index candidates
+
+        Args:
+            analysis (dict): Result of analyze()
+            top (int): Maximum number of candidates
+
+        Returns:
+            list: Candidates with their columns, predicate, DDL, weight and sample queries
+        """
+        candidates = {}
+        for key, pattern in sorted(analysis['patterns'].items(), key=lambda item: -item[1]['weight']):
+            columns = list(key)
+            predicates = []
+            for column, literals in pattern['literals'].items():
+                literal, weight = literals.most_common(1)[0]
+                if literal is not None and len(columns) > 1 and weight >= self.partial_share * pattern['weight']:
+                    columns.remove(column)
+                    predicates.append(f"{column} = {literal}")
+            predicate = ' AND '.join(sorted(predicates))
+
+            # Skip indexes already served by an existing index with the same leading columns
+            if not predicate and any(existing[:len(columns)] == columns for existing in self.existing):
+                continue
+            name = self._name(columns, predicate)
+            candidate = candidates.get(name)
+            if candidate is None:
+                ddl = f"CREATE INDEX {name} ON {self.table} ({', '.join(columns)})"
+                candidate = candidates[name] = {
+                    'name': name, 'columns': columns, 'predicate': predicate or None,
+                    'ddl': ddl + (f" WHERE {predicate}" if predicate else ''),
+                    'queries': 0, 'weight': 0.0, 'samples': {}
+                }
+            candidate['queries'] += pattern['count']
+            candidate['weight'] += pattern['weight']
+            for sql_query, (_, weight) in pattern['queries'].items():
+                candidate['samples'][sql_query] = candidate['samples'].get(sql_query, 0.0) + weight
+
+        top_candidates = sorted(candidates.values(), key=lambda candidate: -candidate['weight'])[:top]
+        for candidate in top_candidates:
+            # EXPLAIN the queries that spent the most time in the database
+            slowest = sorted(candidate['samples'].items(), key=lambda item: -item[1])
+            candidate['samples'] = [sql_query for sql_query, _ in slowest[:self.sample_queries]]
+        return top_candidates
+
+    def _costs(self, conn, samples):
+        """EXPLAIN cost and plan text of each sample query, skipping the ones that fail to plan"""
+        costs = {}
+        for sql_query in samples:
+            savepoint = conn.begin_nested()
+            try:
+                plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql_query.strip().rstrip(';')}")).scalar()
+                savepoint.commit()
+                costs[sql_query] = (plan[0]['Plan']['Total Cost'], json.dumps(plan))
+            except Exception:
+                savepoint.rollback()
+        return costs
+
+    def verify(self, candidate):
+        """
+        Compare the EXPLAIN costs of a candidate's sample queries with and without the index
+
+        Args:
+            candidate (dict): Candidate from candidates(), updated in place
+
+        Returns:
+            dict: The candidate with 'cost_before', 'cost_after', 'improvement', 'uses_index',
+                'method' and 'accepted'
+        """
+        with self.engine.connect() as conn:
+            with conn.begin() as transaction:
+                before = self._costs(conn, candidate['samples'])
+                if self.hypopg:
+                    method = 'hypopg'
+                    index_name = conn.execute(
+                        text("SELECT indexname FROM hypopg_create_index(:ddl)"), {'ddl': candidate['ddl']}
+                    ).scalar()
+                else:
+                    # The build locks out writes to the table until the rollback
+                    method = 'build'
+                    index_name = candidate['name']
+                    conn.execute(text(f"SET LOCAL lock_timeout = {int(self.lock_timeout)}"))
+                    conn.execute(text(candidate['ddl']))
+                after = self._costs(conn, list(before))
+                if self.hypopg:
+                    conn.execute(text("SELECT hypopg_reset()"))
+                transaction.rollback()
+
+        measured = [sql for sql in before if sql in after]
+        cost_before = sum(before[sql][0] for sql in measured)
+        cost_after = sum(after[sql][0] for sql in measured)
+        improvement = (cost_before - cost_after) / cost_before if cost_before else 0.0
+        uses_index = any(index_name in after[sql][1] for sql in measured)
+        candidate.update({
+            'method': method,
+            'cost_before': cost_before,
+            'cost_after': cost_after,
+            'improvement': improvement,
+            'uses_index': uses_index,
+            'accepted': bool(measured) and uses_index and improvement >= self.min_improvement
+        })
+        return candidate
+
+    def create(self, candidate):
+        """
+        Create a candidate index without blocking writes
+
+        Args:
+            candidate (dict): Verified candidate
+        """
+        ddl = candidate['ddl'].replace('CREATE INDEX ', 'CREATE INDEX CONCURRENTLY IF NOT EXISTS ', 1)
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text(ddl))
+        print(f"Created index {candidate['name']}")
+
+    def advise(self, entries, top=5, create=False):
+        """
+        Analyze logged queries, verify the best candidates and optionally create the accepted ones
+
+        Args:
+            entries (iterable): Query log entries
+            top (int): Maximum number of candidates verified
+            create (bool): Create the accepted indexes
+
+        Returns:
+            dict: Number of queries analyzed, column weights and verified candidates
+        """
+        analysis = self.analyze(entries)
+        candidates = []
+        for candidate in self.candidates(analysis, top):
+            try:
+                self.verify(candidate)
+            except Exception as e:
+                print(f"Error verifying {candidate['name']}: {str(e)}")
+                candidate.update({'accepted': False, 'error': str(e)})
+            if create and candidate['accepted']:
+                self.create(candidate)
+                candidate['created'] = True
+            candidates.append(candidate)
+        return {'queries': analysis['queries'], 'columns': analysis['columns'], 'candidates': candidates}
+
+
+def print_report(report):
+    """Print the column weights and candidates of an advise() result"""
+    print(f"Analyzed {report['queries']} logged queries")
+    print("\nColumn weights (queries, database ms):")
+    for column in report['columns']:
+        print(f"  {column['column']:<12} {column['count']:>8} {column['weight']:>12.1f}")
+    print("\nIndex candidates:")
+    if not report['candidates']:
+        print("  none")
+    for candidate in report['candidates']:
+        verdict = 'accepted' if candidate['accepted'] else 'rejected'
+        if candidate.get('created'):
+            verdict = 'created'
+        print(f"  {candidate['ddl']}")
+        print(f"    {candidate['queries']} queries, {candidate['weight']:.1f} ms, {verdict}", end='')
+        if 'error' in candidate:
+            print(f" ({candidate['error']})")
+        else:
+            print(f" (cost {candidate['cost_before']:.1f} -> {candidate['cost_after']:.1f}, "
+                  f"{candidate['improvement']:.0%}, {candidate['method']})")
+
+
+if __name__ == '__main__':
+    # Run from sql_engine/: python -m utils.index_advisor --log-dir logs --since 2024-01-01
+    from config import config
+    from utils.db_engine import get_engine
+
+    parser = argparse.ArgumentParser(description='Propose indexes from the query log, verified with EXPLAIN')
+    parser.add_argument('--log-dir', default='logs')
+    parser.add_argument('--since', default=None, help='first day of logs to read, YYYY-MM-DD')
+    parser.add_argument('--until', default=None, help='last day of logs to read, YYYY-MM-DD')
+    parser.add_argument('--table', default='sampledb')
+    parser.add_argument('--top', type=int, default=5, help='maximum number of candidates')
+    parser.add_argument('--min-improvement', type=float, default=0.1, help='minimum relative EXPLAIN cost reduction')
+    parser.add_argument('--create', action='store_true', help='create the accepted indexes (CONCURRENTLY)')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--database-url', default=None)
+    args = parser.parse_args()
+
+    settings = config[os.getenv('FLASK_CONFIG', 'default')]
+    engine = get_engine(args.database_url or settings.SQLALCHEMY_DATABASE_URI, settings.SQLALCHEMY_ENGINE_OPTIONS)
+    advisor = IndexAdvisor(engine, table=args.table, min_improvement=args.min_improvement)
+    files = list_log_files(args.log_dir, args.since, args.until)
+    result = advisor.advise(iter_log_entries(files), top=args.top, create=args.create)
+    if args.json:
+        print(json.dumps(result, indent=2, default=str))
+    else:
+        print_report(result)
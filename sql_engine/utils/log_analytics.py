@@ -0,0 +1,504 @@
+import os
+import re
+import csv
+import json
+import math
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from utils.log_reader import list_log_files, open_log_file
+from utils.sql_text import normalize_sql
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, only needed for the Parquet output
+    pa = None
+    pq = None
+
+# Plain log files larger than this are split into byte ranges parsed by different processes
+CHUNK_BYTES = 64 * 1024 * 1024
+
+# Relative width of the latency histogram buckets, i.e. the error of the reported percentiles
+BUCKET_GROWTH = 1.05
+
+# Comments of the responses answered without the LLMs
+TEMPLATE_COMMENT = 'Answered by the '
+FAST_PATH_COMMENT = 'Validated locally, checker skipped'
+
+
+def error_type(error):
+    """
+    Group error messages differing only by their values
+
+    Args:
+        error (str): Logged error message
+
+    Returns:
+        str: First line of the message with quoted strings and numbers replaced by '?'
+    """
+    if not error:
+        return 'unknown'
+    message = str(error).strip().splitlines()[0]
+    message = re.sub(r"'[^']*'|\"[^\"]*\"", '?', message)
+    message = re.sub(r'\b\d+(?:\.\d+)?\b', '?', message)
+    return message[:200]
+
+
+def pipeline_path(entry):
+    """
+    Get how a logged question was answered
+
+    Args:
+        entry (dict): Log entry
+
+    Returns:
+        str: 'template', 'cache', 'fast_path', 'checker', 'failed' before the checker, or 'unknown'
+            for entries logged without stage timings
+    """
+    comments = entry.get('comments') or ''
+    if comments.startswith(TEMPLATE_COMMENT):
+        return 'template'
+    timings = entry.get('timings')
+    if timings is None:
+        return 'unknown'
+    if 'checker' in timings:
+        return 'checker'
+    if 'initial_sql' not in timings:
+        return 'cache' if entry.get('final_query') else 'failed'
+    if comments == FAST_PATH_COMMENT:
+        return 'fast_path'
+    return 'failed'
+
+
+class TopCounter:
+    """
+    Approximate counts of the most frequent values in bounded memory.
+
+    Counts are exact until `capacity` distinct values were seen; beyond, the
+    least frequent half is dropped whenever the counter holds twice the
+    capacity, so rare values may be undercounted but the frequent ones are kept.
+    """
+    def __init__(self, capacity=10000):
+        """
+        Initialize the TopCounter class
+
+        Args:
+            capacity (int): Distinct values kept after each pruning
+        """
+        self.capacity = capacity
+        self.counts = Counter()
+        self.pruned = False
+
+    def add(self, value, count=1):
+        """Count a value"""
+        self.counts[value] += count
+        if len(self.counts) >= 2 * self.capacity:
+            self._prune()
+
+    def _prune(self):
+        """Keep the `capacity` most frequent values"""
+        self.counts = Counter(dict(self.counts.most_common(self.capacity)))
+        self.pruned = True
+
+    def merge(self, other):
+        """Add the counts of another TopCounter"""
+        for value, count in other.counts.items():
+            self.add(value, count)
+        self.pruned = self.pruned or other.pruned
+
+    def most_common(self, top):
+        """Get the `top` most frequent values with their counts"""
+        return self.counts.most_common(top)
+
+
+class LatencyHistogram:
+    """
+    Durations in logarithmic buckets, mergeable and of constant size.
+
+    Percentiles are reported as the upper bound of their bucket, within
+    BUCKET_GROWTH of the exact value.
+    """
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        """Add a duration in milliseconds"""
+        ms = max(float(ms), 0.0)
+        self.buckets[math.ceil(math.log(ms, BUCKET_GROWTH)) if ms >= 0.001 else None] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def merge(self, other):
+        """Add the durations of another LatencyHistogram"""
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, share):
+        """Upper bound of the bucket holding the given share of the durations, None if empty"""
+        if not self.count:
+            return None
+        rank = share * self.count
+        seen = 0
+        zero = self.buckets.get(None, 0)
+        if zero >= rank:
+            return 0.0
+        seen += zero
+        for index in sorted(key for key in self.buckets if key is not None):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(BUCKET_GROWTH ** index, self.max)
+        return self.max
+
+
+class LogSummary:
+    """
+    Aggregates of query log entries.
+
+    Summaries of different files, or parts of a file, are built in separate
+    processes and merged; their size depends on the number of days, error
+    types and stages, and on the capacity of the question and SQL counters,
+    not on the number of entries.
+    """
+    def __init__(self, capacity=10000):
+        """
+        Initialize the LogSummary class
+
+        Args:
+            capacity (int): Distinct questions and SQL queries counted (see TopCounter)
+        """
+        self.entries = 0
+        self.failures = 0
+        self.invalid_lines = 0
+        self.checker_runs = 0
+        self.checker_modified = 0
+        self.first = None
+        self.last = None
+        self.daily = {}
+        self.errors = Counter()
+        self.paths = Counter()
+        self.questions = TopCounter(capacity)
+        self.queries = TopCounter(capacity)
+        self.latency = {}
+        self.prefix = Counter()
+        self.prompt_eval_saved_ms = 0.0
+
+    def _observe(self, name, ms):
+        """Add a duration to the latency histogram of a stage"""
+        if ms is not None:
+            self.latency.setdefault(name, LatencyHistogram()).add(ms)
+
+    def add(self, entry):
+        """
+        Add a log entry
+
+        Args:
+            entry (dict): Entry written by QueryLogger
+        """
+        self.entries += 1
+        timestamp = entry.get('timestamp') or ''
+        if timestamp:
+            self.first = min(self.first or timestamp, timestamp)
+            self.last = max(self.last or timestamp, timestamp)
+        day = self.daily.setdefault(timestamp[:10] or 'unknown', [0, 0])
+        day[0] += 1
+        if not entry.get('success'):
+            self.failures += 1
+            day[1] += 1
+            self.errors[error_type(entry.get('error'))] += 1
+
+        path = pipeline_path(entry)
+        self.paths[path] += 1
+        # Entries logged before the stage timings all went through the checker
+        if path in ('checker', 'unknown') and entry.get('initial_query') and entry.get('final_query'):
+            self.checker_runs += 1
+            if normalize_sql(entry.get('initial_query')) != normalize_sql(entry['final_query']):
+                self.checker_modified += 1
+
+        if entry.get('user_query'):
+            self.questions.add(' '.join(str(entry['user_query']).split()))
+        if entry.get('final_query'):
+            self.queries.add(normalize_sql(entry['final_query']))
+
+        timings = entry.get('timings') or {}
+        for stage, ms in timings.items():
+            self._observe(stage, ms)
+        if timings:
+            self._observe('total', sum(ms for ms in timings.values() if ms is not None))
+        for stats in entry.get('llm_stats') or []:
+            self._observe(f"llm:{stats.get('model')}", stats.get('total_ms'))
+            if stats.get('prefix_cached') is not None:
+                self.prefix['hit' if stats['prefix_cached'] else 'miss'] += 1
+                self.prompt_eval_saved_ms += stats.get('prompt_eval_saved_ms') or 0
+
+    def merge(self, other):
+        """
+        Add the aggregates of another LogSummary
+
+        Args:
+            other (LogSummary): Summary to merge into this one
+        """
+        for name in ('entries', 'failures', 'invalid_lines', 'checker_runs', 'checker_modified',
+                     'prompt_eval_saved_ms'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.first = min(filter(None, (self.first, other.first)), default=None)
+        self.last = max(filter(None, (self.last, other.last)), default=None)
+        for day, (count, failures) in other.daily.items():
+            totals = self.daily.setdefault(day, [0, 0])
+            totals[0] += count
+            totals[1] += failures
+        self.errors.update(other.errors)
+        self.paths.update(other.paths)
+        self.prefix.update(other.prefix)
+        self.questions.merge(other.questions)
+        self.queries.merge(other.queries)
+        for name, histogram in other.latency.items():
+            self.latency.setdefault(name, LatencyHistogram()).merge(histogram)
+
+    def tables(self, top=50):
+        """
+        Build the report tables
+
+        Args:
+            top (int): Rows of the question and SQL tables
+
+        Returns:
+            dict: Table name -> list of row dicts: 'summary', 'daily', 'errors', 'paths', 'questions', 'sql'
+                and 'latency'
+        """
+        def rate(part, total):
+            return round(part / total, 4) if total else None
+
+        prefix_total = self.prefix['hit'] + self.prefix['miss']
+        summary = {
+            'entries': self.entries,
+            'failures': self.failures,
+            'failure_rate': rate(self.failures, self.entries),
+            'checker_runs': self.checker_runs,
+            'checker_modified': self.checker_modified,
+            'checker_modification_rate': rate(self.checker_modified, self.checker_runs),
+            'prefix_cache_hit_rate': rate(self.prefix['hit'], prefix_total),
+            'prompt_eval_saved_ms': round(self.prompt_eval_saved_ms, 3),
+            'invalid_lines': self.invalid_lines,
+            'first_timestamp': self.first,
+            'last_timestamp': self.last,
+            'counts_approximate': self.questions.pruned or self.queries.pruned
+        }
+        latency = []
+        for name, histogram in sorted(self.latency.items()):
+            latency.append({
+                'stage': name,
+                'count': histogram.count,
+                'mean_ms': round(histogram.total / histogram.count, 3) if histogram.count else None,
+                'p50_ms': _round(histogram.percentile(0.50)),
+                'p90_ms': _round(histogram.percentile(0.90)),
+                'p95_ms': _round(histogram.percentile(0.95)),
+                'p99_ms': _round(histogram.percentile(0.99)),
+                'max_ms': round(histogram.max, 3)
+            })
+        return {
+            'summary': [{'metric': name, 'value': value} for name, value in summary.items()],
+            'daily': [{'day': day, 'entries': count, 'failures': failures, 'failure_rate': rate(failures, count)}
+                      for day, (count, failures) in sorted(self.daily.items())],
+            'errors': [{'error_type': name, 'count': count, 'share_of_entries': rate(count, self.entries)}
+                       for name, count in self.errors.most_common()],
+            'paths': [{'path': name, 'count': count, 'share': rate(count, self.entries)}
+                      for name, count in self.paths.most_common()],
+            'questions': [{'user_query': question, 'count': count}
+                          for question, count in self.questions.most_common(top)],
+            'sql': [{'sql_query': sql, 'count': count} for sql, count in self.queries.most_common(top)],
+            'latency': latency
+        }
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+def split_log_files(paths, chunk_bytes=CHUNK_BYTES):
+    """
+    Split log files into the parts parsed by the worker processes
+
+    Args:
+        paths (list): Log file paths
+        chunk_bytes (int): Size of the byte ranges plain files are split into
+
+    Returns:
+        list: (path, start, end) tuples; compressed files are read whole (end None)
+    """
+    parts = []
+    for path in paths:
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if path.endswith(('.gz', '.zst')) or size <= chunk_bytes:
+            parts.append((path, 0, None))
+            continue
+        parts.extend((path, start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes))
+    return parts
+
+
+def _iter_range(f, start, end):
+    """
+    Stream the lines starting within a byte range of a plain log file
+
+    A line belongs to the range its first byte is in, so consecutive ranges
+    read every line exactly once.
+
+    Args:
+        f (file): Log file opened in binary mode
+        start (int): First byte of the range
+        end (int): Byte following the range
+    """
+    if start:
+        # Skip the line started in the previous range, unless the range begins right after a newline
+        f.seek(start - 1)
+        f.readline()
+    while f.tell() < end:
+        line = f.readline()
+        if not line:
+            break
+        yield line
+
+
+def summarize_part(part, capacity=10000):
+    """
+    Summarize one part of a log file
+
+    Args:
+        part (tuple): (path, start, end) from split_log_files()
+        capacity (int): Distinct questions and SQL queries counted
+
+    Returns:
+        LogSummary: Aggregates of the entries of the part
+    """
+    path, start, end = part
+    summary = LogSummary(capacity)
+    try:
+        with open_log_file(path) if end is None else open(path, 'rb') as stream:
+            for line in stream if end is None else _iter_range(stream, start, end):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    # e.g. a line cut by a crash
+                    summary.invalid_lines += 1
+                    continue
+                summary.add(entry)
+    except (OSError, EOFError, ImportError) as e:
+        print(f"Error reading log file {path}: {str(e)}")
+    return summary
+
+
+def _summarize_part(args):
+    return summarize_part(*args)
+
+
+def analyze_logs(paths, workers=None, capacity=10000, chunk_bytes=CHUNK_BYTES):
+    """
+    Aggregate query log files in parallel
+
+    Args:
+        paths (list): Log file paths, e.g. from list_log_files()
+        workers (int, optional): Worker processes, defaults to the CPU count; 1 parses in this process
+        capacity (int): Distinct questions and SQL queries counted per process
+        chunk_bytes (int): Size of the byte ranges plain files are split into
+
+    Returns:
+        LogSummary: Aggregates of all entries
+    """
+    parts = split_log_files(paths, chunk_bytes)
+    summary = LogSummary(capacity)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(parts) <= 1:
+        for part in parts:
+            summary.merge(summarize_part(part, capacity))
+        return summary
+    with ProcessPoolExecutor(max_workers=min(workers, len(parts))) as executor:
+        for part_summary in executor.map(_summarize_part, [(part, capacity) for part in parts]):
+            summary.merge(part_summary)
+    return summary
+
+
+def write_tables(tables, output_dir, output_format='csv'):
+    """
+    Write report tables, one file per table
+
+    Args:
+        tables (dict): Table name -> list of row dicts, from LogSummary.tables()
+        output_dir (str): Directory to write to, created if needed
+        output_format (str): 'csv' or 'parquet' (requires pyarrow)
+
+    Returns:
+        list: Paths of the written files
+    """
+    if output_format == 'parquet' and pa is None:
+        raise ImportError("pyarrow is required for the Parquet output")
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    for name, rows in tables.items():
+        path = os.path.join(output_dir, f"{name}.{output_format}")
+        if output_format == 'parquet':
+            # Values of the summary table have mixed types
+            if name == 'summary':
+                rows = [dict(row, value=None if row['value'] is None else str(row['value'])) for row in rows]
+            pq.write_table(pa.Table.from_pylist(rows), path)
+        else:
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else [])
+                writer.writeheader()
+                writer.writerows(rows)
+        written.append(path)
+    return written
+
+
+def print_report(tables, top=10):
+    """Print the summary, error types, pipeline paths, frequent questions and latencies"""
+    for row in tables['summary']:
+        print(f"{row['metric']:<28} {row['value']}")
+    print("\nErrors:")
+    for row in tables['errors'][:top]:
+        print(f"  {row['count']:>8}  {row['error_type']}")
+    print("\nPipeline paths:")
+    for row in tables['paths']:
+        print(f"  {row['count']:>8}  {row['path']}")
+    print("\nMost frequent questions:")
+    for row in tables['questions'][:top]:
+        print(f"  {row['count']:>8}  {row['user_query']}")
+    print(f"\n  {'stage':<20} {'count':>8} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for row in tables['latency']:
+        values = (f"{row[key]:10.1f}" if row[key] is not None else f"{'-':>10}"
+                  for key in ('p50_ms', 'p95_ms', 'p99_ms'))
+        print(f"  {row['stage']:<20} {row['count']:>8} {' '.join(values)}")
+
+
+if __name__ == '__main__':
+    # Run from sql_engine/: python -m utils.log_analytics --log-dir logs --since 2024-01-01 --output reports
+    parser = argparse.ArgumentParser(description='Aggregate the query logs')
+    parser.add_argument('--log-dir', default='logs')
+    parser.add_argument('--since', default=None, help='first day of logs to read, YYYY-MM-DD')
+    parser.add_argument('--until', default=None, help='last day of logs to read, YYYY-MM-DD')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the CPU count')
+    parser.add_argument('--top', type=int, default=50, help='rows of the question and SQL tables')
+    parser.add_argument('--max-distinct', type=int, default=10000,
+                        help='distinct questions and SQL queries counted exactly per process')
+    parser.add_argument('--chunk-mb', type=int, default=CHUNK_BYTES // (1024 * 1024),
+                        help='size of the parts plain log files are split into')
+    parser.add_argument('--output', default=None, help='directory to write the tables to')
+    parser.add_argument('--format', default='csv', choices=('csv', 'parquet'))
+    args = parser.parse_args()
+
+    files = list_log_files(args.log_dir, args.since, args.until)
+    print(f"Reading {len(files)} log files from {args.log_dir}")
+    result = analyze_logs(files, args.workers, args.max_distinct, args.chunk_mb * 1024 * 1024)
+    report = result.tables(args.top)
+    print_report(report)
+    if args.output:
+        for path in write_tables(report, args.output, args.format):
+            print(f"Wrote {path}")
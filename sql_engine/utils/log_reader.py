@@ -0,0 +1,85 @@
+import io
+import os
+import re
+import glob
+import gzip
+import json
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, only needed to read .zst logs
+    zstandard = None
+
+# queries_YYYY-MM-DD.pPID.log per process, rotated files queries_YYYY-MM-DD.pPID.N.log, optionally
+# compressed; files of older versions have no .pPID part
+LOG_FILE_PATTERN = re.compile(r'^queries_(\d{4}-\d{2}-\d{2})(?:\.p(\d+))?(?:\.(\d+))?\.log(\.gz|\.zst)?$')
+
+
+def list_log_files(log_dir='logs', since=None, until=None):
+    """
+    List the query log files of a directory in chronological order
+
+    Args:
+        log_dir (str): Directory written by QueryLogger
+        since (str, optional): First day to include, YYYY-MM-DD
+        until (str, optional): Last day to include, YYYY-MM-DD
+
+    Returns:
+        list: Paths of the plain, rotated and compressed log files
+    """
+    files = []
+    for path in glob.glob(os.path.join(log_dir, 'queries_*.log*')):
+        match = LOG_FILE_PATTERN.match(os.path.basename(path))
+        if not match:
+            continue
+        day, pid, index = match.group(1), match.group(2), match.group(3)
+        if (since and day < since) or (until and day > until):
+            continue
+        # Rotated parts were written before the current file of their process
+        files.append((day, int(pid or 0), int(index) if index else float('inf'), path))
+    return [path for *_, path in sorted(files)]
+
+
+def open_log_file(path):
+    """
+    Open a log file for reading text, decompressing .gz and .zst files on the fly
+
+    Args:
+        path (str): Log file path
+
+    Returns:
+        file: Text stream of the file
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError(f"zstandard is required to read {path}")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(reader, encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def iter_log_entries(paths):
+    """
+    Stream the entries of query log files
+
+    Args:
+        paths (list): Log file paths, e.g. from list_log_files()
+
+    Yields:
+        dict: Log entries; lines that are not valid JSON (e.g. cut by a crash) are skipped
+    """
+    for path in paths:
+        try:
+            with open_log_file(path) as stream:
+                for line in stream:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+        except (OSError, EOFError, ImportError) as e:
+            print(f"Error reading log file {path}: {str(e)}")
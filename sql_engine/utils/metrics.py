@@ -0,0 +1,231 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Default latency buckets in seconds, from cache hits to slow CPU-only generations
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# A generation whose model load took longer than this had to read the weights, i.e. the model was not loaded
+COLD_LOAD_THRESHOLD_MS = 250
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list((extra or {}).items())
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    """Base class of the metrics rendered in the Prometheus text format"""
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self):
+        return []
+
+
+class Counter(_Metric):
+    """A monotonically increasing counter"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+                    for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """A value read from a callback at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labelnames=(), callback=None):
+        """
+        Args:
+            callback (callable): Returns a number, or a dict of label value tuples -> number
+        """
+        super().__init__(name, help_text, labelnames)
+        self.callback = callback
+
+    def _samples(self):
+        try:
+            values = self.callback()
+        except Exception:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    """A cumulative histogram with fixed buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # [bucket counts, sum, count]
+            state = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labelnames, key, {'le': bound})
+                    samples.append(f"{self.name}_bucket{labels} {bucket_count}")
+                samples.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, {'le': '+Inf'})} {count}")
+                samples.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                samples.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return samples
+
+
+class MetricsRegistry:
+    """
+    A minimal in-process metrics registry rendering the Prometheus text format.
+
+    Metrics are per process: with several gunicorn workers every worker
+    exposes its own values and Prometheus aggregates them across scrapes.
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Render every registered metric
+
+        Returns:
+            str: Metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'nl2sql_stage_seconds', 'Duration of each stage of a request', ['stage']))
+LLM_SECONDS = REGISTRY.register(Histogram(
+    'nl2sql_llm_seconds', 'Durations reported by Ollama for each generation', ['model', 'phase']))
+LLM_TOKENS = REGISTRY.register(Counter(
+    'nl2sql_llm_tokens_total', 'Tokens processed by Ollama', ['model', 'kind']))
+LLM_COLD_LOADS = REGISTRY.register(Counter(
+    'nl2sql_llm_cold_loads_total', 'Generations that had to load the model first (startup or eviction)', ['model']))
+LLM_PREFIX_CACHE = REGISTRY.register(Counter(
+    'nl2sql_llm_prefix_cache_total', 'Generations whose prompt prefix was reused from the KV cache, or evaluated',
+    ['model', 'result']))
+LLM_PROMPT_EVAL_SAVED = REGISTRY.register(Counter(
+    'nl2sql_llm_prompt_eval_saved_seconds_total', 'Estimated prompt evaluation time saved by prefix reuse', ['model']))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'nl2sql_cache_lookups_total', 'NL->SQL cache lookups by result', ['result']))
+RESULT_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'nl2sql_result_cache_lookups_total', 'Query result cache lookups by result', ['result']))
+TEMPLATE_MATCHES = REGISTRY.register(Counter(
+    'nl2sql_template_matches_total', 'Questions answered by a SQL template, or left to the LLMs', ['result']))
+SPECULATIVE_QUERIES = REGISTRY.register(Counter(
+    'nl2sql_speculative_queries_total', 'Queries run while the checker model ran, by whether their results were used',
+    ['result']))
+CHECKER_DECISIONS = REGISTRY.register(Counter(
+    'nl2sql_checker_decisions_total', 'Generated queries that skipped or went through the checker model',
+    ['decision']))
+QUERY_GUARD = REGISTRY.register(Counter(
+    'nl2sql_query_guard_total', 'Generated queries checked by the query guard, by outcome', ['outcome']))
+ROLLUP_REWRITES = REGISTRY.register(Counter(
+    'nl2sql_rollup_rewrites_total', 'Executed queries answered from the rollup, or why they were not', ['result']))
+DB_ROWS = REGISTRY.register(Histogram(
+    'nl2sql_db_rows', 'Rows returned per executed query', buckets=ROW_BUCKETS))
+REQUESTS = REGISTRY.register(Counter(
+    'nl2sql_requests_total', 'Submitted questions by outcome', ['outcome']))
+
+
+def record_llm_stats(stats):
+    """
+    Report the metadata of one Ollama generation
+
+    Args:
+        stats (dict): Stats built by OllamaLLM from the generate response
+    """
+    if not stats:
+        return
+    model = stats.get('model', '')
+    for phase in ('total', 'load', 'prompt_eval', 'eval'):
+        if stats.get(f'{phase}_ms') is not None:
+            LLM_SECONDS.observe(stats[f'{phase}_ms'] / 1000.0, model=model, phase=phase)
+    if (stats.get('load_ms') or 0) >= COLD_LOAD_THRESHOLD_MS:
+        LLM_COLD_LOADS.inc(model=model)
+    LLM_TOKENS.inc(stats.get('prompt_tokens') or 0, model=model, kind='prompt')
+    LLM_TOKENS.inc(stats.get('eval_tokens') or 0, model=model, kind='eval')
+    if stats.get('prefix_cached') is not None:
+        LLM_PREFIX_CACHE.inc(model=model, result='hit' if stats['prefix_cached'] else 'miss')
+        LLM_PROMPT_EVAL_SAVED.inc((stats.get('prompt_eval_saved_ms') or 0) / 1000.0, model=model)
+
+
+class StageTimer:
+    """
+    Collect the stage durations of one request.
+
+    Durations are kept in milliseconds in `timings` (for the response and the
+    query log) and observed in the stage histogram.
+    """
+    def __init__(self, histogram=STAGE_SECONDS):
+        self.histogram = histogram
+        self.timings = {}
+
+    def record(self, stage, seconds):
+        """
+        Record the duration of a stage, adding to it if the stage ran before
+
+        Args:
+            stage (str): Stage name
+            seconds (float): Duration in seconds
+        """
+        self.timings[stage] = round(self.timings.get(stage, 0) + seconds * 1000, 3)
+        if self.histogram:
+            self.histogram.observe(seconds, stage=stage)
+
+    @contextmanager
+    def stage(self, stage):
+        """Time the enclosed block as the given stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
@@ -0,0 +1,371 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from utils.result_stream import json_default, execute_streaming
+from utils.query_guard import QueryRejectedError
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:  # sqlglot is optional, without it every result is paged with a held cursor
+    sqlglot = None
+    exp = None
+
+# Prefix of the key columns added to a query only to build the next page token
+HIDDEN_KEY_PREFIX = '_page_key_'
+
+
+class PageTokenError(Exception):
+    """Raised when a continuation token is invalid, expired or already used"""
+    pass
+
+
+def _token_value(value):
+    """Store a key value of the last row in a JSON token"""
+    return value if isinstance(value, int) else json_default(value)
+
+
+def _literal(value):
+    """Render a key value of the last row as a SQL literal"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return exp.Literal.number(value)
+    # Untyped string literals are coerced by Postgres to the type of the compared column
+    return exp.Literal.string(json_default(value))
+
+
+class Paginator:
+    """
+    Split query results into pages with opaque continuation tokens.
+
+    Plain single-table SELECTs are paged with keyset pagination: the query is
+    ordered by its ORDER BY columns (when they are NOT NULL and sorted in one
+    direction) followed by the primary key, each page is fetched with a
+    LIMIT, and the token carries the key values of the last row, so every
+    page is a new, index-friendly and cacheable query. Other queries (joins,
+    aggregates, DISTINCT, LIMIT, ...) run once with a server-side cursor that
+    fetches one row more than the page: the cursor is closed when the results
+    fit in the page, and held open in this process between pages otherwise.
+    At most `max_rows` rows are returned across all pages of a query.
+
+    Tokens are signed with the application secret key and expire after
+    `token_ttl` seconds; held cursors are closed after `cursor_idle` seconds
+    without a request, by a background thread started with start().
+    """
+    def __init__(self, engine, schema_catalog, secret_key, execute_fn, page_size=1000, max_rows=100000,
+                 token_ttl=3600, max_cursors=8, cursor_idle=300, guard=None):
+        """
+        Initialize the Paginator class
+
+        Args:
+            engine (Engine): Engine, or ReplicaRouter, the held cursors are opened from
+            schema_catalog (SchemaCatalog): Source of primary keys and column nullability
+            secret_key (str): Key signing the continuation tokens
+            execute_fn (callable): Function (sql_query) -> query results, used for keyset pages
+            page_size (int): Default and maximum number of rows per page
+            max_rows (int): Maximum number of rows returned across all pages of a query
+            token_ttl (int): Seconds a continuation token stays valid
+            max_cursors (int): Maximum number of cursors held open, the least recently used is closed first
+            cursor_idle (int): Seconds after which an unused held cursor is closed
+            guard (QueryGuard, optional): Guard applied to the transactions of held cursors
+        """
+        self.engine = engine
+        self.schema_catalog = schema_catalog
+        self.execute_fn = execute_fn
+        self.page_size = page_size
+        self.max_rows = max_rows
+        self.token_ttl = token_ttl
+        self.max_cursors = max_cursors
+        self.cursor_idle = cursor_idle
+        self.guard = guard
+        self.serializer = URLSafeTimedSerializer(secret_key, salt='result-page')
+
+        self._cursors = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    # Keyset pagination
+
+    def _output_name(self, tree, column):
+        """Get the name under which the query returns a column, or None if it does not"""
+        for projection in tree.expressions:
+            if isinstance(projection, exp.Star):
+                return column
+            if isinstance(projection, exp.Column) and projection.name.lower() == column:
+                return projection.output_name
+            if isinstance(projection, exp.Alias) and isinstance(projection.this, exp.Column) \
+                    and projection.this.name.lower() == column:
+                return projection.alias
+        return None
+
+    def keyset_plan(self, sql_query):
+        """
+        Check whether a query can be paged with keyset pagination
+
+        Args:
+            sql_query (str): SQL query
+
+        Returns:
+            dict: Ordered 'query' tree, 'keys' as (column, output name) pairs, sort direction
+                and 'hidden' output names, or None if the query needs a held cursor
+        """
+        if sqlglot is None:
+            return None
+        try:
+            statements = sqlglot.parse(sql_query.strip().rstrip(';'), read='postgres')
+        except Exception:
+            return None
+        if len(statements) != 1 or not isinstance(statements[0], exp.Select):
+            return None
+        tree = statements[0]
+        if any(tree.args.get(arg) for arg in ('with', 'joins', 'group', 'having', 'distinct', 'limit', 'offset',
+                                               'windows')):
+            return None
+        if any(projection.find(exp.AggFunc, exp.Window) for projection in tree.expressions):
+            return None
+        source = tree.args.get('from') or tree.args.get('from_')  # 'from_' in newer sqlglot releases
+        if source is None or not isinstance(source.this, exp.Table):
+            return None
+
+        table = self.schema_catalog.snapshot()['tables'].get(source.this.name.lower())
+        if not table or len(table['primary_key']) != 1:
+            return None
+        primary_key = table['primary_key'][0].lower()
+        not_null = {col['name'].lower() for col in table['columns'] if not col['nullable']} | {primary_key}
+
+        order = tree.args.get('order')
+        ordered = order.expressions if order else []
+        directions = {bool(item.args.get('desc')) for item in ordered}
+        if len(directions) > 1:
+            return None
+        key_columns = []
+        for item in ordered:
+            if not isinstance(item.this, exp.Column) or item.this.name.lower() not in not_null:
+                return None
+            key_columns.append(item.this.name.lower())
+        if primary_key not in key_columns:
+            key_columns.append(primary_key)
+        descending = directions == {True}
+
+        query = tree.copy()
+        keys, hidden = [], []
+        for i, column in enumerate(key_columns):
+            name = self._output_name(query, column)
+            if name is None:
+                name = f"{HIDDEN_KEY_PREFIX}{i}"
+                query = query.select(exp.alias_(exp.column(column), name), copy=False)
+                hidden.append(name)
+            keys.append((column, name))
+        query = query.order_by(
+            *(exp.Ordered(this=exp.column(column), desc=descending, nulls_first=descending) for column in key_columns),
+            append=False, copy=False
+        )
+        return {'query': query, 'keys': keys, 'descending': descending, 'hidden': hidden}
+
+    def _keyset_sql(self, plan, after, limit):
+        """Render the query of the page following the key values `after`"""
+        query = plan['query'].copy()
+        if after is not None:
+            columns = [exp.column(column) for column, _ in plan['keys']]
+            values = [_literal(value) for value in after]
+            left, right = (columns[0], values[0]) if len(columns) == 1 else \
+                (exp.Tuple(expressions=columns), exp.Tuple(expressions=values))
+            condition = exp.LT(this=left, expression=right) if plan['descending'] else \
+                exp.GT(this=left, expression=right)
+            query = query.where(condition, copy=False)
+        return query.limit(limit, copy=False).sql(dialect='postgres')
+
+    def _keyset_page(self, sql_query, plan, after, served, page_size):
+        """Fetch one keyset page and build its continuation token"""
+        limit = min(page_size, self.max_rows - served)
+        result = self.execute_fn(self._keyset_sql(plan, after, limit + 1))
+        if not result['success']:
+            return result
+        rows = result['data'][:limit]
+        more = len(result['data']) > limit
+        state = None
+        if more and served + limit < self.max_rows:
+            state = {
+                'mode': 'keyset',
+                'sql': sql_query,
+                'after': [_token_value(rows[-1][name]) for _, name in plan['keys']],
+                'served': served + len(rows),
+                'page_size': page_size
+            }
+        if plan['hidden']:
+            rows = [{k: v for k, v in row.items() if k not in plan['hidden']} for row in rows]
+        columns = [column for column in result['columns'] if column not in plan['hidden']]
+        return self._page(columns, rows, state, truncated=more and state is None)
+
+    # Held cursor pagination
+
+    def _close_cursor(self, entry):
+        try:
+            if self.guard:
+                self.guard.release(entry['conn'])
+            entry['conn'].close()
+        except Exception:
+            pass
+
+    def _expire_cursors(self, reserve=0):
+        """Close idle cursors and the least recently used ones above the limit less `reserve` (lock must be held)"""
+        now = time.time()
+        for cursor_id in [cursor_id for cursor_id, entry in self._cursors.items()
+                          if now - entry['used_at'] > self.cursor_idle]:
+            self._close_cursor(self._cursors.pop(cursor_id))
+        while self._cursors and len(self._cursors) > self.max_cursors - reserve:
+            _, entry = self._cursors.popitem(last=False)
+            self._close_cursor(entry)
+
+    def _cursor_page(self, entry, cursor_id, served, page_size):
+        """Fetch one page from a held cursor, keeping the cursor open if rows remain"""
+        limit = min(page_size, self.max_rows - served)
+        rows = entry['lookahead'] + entry['result'].fetchmany(limit + 1 - len(entry['lookahead']))
+        more = len(rows) > limit
+        state = None
+        if more and served + limit < self.max_rows:
+            entry.update(lookahead=rows[limit:], position=served + limit, used_at=time.time())
+            with self._lock:
+                self._expire_cursors(reserve=1)
+                self._cursors[cursor_id] = entry
+            state = {'mode': 'cursor', 'cursor_id': cursor_id, 'served': served + limit, 'page_size': page_size}
+        else:
+            self._close_cursor(entry)
+        data = [dict(zip(entry['columns'], row)) for row in rows[:limit]]
+        return self._page(entry['columns'], data, state, truncated=more and state is None)
+
+    def _open_cursor(self, sql_query, page_size):
+        """Execute a query with a server-side cursor and fetch its first page"""
+        conn = None
+        try:
+            conn = self.engine.connect()
+            if self.guard:
+                self.guard.begin(conn, sql_query)
+            result = execute_streaming(conn, sql_query, page_size + 1)
+            entry = {'conn': conn, 'result': result, 'columns': list(result.keys()), 'lookahead': []}
+            return self._cursor_page(entry, uuid.uuid4().hex, 0, page_size)
+        except Exception as e:
+            if conn is not None:
+                self._close_cursor({'conn': conn})
+            return self._error(e)
+
+    def _error(self, error):
+        """Build the error result of a failed held cursor query"""
+        if self.guard and not isinstance(error, QueryRejectedError):
+            error = self.guard.translate_error(error)
+        print(f"Error executing query: {str(error)}")
+        result = {'success': False, 'error': str(error)}
+        if isinstance(error, QueryRejectedError):
+            result['rejected'] = error.reason
+        return result
+
+    # Public API
+
+    def _page(self, columns, data, state, truncated=False):
+        return {
+            'success': True,
+            'columns': columns,
+            'data': data,
+            'count': len(data),
+            'has_more': state is not None,
+            'next_token': self.serializer.dumps(state) if state else None,
+            'truncated': truncated
+        }
+
+    def first_page(self, sql_query, page_size=None):
+        """
+        Execute a query and return its first page
+
+        Args:
+            sql_query (str): SQL query
+            page_size (int, optional): Rows per page, capped at the configured page size
+
+        Returns:
+            dict: Query results with 'has_more', 'next_token' and 'truncated' (max_rows reached), or an error
+        """
+        page_size = min(page_size or self.page_size, self.page_size)
+        plan = self.keyset_plan(sql_query)
+        if plan is not None:
+            return self._keyset_page(sql_query, plan, None, 0, page_size)
+
+        # The cursor is only held when a row remains past the page
+        return self._open_cursor(sql_query, page_size)
+
+    def next_page(self, token):
+        """
+        Return the page following a continuation token
+
+        Args:
+            token (str): 'next_token' of the previous page
+
+        Returns:
+            dict: Query results as for first_page()
+
+        Raises:
+            PageTokenError: If the token is invalid, expired or its cursor is gone
+        """
+        try:
+            state = self.serializer.loads(token, max_age=self.token_ttl)
+        except SignatureExpired:
+            raise PageTokenError('Page token expired')
+        except BadSignature:
+            raise PageTokenError('Invalid page token')
+
+        if state['mode'] == 'keyset':
+            plan = self.keyset_plan(state['sql'])
+            if plan is None:
+                raise PageTokenError('Invalid page token')
+            return self._keyset_page(state['sql'], plan, state['after'], state['served'], state['page_size'])
+
+        with self._lock:
+            self._expire_cursors()
+            entry = self._cursors.get(state['cursor_id'])
+            if entry is None:
+                raise PageTokenError('Page token expired, run the query again')
+            if entry['position'] != state['served']:
+                raise PageTokenError('Page token already used')
+            del self._cursors[state['cursor_id']]
+        try:
+            return self._cursor_page(entry, state['cursor_id'], state['served'], state['page_size'])
+        except Exception as e:
+            self._close_cursor(entry)
+            return self._error(e)
+
+    def discard(self, page):
+        """
+        Close the cursor held for the following pages of a page that will not be returned
+
+        Args:
+            page (dict): Result of first_page() or next_page()
+        """
+        if not page.get('next_token'):
+            return
+        state = self.serializer.loads(page['next_token'])
+        if state['mode'] != 'cursor':
+            return
+        with self._lock:
+            entry = self._cursors.pop(state['cursor_id'], None)
+        if entry is not None:
+            self._close_cursor(entry)
+
+    def stats(self):
+        """Get the number of cursors held open"""
+        with self._lock:
+            self._expire_cursors()
+            return {'held_cursors': len(self._cursors)}
+
+    def _run(self):
+        while True:
+            time.sleep(max(1, self.cursor_idle / 2))
+            try:
+                with self._lock:
+                    self._expire_cursors()
+            except Exception as e:
+                print(f"Error closing idle cursors: {str(e)}")
+
+    def start(self):
+        """Start closing idle cursors in a background thread, even when no further page is requested"""
+        if self._thread is None and self.cursor_idle > 0:
+            self._thread = threading.Thread(target=self._run, name='cursor-reaper', daemon=True)
+            self._thread.start()
@@ -0,0 +1,307 @@
+import os
+import re
+import json
+import math
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+def modelfile_fingerprint(model_files):
+    """
+    Build a fingerprint of the models used by the LLM pipeline
+
+    Args:
+        model_files (dict): Mapping of model name to its Modelfile path
+
+    Returns:
+        str: Hash of the model names and the content of their Modelfiles
+    """
+    digest = hashlib.sha256()
+    for model_name in sorted(model_files):
+        digest.update(model_name.encode('utf-8'))
+        path = model_files[model_name]
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def normalize_query(user_query):
+    """
+    Normalize a natural language query so trivial differences share a cache entry
+
+    Args:
+        user_query (str): Natural language query
+
+    Returns:
+        str: Lowercased query with collapsed whitespace and no trailing punctuation
+    """
+    normalized = re.sub(r'\s+', ' ', (user_query or '').strip().lower())
+    return normalized.rstrip(' ?.!;')
+
+
+def normalize_selections(columns, selected_values):
+    """
+    Normalize the user selections so their order does not matter
+
+    Args:
+        columns (list): Selected columns
+        selected_values (dict): Selected filter values
+
+    Returns:
+        str: Canonical JSON representation of the selections
+    """
+    values = {}
+    for column, value in (selected_values or {}).items():
+        if isinstance(value, (list, tuple)):
+            values[column] = sorted(str(v) for v in value)
+        else:
+            values[column] = str(value).strip()
+    return json.dumps({'columns': sorted(columns or []), 'selected_values': values}, sort_keys=True)
+
+
+class QueryCache:
+    """
+    A cache in front of the two-stage NL->SQL LLM pipeline.
+
+    Entries are keyed on the normalized user query, the user selections and a
+    fingerprint of the models. The cache keeps the most recently used entries
+    in memory with a TTL, can mirror them to a SQLite file so they survive
+    restarts, and can fall back to an embedding similarity lookup for
+    near-duplicate phrasings of a question with identical selections.
+    """
+    def __init__(self, max_entries=512, ttl_seconds=3600, db_path=None, fingerprint='',
+                 embed_fn=None, similarity_threshold=0.97):
+        """
+        Initialize the QueryCache class
+
+        Args:
+            max_entries (int): Maximum number of entries kept (LRU eviction)
+            ttl_seconds (int): Seconds after which an entry expires
+            db_path (str, optional): SQLite file used as the on-disk backing store
+            fingerprint (str or callable): Model fingerprint mixed into every key, or a
+                function returning it when it can change at runtime (e.g. with the schema)
+            embed_fn (callable, optional): Function returning an embedding for a text
+            similarity_threshold (float): Minimum cosine similarity for a semantic hit
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.fingerprint = fingerprint
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+
+        self._entries = OrderedDict()
+        self._embeddings = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            self._open_store()
+
+    def _open_store(self):
+        """Open the SQLite backing store and load the live entries into memory"""
+        directory = os.path.dirname(self.db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_cache (
+                key TEXT PRIMARY KEY,
+                selection_key TEXT,
+                normalized_query TEXT,
+                embedding TEXT,
+                response TEXT,
+                created_at REAL
+            )
+        """)
+        self._conn.execute("DELETE FROM query_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        self._conn.commit()
+
+        rows = self._conn.execute("""
+            SELECT key, selection_key, normalized_query, embedding, response, created_at
+            FROM query_cache ORDER BY created_at DESC LIMIT ?
+        """, (self.max_entries,)).fetchall()
+        for key, selection_key, normalized_query, embedding, response, created_at in reversed(rows):
+            self._entries[key] = {
+                'selection_key': selection_key,
+                'normalized_query': normalized_query,
+                'embedding': json.loads(embedding) if embedding else None,
+                'response': json.loads(response),
+                'created_at': created_at
+            }
+
+    def _selection_key(self, columns, selected_values):
+        """Hash of the selections and model fingerprint shared by exact and semantic lookups"""
+        fingerprint = self.fingerprint() if callable(self.fingerprint) else self.fingerprint
+        raw = fingerprint + normalize_selections(columns, selected_values)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _make_key(self, normalized_query, selection_key):
+        """Build the exact-match cache key"""
+        return hashlib.sha256(f"{selection_key}:{normalized_query}".encode('utf-8')).hexdigest()
+
+    def _embedding_for(self, normalized_query):
+        """
+        Get the embedding of a normalized query, memoizing recent ones so a miss
+        followed by a set only pays for one embedding call
+        """
+        if not self.embed_fn:
+            return None
+        with self._lock:
+            if normalized_query in self._embeddings:
+                self._embeddings.move_to_end(normalized_query)
+                return self._embeddings[normalized_query]
+        # The embedding call is slow, it runs without the lock
+        try:
+            embedding = self.embed_fn(normalized_query)
+        except Exception as e:
+            print(f"Error computing query embedding: {str(e)}")
+            return None
+        with self._lock:
+            self._embeddings[normalized_query] = embedding
+            self._embeddings.move_to_end(normalized_query)
+            if len(self._embeddings) > 64:
+                self._embeddings.popitem(last=False)
+        return embedding
+
+    def _is_expired(self, entry):
+        return time.time() - entry['created_at'] > self.ttl_seconds
+
+    def _delete(self, key):
+        """Remove an entry from memory and the backing store (lock must be held)"""
+        self._entries.pop(key, None)
+        if self._conn:
+            self._conn.execute("DELETE FROM query_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    @staticmethod
+    def _cosine_similarity(a, b):
+        dot = sum(x * y for x, y in zip(a, b))
+        norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+        return dot / norm if norm else 0.0
+
+    def _find_similar(self, normalized_query, selection_key, embedding):
+        """
+        Find the most similar live entry with the same selections (lock must be held).
+        Numbers in the query (years, top-N) must match exactly, since embeddings
+        barely distinguish "top 3" from "top 5".
+        """
+        numbers = re.findall(r'\d+', normalized_query)
+        best_key, best_score = None, self.similarity_threshold
+        for key, entry in self._entries.items():
+            if entry['selection_key'] != selection_key or not entry['embedding']:
+                continue
+            if self._is_expired(entry) or re.findall(r'\d+', entry['normalized_query']) != numbers:
+                continue
+            score = self._cosine_similarity(embedding, entry['embedding'])
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def get(self, user_query, columns, selected_values):
+        """
+        Look up a cached pipeline response
+
+        Args:
+            user_query (str): Natural language query
+            columns (list): Selected columns
+            selected_values (dict): Selected filter values
+
+        Returns:
+            dict: Cached response with a 'cache' key ('exact' or 'semantic'), or None on a miss
+        """
+        normalized_query = normalize_query(user_query)
+        selection_key = self._selection_key(columns, selected_values)
+        key = self._make_key(normalized_query, selection_key)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self._is_expired(entry):
+                self._delete(key)
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry['response'], cache='exact')
+
+        embedding = self._embedding_for(normalized_query)
+        with self._lock:
+            if embedding:
+                similar_key = self._find_similar(normalized_query, selection_key, embedding)
+                if similar_key:
+                    self._entries.move_to_end(similar_key)
+                    self.semantic_hits += 1
+                    return dict(self._entries[similar_key]['response'], cache='semantic')
+            self.misses += 1
+        return None
+
+    def set(self, user_query, columns, selected_values, response):
+        """
+        Store a successful pipeline response
+
+        Args:
+            user_query (str): Natural language query
+            columns (list): Selected columns
+            selected_values (dict): Selected filter values
+            response (dict): Response returned by the LLM pipeline
+        """
+        normalized_query = normalize_query(user_query)
+        selection_key = self._selection_key(columns, selected_values)
+        key = self._make_key(normalized_query, selection_key)
+        embedding = self._embedding_for(normalized_query)
+        entry = {
+            'selection_key': selection_key,
+            'normalized_query': normalized_query,
+            'embedding': embedding,
+            'response': {k: v for k, v in response.items() if k != 'cache'},
+            'created_at': time.time()
+        }
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if self._conn:
+                self._conn.execute("""
+                    INSERT OR REPLACE INTO query_cache
+                    (key, selection_key, normalized_query, embedding, response, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (key, selection_key, normalized_query,
+                      json.dumps(embedding) if embedding else None,
+                      json.dumps(entry['response'], default=str), entry['created_at']))
+                self._conn.commit()
+            while len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._delete(oldest_key)
+
+    def clear(self):
+        """Remove every entry from the cache"""
+        with self._lock:
+            self._entries.clear()
+            self._embeddings.clear()
+            if self._conn:
+                self._conn.execute("DELETE FROM query_cache")
+                self._conn.commit()
+
+    def stats(self):
+        """
+        Get cache statistics
+
+        Returns:
+            dict: Entry count, hit/miss counters and hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.semantic_hits) / lookups if lookups else 0.0
+            }
@@ -0,0 +1,219 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import text
+
+# Id of the request being served, set by the views so that its queries can be cancelled
+current_request_id = ContextVar('current_request_id', default=None)
+
+# SQLSTATE of statements stopped by statement_timeout or pg_cancel_backend
+QUERY_CANCELED = '57014'
+
+
+class QueryRejectedError(Exception):
+    """Raised when the guard refuses or stops a query: 'cost', 'rows', 'timeout' or 'cancelled'"""
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+class QueryGuard:
+    """
+    Run generated SQL under limits.
+
+    Each query runs in a read-only transaction with a local statement_timeout,
+    after an EXPLAIN whose estimated total cost and row count must stay below
+    the configured limits. The backend pid of every guarded connection is
+    registered under the current request id, so a request can be cancelled
+    with pg_cancel_backend while its query runs; cancelling before the query
+    starts makes it fail immediately. The cancellation only signals a backend
+    that is still running the registered transaction, never a pooled backend
+    that has moved on to another request's query.
+    """
+    def __init__(self, engine, max_cost=1e7, max_rows=5e7, statement_timeout=30000, cancel_ttl=600, on_outcome=None):
+        """
+        Initialize the QueryGuard class
+
+        Args:
+            engine (Engine): Engine, or ReplicaRouter, the guarded connections are opened from
+            max_cost (float): Maximum estimated plan cost, 0 disables the check
+            max_rows (float): Maximum estimated row count of the plan, 0 disables the check
+            statement_timeout (int): Timeout in milliseconds of each statement, 0 disables it
+            cancel_ttl (int): Seconds a cancelled request id is remembered
+            on_outcome (callable, optional): Called with 'allowed', 'rejected_cost', 'rejected_rows',
+                'timeout' or 'cancelled' for each guarded query
+        """
+        self.engine = engine
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.statement_timeout = statement_timeout
+        self.cancel_ttl = cancel_ttl
+        self.on_outcome = on_outcome
+
+        self._running = {}
+        self._cancelled = {}
+        self._lock = threading.Lock()
+
+    def _report(self, outcome):
+        if self.on_outcome:
+            self.on_outcome(outcome)
+
+    def explain(self, conn, sql_query):
+        """
+        Get the planner estimates of a query
+
+        Args:
+            conn (Connection): Open connection
+            sql_query (str): SQL query
+
+        Returns:
+            dict: Estimated total 'cost' and 'rows' of the plan
+        """
+        plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql_query.strip().rstrip(';')}")).scalar()
+        root = plan[0]['Plan']
+        return {'cost': root['Total Cost'], 'rows': root['Plan Rows']}
+
+    def is_cancelled(self, request_id):
+        """Check whether a request was cancelled"""
+        with self._lock:
+            self._expire_cancelled()
+            return request_id in self._cancelled
+
+    def _expire_cancelled(self):
+        """Forget old cancellations (lock must be held)"""
+        now = time.time()
+        for request_id in [rid for rid, at in self._cancelled.items() if now - at > self.cancel_ttl]:
+            del self._cancelled[request_id]
+
+    def begin(self, conn, sql_query, request_id=None):
+        """
+        Start a guarded transaction on a connection and check the query plan
+
+        Args:
+            conn (Connection): Connection without an open transaction
+            sql_query (str): SQL query about to run
+            request_id (str, optional): Request the query belongs to (defaults to current_request_id)
+
+        Raises:
+            QueryRejectedError: If the request was cancelled or the plan exceeds the limits
+        """
+        request_id = request_id or current_request_id.get()
+        if request_id and self.is_cancelled(request_id):
+            self._report('cancelled')
+            raise QueryRejectedError('Query cancelled', 'cancelled')
+
+        conn.begin()
+        conn.execute(text("SET TRANSACTION READ ONLY"))
+        pid, started = conn.execute(
+            text("SELECT pg_backend_pid(), now(), set_config('statement_timeout', :timeout, true)"),
+            {'timeout': str(int(self.statement_timeout))}
+        ).first()[:2]
+        if request_id:
+            # The pid is only meaningful on the server this connection belongs to, and only
+            # for this transaction: pooled backends are reused by other requests afterwards
+            backend = (conn.engine, pid, started)
+            conn.info['guard_request'] = (request_id, backend)
+            with self._lock:
+                self._running.setdefault(request_id, set()).add(backend)
+                # A cancel() between the first check and the registration found nothing to signal
+                self._expire_cancelled()
+                cancelled = request_id in self._cancelled
+            if cancelled:
+                self.release(conn)
+                self._report('cancelled')
+                raise QueryRejectedError('Query cancelled', 'cancelled')
+
+        plan = self.explain(conn, sql_query)
+        if self.max_cost and plan['cost'] > self.max_cost:
+            self._report('rejected_cost')
+            raise QueryRejectedError(
+                f"Query rejected: estimated cost {plan['cost']:.0f} exceeds the limit of {self.max_cost:.0f}", 'cost')
+        if self.max_rows and plan['rows'] > self.max_rows:
+            self._report('rejected_rows')
+            raise QueryRejectedError(
+                f"Query rejected: estimated {plan['rows']:.0f} rows exceed the limit of {self.max_rows:.0f}", 'rows')
+        self._report('allowed')
+
+    def release(self, conn):
+        """Unregister a connection started with begin()"""
+        request_id, backend = conn.info.pop('guard_request', (None, None))
+        if request_id:
+            with self._lock:
+                backends = self._running.get(request_id, set())
+                backends.discard(backend)
+                if not backends:
+                    self._running.pop(request_id, None)
+
+    def translate_error(self, error, request_id=None):
+        """
+        Turn a statement stopped by the timeout or a cancellation into a QueryRejectedError
+
+        Args:
+            error (Exception): Error raised while running a guarded query
+            request_id (str, optional): Request the query belongs to (defaults to current_request_id)
+
+        Returns:
+            Exception: QueryRejectedError, or the original error
+        """
+        if getattr(getattr(error, 'orig', None), 'pgcode', None) != QUERY_CANCELED:
+            return error
+        request_id = request_id or current_request_id.get()
+        if request_id and self.is_cancelled(request_id):
+            self._report('cancelled')
+            return QueryRejectedError('Query cancelled', 'cancelled')
+        self._report('timeout')
+        return QueryRejectedError(
+            f"Query stopped after the statement timeout of {self.statement_timeout} ms", 'timeout')
+
+    @contextmanager
+    def connection(self, sql_query, request_id=None):
+        """
+        Open a connection running a guarded transaction for one query
+
+        Args:
+            sql_query (str): SQL query about to run
+            request_id (str, optional): Request the query belongs to (defaults to current_request_id)
+
+        Yields:
+            Connection: Connection to execute the query on
+        """
+        with self.engine.connect() as conn:
+            try:
+                self.begin(conn, sql_query, request_id)
+                yield conn
+            except QueryRejectedError:
+                raise
+            except Exception as e:
+                raise self.translate_error(e, request_id) from e
+            finally:
+                self.release(conn)
+
+    def cancel(self, request_id):
+        """
+        Cancel a request: stop its running queries and refuse the ones it starts later
+
+        Args:
+            request_id (str): Request id given to the submit endpoint
+
+        Returns:
+            int: Number of running queries signalled
+        """
+        with self._lock:
+            self._expire_cancelled()
+            self._cancelled[request_id] = time.time()
+            backends = list(self._running.get(request_id, ()))
+        cancelled = 0
+        for engine, pid, started in backends:
+            with self._lock:
+                if (engine, pid, started) not in self._running.get(request_id, ()):
+                    continue
+            # The transaction start time ties the signal to the registered transaction, in the same
+            # statement, so a backend released and reused in the meantime is left alone
+            with engine.connect() as conn:
+                cancelled += bool(conn.execute(
+                    text("SELECT pg_cancel_backend(pid) FROM pg_stat_activity "
+                         "WHERE pid = :pid AND xact_start = :started"),
+                    {'pid': pid, 'started': started}
+                ).scalar())
+        return cancelled
@@ -1,26 +1,185 @@
 import os
-from datetime import datetime
+import gzip
 import json
+import queue
+import atexit
+import shutil
+import threading
+import time
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, only needed for compression='zstd'
+    zstandard = None
+
 
 class QueryLogger:
-    def __init__(self, log_dir="logs"):
+    """
+    Log query execution details as JSON lines in daily files.
+
+    In background mode entries go onto a bounded queue and a writer thread
+    appends them in batches, flushing when `batch_size` entries are waiting or
+    every `flush_interval` seconds. Every process writes its own file
+    (queries_YYYY-MM-DD.pPID.log), so gunicorn workers never share, rename or
+    compress a file another worker still holds open. Files rotate when they
+    reach `max_bytes` (queries_YYYY-MM-DD.pPID.N.log) and closed files can be
+    compressed.
+    """
+    def __init__(self, log_dir="logs", background=False, queue_size=10000, batch_size=100,
+                 flush_interval=1.0, fsync=False, max_bytes=0, compression=None,
+                 overflow='drop', echo=True):
+        """
+        Initialize the QueryLogger class
+
+        Args:
+            log_dir (str): Directory of the log files
+            background (bool): Write entries from a background thread instead of the caller
+            queue_size (int): Maximum number of entries waiting to be written
+            batch_size (int): Number of entries written per batch
+            flush_interval (float): Maximum seconds an entry waits before being flushed
+            fsync (bool): fsync the file after every batch
+            max_bytes (int): Rotate the file when it grows past this size (0 disables rotation)
+            compression (str, optional): 'gzip' or 'zstd' compression of rotated and past-day files
+            overflow (str): 'drop' discards entries when the queue is full, 'block' waits for room
+            echo (bool): Also print every entry to the console
+        """
         self.log_dir = log_dir
+        self.background = background
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.overflow = overflow
+        self.echo = echo
+        self.dropped = 0
+
+        if compression == 'zstd' and zstandard is None:
+            print("Warning: zstandard is not installed, falling back to gzip compression")
+            self.compression = 'gzip'
+
+        self._file = None
+        self._file_date = None
+        self._file_path = None
+        self._write_lock = threading.Lock()
         self._ensure_log_dir()
-        
+
+        if self.background:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='query-logger', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
     def _ensure_log_dir(self):
         """Ensure the log directory exists"""
         if not os.path.exists(self.log_dir):
             os.makedirs(self.log_dir)
-            
-    def _get_log_file(self):
-        """Get the current log file path based on date"""
-        today = datetime.now().strftime("%Y-%m-%d")
-        return os.path.join(self.log_dir, f"queries_{today}.log")
-        
-    def log_query(self, success, user_query, selected_columns, selected_values, initial_query, final_query, comments, error=None):
+
+    def _get_log_file(self, day=None):
+        """Get the log file path of this process based on date"""
+        today = day or datetime.now().strftime("%Y-%m-%d")
+        return os.path.join(self.log_dir, f"queries_{today}.p{os.getpid()}.log")
+
+    def _rotated_path(self, path):
+        """Get the first free numbered path for a rotated copy of a file of this process"""
+        index = 1
+        while True:
+            rotated = f"{path[:-len('.log')]}.{index}.log"
+            if not any(os.path.exists(rotated + ext) for ext in ('', '.gz', '.zst')):
+                return rotated
+            index += 1
+
+    def _compress(self, path):
+        """Compress a closed log file and remove the original"""
+        try:
+            if self.compression == 'zstd':
+                with open(path, 'rb') as src, open(path + '.zst', 'wb') as dst:
+                    zstandard.ZstdCompressor().copy_stream(src, dst)
+            else:
+                with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+            os.remove(path)
+        except Exception as e:
+            print(f"Error compressing log file {path}: {str(e)}")
+
+    def _close_file(self, rotate=False):
+        """Close the open file, renaming it when rotating and compressing it if configured"""
+        if self._file is None:
+            return
+        self._file.close()
+        path = self._file_path
+        if rotate:
+            rotated = self._rotated_path(path)
+            os.rename(path, rotated)
+            path = rotated
+        self._file = None
+        self._file_path = None
+        if self.compression and (rotate or self._file_date != datetime.now().strftime("%Y-%m-%d")):
+            threading.Thread(target=self._compress, args=(path,), daemon=True).start()
+
+    def _write_entries(self, entries):
+        """Append entries to the current file, handling day changes and rotation"""
+        with self._write_lock:
+            today = datetime.now().strftime("%Y-%m-%d")
+            if self._file is not None and self._file_date != today:
+                self._close_file()
+            if self._file is not None and self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._close_file(rotate=True)
+            if self._file is None:
+                self._file_path = self._get_log_file(today)
+                self._file = open(self._file_path, "a")
+                self._file_date = today
+
+            lines = []
+            for entry in entries:
+                # One entry that cannot be serialized is skipped, not the whole batch
+                try:
+                    lines.append(json.dumps(entry, default=str) + "\n")
+                except Exception as e:
+                    print(f"Error serializing query log entry: {str(e)}")
+                    self.dropped += 1
+            self._file.write(''.join(lines))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def _run(self):
+        """Writer thread: collect entries into batches and write them"""
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size and time.time() < deadline:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self._write_entries(batch)
+            except Exception as e:
+                print(f"Error writing query log: {str(e)}")
+                self.dropped += len(batch)
+
+    def close(self):
+        """Flush the pending entries and close the log file"""
+        if self.background and not self._stop.is_set():
+            self._stop.set()
+            self._thread.join(timeout=5)
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._file_path = None
+
+    def log_query(self, success, user_query, selected_columns, selected_values, initial_query, final_query, comments, error=None,
+                  timings=None, llm_stats=None, row_count=None):
         """
         Log query execution details
-        
+
         Args:
             success (bool): Whether the query was successful
             user_query (str): The original user query
@@ -30,6 +189,9 @@ class QueryLogger:
             final_query (str): The final SQL query after validation
             comments (str): Comments from the LLM
             error (str, optional): Error message if query failed
+            timings (dict, optional): Duration of each stage of the request in milliseconds
+            llm_stats (list, optional): Token counts and durations reported by Ollama per generation
+            row_count (int, optional): Number of rows returned by the final query
         """
         log_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -42,11 +204,28 @@ class QueryLogger:
             "comments": comments,
             "error": error
         }
-        
-        # Write to log file
-        with open(self._get_log_file(), "a") as f:
-            f.write(json.dumps(log_entry) + "\n")
-            
+        if timings is not None:
+            log_entry["timings"] = timings
+        if llm_stats:
+            log_entry["llm_stats"] = llm_stats
+        if row_count is not None:
+            log_entry["row_count"] = row_count
+
+        # Write to log file, or hand the entry to the writer thread
+        if self.background:
+            try:
+                if self.overflow == 'block':
+                    self._queue.put(log_entry, timeout=self.flush_interval)
+                else:
+                    self._queue.put_nowait(log_entry)
+            except queue.Full:
+                self.dropped += 1
+        else:
+            self._write_entries([log_entry])
+
+        if not self.echo:
+            return
+
         # Also print to console for immediate feedback
         print("\n=== Query Execution Log ===")
         print(f"Timestamp: {log_entry['timestamp']}")
@@ -59,4 +238,6 @@ class QueryLogger:
         print(f"Comments: {comments}")
         if error:
             print(f"Error: {error}")
-        print("=========================\n") 
\ No newline at end of file
+        if timings:
+            print(f"Timings (ms): {timings}")
+        print("=========================\n")
@@ -0,0 +1,283 @@
+import re
+import threading
+from datetime import date
+
+# Aggregates recognized in questions: phrase pattern, SQL expression, output name
+MEASURES = [
+    (r'(?:total )?sales amounts?|sales value', 'SUM(units * unit_cost)', 'sales_amount'),
+    (r'average unit costs?|average (?:unit )?prices?', 'ROUND(AVG(unit_cost), 2)', 'avg_unit_cost'),
+    (r'(?:total )?(?:number of |count of )?units(?: sold)?|(?:total )?quantity', 'SUM(units)', 'units_sold'),
+    (r'(?:total )?(?:number of |count of )orders|how many orders|order counts?', 'COUNT(*)', 'order_count'),
+    (r'(?:total )?(?:sales|revenue)', 'SUM(total)', 'total_sales'),
+]
+
+# Grouping dimensions: phrase pattern, SQL expression, output name
+DIMENSIONS = [
+    (r'regions?', 'region', 'region'),
+    (r'(?:sales )?reps?|(?:sales )?representatives?|salespe(?:rson|ople)', 'rep', 'rep'),
+    (r'items?|products?', 'item', 'item'),
+    (r'months?|monthly', "DATE_TRUNC('month', order_date)", 'month'),
+    (r'years?|yearly|annually', 'CAST(EXTRACT(YEAR FROM order_date) AS INTEGER)', 'year'),
+    (r'days?|daily|dates?', 'order_date', 'order_date'),
+]
+
+MONTHS = ['january', 'february', 'march', 'april', 'may', 'june', 'july', 'august', 'september', 'october',
+          'november', 'december']
+
+# Words that may remain once the measures, dimensions, entities and dates are recognized
+FILLER = {
+    'a', 'all', 'an', 'and', 'are', 'by', 'did', 'do', 'does', 'each', 'for', 'from', 'get', 'give', 'have',
+    'how', 'in', 'is', 'list', 'me', 'much', 'of', 'on', 'overall', 'please', 'show', 'sold', 'the', 'total',
+    'totals', 'was', 'were', 'what', "what's", 'whats', 'which', 'with', 'made', 'make', 'generated', 'per',
+    'breakdown', 'broken', 'down', 'split', 'tell', 'find', 'every', 'across', 'during', 'at', 'we', 'our',
+    'i', 'can', 'you', 'see', 'sell', 'to'
+}
+
+DATE = r"'?(\d{4}-\d{2}-\d{2})'?"
+DATE_RANGES = [
+    (rf'between {DATE} and {DATE}', lambda m: (f">= '{m[1]}'", f"<= '{m[2]}'")),
+    (rf'from {DATE} (?:to|until|through) {DATE}', lambda m: (f">= '{m[1]}'", f"<= '{m[2]}'")),
+    (rf'(?:since|from|starting) {DATE}', lambda m: (f">= '{m[1]}'",)),
+    (rf'after {DATE}', lambda m: (f"> '{m[1]}'",)),
+    (rf'before {DATE}', lambda m: (f"< '{m[1]}'",)),
+    (rf'(?:until|through|up to) {DATE}', lambda m: (f"<= '{m[1]}'",)),
+    (rf"(?:in |during )?({'|'.join(MONTHS)}) (\d{{4}})", lambda m: _month_range(MONTHS.index(m[1]) + 1, int(m[2]))),
+    (r'(?:in |during )(\d{4})', lambda m: (f">= '{m[1]}-01-01'", f"< '{int(m[1]) + 1}-01-01'")),
+]
+
+
+def _month_range(month, year):
+    """Bounds of a calendar month"""
+    end = date(year + month // 12, month % 12 + 1, 1)
+    return f">= '{date(year, month, 1).isoformat()}'", f"< '{end.isoformat()}'"
+
+
+def _literal(value):
+    """SQL string literal"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class TemplateMatcher:
+    """
+    Answer common question shapes with SQL built from templates, without the LLMs.
+
+    A question matches when it reads as one or more known aggregates
+    ("total sales", "units sold", "number of orders"...), optionally broken
+    down "by"/"per"/"for each" region, rep, item, month, year or day, filtered
+    on values of the categorical columns found in the value dictionary and on
+    order_date ranges, with an optional "top N". Every word of the question
+    must be accounted for; anything else (negations, other columns,
+    comparisons...) is left to the LLMs, as are questions whose selections
+    the template cannot honour.
+    """
+    def __init__(self, value_dictionary, table='sampledb'):
+        """
+        Initialize the TemplateMatcher class
+
+        Args:
+            value_dictionary (ValueDictionary): Source of the known values of the categorical columns
+            table (str): Table the templates query
+        """
+        self.value_dictionary = value_dictionary
+        self.table = table
+        self._entities = None
+        self._entities_etag = None
+        self._lock = threading.Lock()
+        self.matched = 0
+        self.unmatched = 0
+
+        self._measures = [(re.compile(rf'\b(?:{pattern})\b'), sql, name) for pattern, sql, name in MEASURES]
+        dimension = '|'.join(f'(?:{pattern})' for pattern, _, _ in DIMENSIONS)
+        self._grouping = re.compile(
+            rf'\b(?:by|per|for each|for every|each|across|in each)\s+((?:{dimension})(?:\s*(?:,|and|&)\s*(?:{dimension}))*)\b'
+            rf'|\b(monthly|yearly|daily)\b'
+        )
+        self._dimensions = [(re.compile(rf'^(?:{pattern})$'), sql, name) for pattern, sql, name in DIMENSIONS]
+        # "the East region", "rep Jones": the column named next to one of its values
+        self._nouns = {name: pattern for pattern, _, name in DIMENSIONS}
+        self._dates = [(re.compile(rf'\b{pattern}\b'), bounds) for pattern, bounds in DATE_RANGES]
+        self._top = re.compile(rf'\btop (\d{{1,4}})(?: ({dimension}))?\b')
+
+    def _entity_patterns(self):
+        """One pattern per categorical column matching its known values, rebuilt when the dictionary changes"""
+        etag = self.value_dictionary.etag
+        with self._lock:
+            if self._entities is not None and etag == self._entities_etag:
+                return self._entities
+        unique_values = self.value_dictionary.snapshot()['unique_values']
+        entities = {}
+        for column, values in unique_values.items():
+            values = [str(value) for value in values if value is not None and str(value).strip()]
+            if not values:
+                continue
+            # Longest values first, so "Pen Set" wins over "Pen"
+            alternatives = '|'.join(re.escape(value.lower()) for value in sorted(values, key=len, reverse=True))
+            entities[column] = (re.compile(rf'(?<!\w)(?:{alternatives})(?!\w)'), {value.lower(): value for value in values})
+        with self._lock:
+            self._entities = entities
+            self._entities_etag = etag
+        return entities
+
+    @staticmethod
+    def _claim(spans, start, end):
+        """Mark a span of the question as recognized, unless it overlaps one already claimed"""
+        if any(start < other_end and other_start < end for other_start, other_end in spans):
+            return False
+        spans.append((start, end))
+        return True
+
+    def _parse(self, question):
+        """Recognize the parts of a lowercase question, or return None if some of it is not understood"""
+        spans = []
+        filters = {}
+        for column, (pattern, canonical) in self._entity_patterns().items():
+            noun = self._nouns.get(column)
+            for match in pattern.finditer(question):
+                start, end = match.span()
+                if noun:
+                    before = re.search(rf'\b(?:{noun}) $', question[:start])
+                    after = re.match(rf' (?:{noun})\b', question[end:])
+                    start = before.start() if before else start
+                    end = end + after.end() if after else end
+                if not self._claim(spans, start, end):
+                    return None
+                filters.setdefault(column, []).append(canonical[match.group(0)])
+
+        date_bounds = []
+        for pattern, bounds in self._dates:
+            for match in pattern.finditer(question):
+                if self._claim(spans, *match.span()):
+                    date_bounds.extend(bounds(match))
+
+        top = None
+        dimensions = []
+        match = self._top.search(question)
+        if match and self._claim(spans, *match.span()):
+            top = int(match.group(1))
+            if match.group(2):
+                dimensions.append(next((sql, name) for pattern, sql, name in self._dimensions
+                                       if pattern.match(match.group(2))))
+        for match in self._grouping.finditer(question):
+            if not self._claim(spans, *match.span()):
+                return None
+            for word in re.split(r'\s*(?:,|\band\b|&)\s*', match.group(1) or match.group(2)):
+                found = next(((sql, name) for pattern, sql, name in self._dimensions if pattern.match(word.strip())), None)
+                if found is None:
+                    return None
+                if found not in dimensions:
+                    dimensions.append(found)
+
+        measures = []
+        for pattern, sql, name in self._measures:
+            for match in pattern.finditer(question):
+                if self._claim(spans, *match.span()) and (sql, name) not in measures:
+                    measures.append((sql, name))
+        if not measures or (top and not dimensions):
+            return None
+
+        remaining = ''.join(' ' if any(start <= i < end for start, end in spans) else char
+                            for i, char in enumerate(question))
+        if any(word not in FILLER for word in re.findall(r"[a-z0-9']+", remaining)):
+            return None
+        return {'measures': measures, 'dimensions': dimensions, 'filters': filters,
+                'date_bounds': date_bounds, 'top': top}
+
+    def match(self, user_query, columns=None, selected_values=None):
+        """
+        Build the SQL of a question if it matches a template
+
+        Args:
+            user_query (str): Natural language question
+            columns (list, optional): Selected columns, which the query must return
+            selected_values (dict, optional): Selected filter values, applied exactly
+
+        Returns:
+            dict: 'sql_query' and the 'template' matched, or None to use the LLMs
+        """
+        question = re.sub(r'\s+', ' ', (user_query or '').lower()).strip().rstrip('?.! ')
+        try:
+            parsed = self._parse(question) if question else None
+        except Exception as e:
+            print(f"Error matching query templates: {str(e)}")
+            parsed = None
+        if parsed is not None:
+            parsed = self._apply_selections(parsed, columns or [], selected_values or {})
+        with self._lock:
+            if parsed is None:
+                self.unmatched += 1
+                return None
+            self.matched += 1
+        return {'sql_query': self._sql(parsed), 'template': self._name(parsed)}
+
+    def _apply_selections(self, parsed, columns, selected_values):
+        """
+        Merge the UI selections into the parsed question, or return None if they conflict
+
+        Selected values are only accepted on the categorical columns of the value
+        dictionary, since the column names are written into the SQL.
+        """
+        known = self._entity_patterns()
+        for column, values in selected_values.items():
+            values = values if isinstance(values, (list, tuple)) else [values]
+            if not values:
+                continue
+            if column.lower() not in known:
+                return None
+            mentioned = parsed['filters'].get(column.lower())
+            if mentioned and set(mentioned) != {str(value) for value in values}:
+                return None
+            parsed['filters'][column.lower()] = [str(value) for value in values]
+        returned = ' '.join(sql for sql, _ in parsed['measures'] + parsed['dimensions'])
+        if any(not re.search(rf'\b{re.escape(column.lower())}\b', returned) for column in columns):
+            return None
+        return parsed
+
+    def _sql(self, parsed):
+        """Render the SQL of a parsed question"""
+        projections = [sql if sql == name else f"{sql} AS {name}" for sql, name in parsed['dimensions']]
+        projections += [f"{sql} AS {name}" for sql, name in parsed['measures']]
+        conditions = []
+        for column, values in parsed['filters'].items():
+            values = list(dict.fromkeys(values))
+            if len(values) == 1:
+                conditions.append(f"{column} = {_literal(values[0])}")
+            else:
+                conditions.append(f"{column} IN ({', '.join(_literal(value) for value in values)})")
+        conditions += [f"order_date {bound}" for bound in parsed['date_bounds']]
+
+        sql = f"SELECT {', '.join(projections)} FROM {self.table}"
+        if conditions:
+            sql += f" WHERE {' AND '.join(conditions)}"
+        if parsed['dimensions']:
+            names = [name for _, name in parsed['dimensions']]
+            sql += f" GROUP BY {', '.join(names)}"
+            if parsed['top']:
+                sql += f" ORDER BY {parsed['measures'][0][1]} DESC LIMIT {parsed['top']}"
+            else:
+                sql += f" ORDER BY {', '.join(names)}"
+        return sql
+
+    @staticmethod
+    def _name(parsed):
+        """Short description of the template used, for logs and metrics"""
+        name = '+'.join(name for _, name in parsed['measures'])
+        if parsed['dimensions']:
+            name += ' by ' + '+'.join(name for _, name in parsed['dimensions'])
+        if parsed['filters'] or parsed['date_bounds']:
+            name += ' filtered'
+        return name
+
+    def stats(self):
+        """
+        Get match statistics
+
+        Returns:
+            dict: Matched and unmatched question counts, and the match rate
+        """
+        with self._lock:
+            total = self.matched + self.unmatched
+            return {
+                'matched': self.matched,
+                'unmatched': self.unmatched,
+                'match_rate': self.matched / total if total else 0.0
+            }
@@ -0,0 +1,306 @@
+import re
+import sys
+import time
+import select
+import hashlib
+import threading
+from collections import OrderedDict
+from sqlalchemy import text
+from utils.sql_text import normalize_sql
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:  # sqlglot is optional, without it SQL is only whitespace-normalized
+    sqlglot = None
+    exp = None
+
+# Channel on which loaders announce the tables they changed (payload: table name)
+CHANGES_CHANNEL = 'table_changes'
+
+TABLE_COUNTERS_SQL = """
+    SELECT relname, n_tup_ins || ':' || n_tup_upd || ':' || n_tup_del || ':' || n_live_tup
+    FROM pg_stat_user_tables
+"""
+
+
+def canonical_sql(sql_query):
+    """
+    Canonicalize a SQL statement so equivalent spellings share a cache entry
+
+    Args:
+        sql_query (str): SQL statement
+
+    Returns:
+        str: The statement re-rendered by sqlglot, or whitespace-normalized without it
+    """
+    if sqlglot is not None:
+        try:
+            return sqlglot.parse_one(sql_query, read='postgres').sql(dialect='postgres')
+        except Exception:
+            pass
+    return normalize_sql(sql_query)
+
+
+def referenced_tables(sql_query):
+    """
+    Get the tables a statement reads
+
+    Args:
+        sql_query (str): SQL statement
+
+    Returns:
+        set: Lowercase table names (CTE names excluded)
+    """
+    if sqlglot is not None:
+        try:
+            tree = sqlglot.parse_one(sql_query, read='postgres')
+            ctes = {cte.alias.lower() for cte in tree.find_all(exp.CTE)}
+            return {table.name.lower() for table in tree.find_all(exp.Table)} - ctes
+        except Exception:
+            pass
+    return {name.strip('"').split('.')[-1].lower()
+            for name in re.findall(r'\b(?:from|join)\s+([\w."]+)', sql_query, re.IGNORECASE)}
+
+
+# Functions whose result changes between executions of the same statement (time, randomness, sequences)
+VOLATILE_FUNCTIONS = {
+    'now', 'current_date', 'current_time', 'current_timestamp', 'localtime', 'localtimestamp',
+    'clock_timestamp', 'statement_timestamp', 'transaction_timestamp', 'timeofday',
+    'random', 'random_normal', 'setseed', 'gen_random_uuid', 'uuid_generate_v1', 'uuid_generate_v4',
+    'nextval', 'currval', 'lastval', 'setval', 'txid_current', 'pg_sleep'
+}
+# sqlglot expressions of the same functions, when it parses them into their own node types
+VOLATILE_EXPRESSIONS = ('CurrentDate', 'CurrentTime', 'CurrentTimestamp', 'CurrentDatetime', 'Localtime',
+                        'Localtimestamp', 'Rand', 'Uuid')
+
+
+def volatile_sql(sql_query):
+    """
+    Check whether a statement calls a function whose result changes between executions
+
+    Args:
+        sql_query (str): SQL statement
+
+    Returns:
+        bool: True if the statement reads the clock, random values or sequences, e.g. now() or CURRENT_DATE
+    """
+    if sqlglot is not None:
+        try:
+            tree = sqlglot.parse_one(sql_query, read='postgres')
+            types = tuple(getattr(exp, name) for name in VOLATILE_EXPRESSIONS if hasattr(exp, name))
+            for node in tree.find_all(exp.Func):
+                if isinstance(node, types):
+                    return True
+                if isinstance(node, exp.Anonymous) and node.name.lower() in VOLATILE_FUNCTIONS:
+                    return True
+                # age() of a single date is measured from the current date
+                if isinstance(node, exp.Anonymous) and node.name.lower() == 'age' and len(node.expressions) < 2:
+                    return True
+            return False
+        except Exception:
+            pass
+    return re.search(r'\b(?:' + '|'.join(VOLATILE_FUNCTIONS) + r')\b|\bage\s*\([^,()]*\)', sql_query,
+                     re.IGNORECASE) is not None
+
+
+def estimate_size(result, sample_rows=100):
+    """
+    Estimate the memory held by a query result from a sample of its rows
+
+    Args:
+        result (dict): Result with 'data' as a list of row dicts
+        sample_rows (int): Number of rows measured
+
+    Returns:
+        int: Approximate size in bytes
+    """
+    rows = result.get('data') or []
+    sample = rows[:sample_rows]
+    if not sample:
+        return sys.getsizeof(result)
+    sampled = sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row.values()) for row in sample)
+    return sys.getsizeof(rows) + sampled * len(rows) // len(sample)
+
+
+class ResultCache:
+    """
+    A memory-bounded LRU cache of query results keyed on the canonical SQL.
+
+    Every entry records a version of each table it reads. A table's version
+    combines its pg_stat_user_tables modification counters, polled at most
+    every `check_interval` seconds, with a local generation bumped by
+    invalidate(). Loaders send NOTIFY on CHANGES_CHANNEL after each load, which
+    a listener thread turns into invalidate() calls without waiting for the
+    statistics to catch up. Statements calling volatile functions (now(),
+    CURRENT_DATE, random(), ...) are never cached. The counters are those of
+    the server the engine connects to, so results must be read from that
+    server too, not from a replica lagging behind it.
+    """
+    def __init__(self, engine, max_bytes=64 * 1024 * 1024, max_entry_bytes=8 * 1024 * 1024,
+                 check_interval=2, listen=True):
+        """
+        Initialize the ResultCache class
+
+        Args:
+            engine (Engine): SQLAlchemy engine of the database
+            max_bytes (int): Approximate memory budget of all cached results
+            max_entry_bytes (int): Results larger than this are not cached
+            check_interval (float): Minimum seconds between two reads of the table counters
+            listen (bool): Listen for table change notifications from the loaders
+        """
+        self.engine = engine
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.check_interval = check_interval
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._counters = {}
+        self._generations = {}
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        if listen:
+            threading.Thread(target=self._listen, name='result-cache-listener', daemon=True).start()
+
+    def _refresh_counters(self):
+        """Re-read the table modification counters if the check interval elapsed"""
+        if time.time() - self._checked_at < self.check_interval:
+            return
+        with self.engine.connect() as conn:
+            counters = dict(conn.execute(text(TABLE_COUNTERS_SQL)).fetchall())
+        with self._lock:
+            self._counters = counters
+            self._checked_at = time.time()
+
+    def _versions(self, tables):
+        """Current version of each table (lock must be held)"""
+        return {table: (self._counters.get(table), self._generations.get(table, 0)) for table in tables}
+
+    def _evict(self, key):
+        """Remove an entry (lock must be held)"""
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._bytes -= entry['size']
+
+    def get_or_execute(self, sql_query, execute_fn):
+        """
+        Return the cached result of a statement, executing it on a miss
+
+        Args:
+            sql_query (str): SQL statement
+            execute_fn (callable): Function (sql_query) -> result dict with 'success'
+
+        Returns:
+            dict: Query result, with 'cached' set to True when served from the cache
+        """
+        # The same statement returns different rows at every execution
+        if volatile_sql(sql_query):
+            return execute_fn(sql_query)
+
+        canonical = canonical_sql(sql_query)
+        key = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+        try:
+            self._refresh_counters()
+        except Exception as e:
+            print(f"Error reading table counters, bypassing the result cache: {str(e)}")
+            return execute_fn(sql_query)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['versions'] == self._versions(entry['versions']):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry['result'], cached=True)
+            if entry:
+                self._evict(key)
+                self.invalidations += 1
+            self.misses += 1
+            # Versions are taken before executing, so a change during execution only causes a miss later
+            versions = self._versions(referenced_tables(canonical))
+
+        result = execute_fn(sql_query)
+        if not result.get('success') or not versions:
+            return result
+
+        size = estimate_size(result)
+        if size > self.max_entry_bytes:
+            return result
+        with self._lock:
+            self._evict(key)
+            self._entries[key] = {'result': result, 'versions': versions, 'size': size}
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                self._evict(next(iter(self._entries)))
+        return result
+
+    def invalidate(self, table=None):
+        """
+        Invalidate the cached results reading a table
+
+        Args:
+            table (str, optional): Table that changed, every table if omitted
+        """
+        with self._lock:
+            tables = [table.lower()] if table else list(self._generations) + \
+                [t for entry in self._entries.values() for t in entry['versions']]
+            for name in set(tables):
+                self._generations[name] = self._generations.get(name, 0) + 1
+            # Counters lag behind the change, re-read them on the next lookup
+            self._checked_at = 0
+
+    def _listen(self):
+        """Listener thread: invalidate tables announced on CHANGES_CHANNEL"""
+        while True:
+            raw_conn = None
+            try:
+                raw_conn = self.engine.raw_connection()
+                connection = raw_conn.driver_connection
+                # The connection stays in LISTEN mode, keep it out of the pool
+                raw_conn.detach()
+                connection.autocommit = True
+                connection.cursor().execute(f"LISTEN {CHANGES_CHANNEL}")
+                while True:
+                    if select.select([connection], [], [], 60) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        self.invalidate(notify.payload or None)
+            except Exception as e:
+                print(f"Result cache listener error, reconnecting: {str(e)}")
+                if raw_conn is not None:
+                    try:
+                        raw_conn.close()
+                    except Exception:
+                        pass
+                time.sleep(5)
+
+    def clear(self):
+        """Remove every entry from the cache"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Get cache statistics
+
+        Returns:
+            dict: Entry count, memory use, hit/miss/invalidation counters and hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
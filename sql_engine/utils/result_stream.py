@@ -0,0 +1,140 @@
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from sqlalchemy import text
+
+# Number of rows fetched per round trip from the server-side cursor
+DEFAULT_CHUNK_SIZE = 1000
+
+# Streaming formats accepted by the submit endpoint
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json-stream': 'application/json'
+}
+
+
+def json_default(value):
+    """
+    Serialize the database types the standard json module does not handle
+
+    Args:
+        value: Value that json.dumps could not serialize
+
+    Returns:
+        JSON-compatible representation of the value
+    """
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return str(value)
+
+
+def execute_streaming(conn, sql_query, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Execute a query with a server-side cursor so rows are fetched in chunks
+
+    Args:
+        conn (Connection): Open SQLAlchemy connection
+        sql_query (str): SQL query to execute
+        chunk_size (int): Number of rows fetched per round trip
+
+    Returns:
+        CursorResult: Result yielding rows lazily
+    """
+    return conn.execution_options(stream_results=True, yield_per=chunk_size).execute(text(sql_query))
+
+
+class RowLimit:
+    """Iterate over at most `max_rows` rows of a result, recording whether it had more"""
+    def __init__(self, rows, max_rows=0):
+        """
+        Args:
+            rows (iterable): Rows to iterate over
+            max_rows (int): Maximum number of rows, 0 for no limit
+        """
+        self.rows = rows
+        self.max_rows = max_rows
+        self.truncated = False
+
+    def __iter__(self):
+        for count, row in enumerate(self.rows):
+            if self.max_rows and count >= self.max_rows:
+                self.truncated = True
+                return
+            yield row
+
+
+def ndjson_lines(header, rows, chunk_size=DEFAULT_CHUNK_SIZE, max_rows=0):
+    """
+    Encode a result as newline-delimited JSON
+
+    The first line is the header object (including the column names), each
+    following line is one row as a compact array, and the last line holds the
+    row count and whether rows beyond `max_rows` were left out (or the error
+    that interrupted the stream).
+
+    Args:
+        header (dict): Header object, must contain 'columns'
+        rows (iterable): Rows to encode
+        chunk_size (int): Number of lines joined into each yielded chunk
+        max_rows (int): Maximum number of rows encoded, 0 for no limit
+
+    Yields:
+        str: Chunks of NDJSON text
+    """
+    yield json.dumps(header, default=json_default) + '\n'
+    rows = RowLimit(rows, max_rows)
+    count = 0
+    buffer = []
+    try:
+        for row in rows:
+            buffer.append(json.dumps(list(row), default=json_default))
+            count += 1
+            if len(buffer) >= chunk_size:
+                yield '\n'.join(buffer) + '\n'
+                buffer = []
+        if buffer:
+            yield '\n'.join(buffer) + '\n'
+        yield json.dumps({'success': True, 'count': count, 'truncated': rows.truncated}) + '\n'
+    except Exception as e:
+        if buffer:
+            yield '\n'.join(buffer) + '\n'
+        yield json.dumps({'success': False, 'count': count, 'error': str(e)}) + '\n'
+
+
+def json_array_chunks(header, rows, chunk_size=DEFAULT_CHUNK_SIZE, max_rows=0):
+    """
+    Encode a result as a single JSON object whose 'rows' array is streamed
+
+    The 'count' and 'truncated' fields follow the rows.
+
+    Args:
+        header (dict): Header fields, must contain 'columns'
+        rows (iterable): Rows to encode
+        chunk_size (int): Number of rows joined into each yielded chunk
+        max_rows (int): Maximum number of rows encoded, 0 for no limit
+
+    Yields:
+        str: Chunks of the JSON document
+    """
+    yield json.dumps(header, default=json_default)[:-1] + ', "rows": ['
+    rows = RowLimit(rows, max_rows)
+    count = 0
+    buffer = []
+    error = None
+    try:
+        for row in rows:
+            buffer.append(json.dumps(list(row), default=json_default))
+            count += 1
+            if len(buffer) >= chunk_size:
+                yield (',' if count > len(buffer) else '') + ','.join(buffer)
+                buffer = []
+    except Exception as e:
+        error = str(e)
+    if buffer:
+        yield (',' if count > len(buffer) else '') + ','.join(buffer)
+    trailer = {'count': count, 'truncated': rows.truncated}
+    if error:
+        trailer['error'] = error
+    yield '], ' + json.dumps(trailer)[1:]
@@ -0,0 +1,349 @@
+import os
+import time
+import argparse
+import threading
+from sqlalchemy import text
+from utils.result_cache import CHANGES_CHANNEL
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:  # sqlglot is optional, without it queries always read the base table
+    sqlglot = None
+    exp = None
+
+ROLLUP_TABLE = 'sampledb_daily_rollup'
+STATE_TABLE = 'sampledb_rollup_state'
+CHANGES_TABLE = 'sampledb_rollup_changes'
+
+# Tables maintained by the engine itself, hidden from the schema shown to users
+ROLLUP_TABLES = (ROLLUP_TABLE, STATE_TABLE, CHANGES_TABLE)
+
+# Columns the rollup is grouped by
+DIMENSIONS = ('order_date', 'region', 'rep', 'item')
+
+# The triggers record the days of every row written to sampledb in the changes table, in the writing
+# transaction, so a refresh knows exactly which days to re-aggregate. TRUNCATE empties the rollup.
+ROLLUP_DDL = f"""
+    CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+        order_date DATE,
+        region VARCHAR(50),
+        rep VARCHAR(100),
+        item VARCHAR(100),
+        units_sum BIGINT,
+        total_sum NUMERIC,
+        sales_sum NUMERIC,
+        row_count BIGINT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS {ROLLUP_TABLE}_dims_idx ON {ROLLUP_TABLE} (order_date, region, rep, item);
+    CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+        table_name TEXT PRIMARY KEY,
+        refreshed_at TIMESTAMPTZ
+    );
+    INSERT INTO {STATE_TABLE} (table_name) VALUES ('{ROLLUP_TABLE}') ON CONFLICT DO NOTHING;
+    CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} (
+        order_date DATE
+    );
+
+    CREATE OR REPLACE FUNCTION {CHANGES_TABLE}_capture() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            DELETE FROM {ROLLUP_TABLE};
+            DELETE FROM {CHANGES_TABLE};
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO {CHANGES_TABLE} (order_date) SELECT DISTINCT order_date FROM new_rows;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            INSERT INTO {CHANGES_TABLE} (order_date) SELECT DISTINCT order_date FROM old_rows;
+        END IF;
+        RETURN NULL;
+    END
+    $$;
+
+    DO $$
+    BEGIN
+        -- Created once: CREATE TRIGGER locks sampledb against writes
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = 'sampledb'::regclass
+                       AND tgname = '{CHANGES_TABLE}_insert') THEN
+            CREATE TRIGGER {CHANGES_TABLE}_insert AFTER INSERT ON sampledb
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION {CHANGES_TABLE}_capture();
+            CREATE TRIGGER {CHANGES_TABLE}_update AFTER UPDATE ON sampledb
+                REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION {CHANGES_TABLE}_capture();
+            CREATE TRIGGER {CHANGES_TABLE}_delete AFTER DELETE ON sampledb
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION {CHANGES_TABLE}_capture();
+            CREATE TRIGGER {CHANGES_TABLE}_truncate AFTER TRUNCATE ON sampledb
+                FOR EACH STATEMENT EXECUTE FUNCTION {CHANGES_TABLE}_capture();
+            -- Writes made before the triggers existed were not recorded: the next refresh rebuilds
+            UPDATE {STATE_TABLE} SET refreshed_at = NULL;
+        END IF;
+    END
+    $$;
+"""
+
+# Built without blocking writes to sampledb; an invalid index left by an interrupted build is rebuilt
+ORDER_DATE_INDEX = 'sampledb_order_date_idx'
+INVALID_INDEX_SQL = f"""
+    SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE c.relname = '{ORDER_DATE_INDEX}'
+"""
+
+# Rows aggregated by day, region, rep and item
+AGGREGATE_SQL = """
+    SELECT s.order_date, s.region, s.rep, s.item, SUM(s.units), SUM(s.total), SUM(s.units * s.unit_cost), COUNT(*)
+    FROM sampledb s
+"""
+INSERT_SQL = f"""
+    INSERT INTO {ROLLUP_TABLE} (order_date, region, rep, item, units_sum, total_sum, sales_sum, row_count)
+"""
+
+# Days recorded by the triggers are consumed and recomputed from the base table in one statement, so
+# they are taken from the same snapshot as the rows; days of transactions committed later stay recorded.
+# Days are matched with = so that both tables are read through their order_date indexes, and the NULL
+# day, which = never matches, is handled apart
+REFRESH_SQL = f"""
+    WITH consumed AS (
+        DELETE FROM {CHANGES_TABLE} RETURNING order_date
+    ), days AS (
+        SELECT DISTINCT order_date FROM consumed WHERE order_date IS NOT NULL
+    ), null_day AS (
+        SELECT 1 FROM consumed WHERE order_date IS NULL LIMIT 1
+    ), removed AS (
+        DELETE FROM {ROLLUP_TABLE} r USING days d WHERE r.order_date = d.order_date
+    ), removed_null AS (
+        DELETE FROM {ROLLUP_TABLE} r WHERE r.order_date IS NULL AND EXISTS (SELECT 1 FROM null_day)
+    )
+    {INSERT_SQL}
+    {AGGREGATE_SQL}
+    JOIN days d ON s.order_date = d.order_date
+    GROUP BY s.order_date, s.region, s.rep, s.item
+    UNION ALL
+    {AGGREGATE_SQL}
+    WHERE s.order_date IS NULL AND EXISTS (SELECT 1 FROM null_day)
+    GROUP BY s.order_date, s.region, s.rep, s.item
+"""
+
+REBUILD_SQL = f"""
+    {INSERT_SQL}
+    {AGGREGATE_SQL}
+    GROUP BY s.order_date, s.region, s.rep, s.item
+"""
+
+
+def _column_name(node):
+    """Name Postgres gives to an unaliased output expression"""
+    if isinstance(node, exp.Cast):
+        return _column_name(node.this)
+    if isinstance(node, exp.Column):
+        return node.name
+    if isinstance(node, exp.Func):
+        return node.sql_name().lower()
+    return '?column?'
+
+
+class SalesRollup:
+    """
+    A daily rollup of sampledb by region, rep and item, and the query rewrite using it.
+
+    Statement triggers on sampledb record the order_date of every inserted,
+    updated or deleted row in a changes table, within the writing
+    transaction. A refresh consumes the recorded days and recomputes just
+    those days from the base table, so the rollup is up to date exactly when
+    no day is recorded. Aggregate queries grouping and filtering on the
+    rollup dimensions and summing units, total or units * unit_cost are
+    answered from the rollup while it is up to date; otherwise they run
+    unchanged. Rewritten queries must run on the database the freshness was
+    checked on (the primary), not on a replica that may lag behind it.
+    """
+    def __init__(self, engine, auto_refresh=True):
+        """
+        Initialize the SalesRollup class
+
+        Args:
+            engine (Engine): SQLAlchemy engine of the primary database
+            auto_refresh (bool): Refresh in a background thread when a query finds the rollup stale
+        """
+        self.engine = engine
+        self.auto_refresh = auto_refresh
+        self._refreshing = threading.Lock()
+
+    def create(self):
+        """Create the rollup, state and changes tables, the triggers and the base table index the refresh relies on"""
+        with self.engine.begin() as conn:
+            conn.execute(text(ROLLUP_DDL))
+        with self.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            if conn.execute(text(INVALID_INDEX_SQL)).scalar():
+                conn.execute(text(f"DROP INDEX CONCURRENTLY {ORDER_DATE_INDEX}"))
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {ORDER_DATE_INDEX} ON sampledb (order_date)"))
+
+    def refresh(self, full=False):
+        """
+        Re-aggregate the days written since the last refresh
+
+        Args:
+            full (bool): Rebuild the whole rollup; the first refresh always does
+
+        Returns:
+            dict: Refresh summary with the rows written and whether it was a full rebuild
+        """
+        start = time.time()
+        with self.engine.begin() as conn:
+            # Serialize refreshes across workers
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {'name': ROLLUP_TABLE})
+            refreshed_at = conn.execute(
+                text(f"SELECT refreshed_at FROM {STATE_TABLE} WHERE table_name = :name"), {'name': ROLLUP_TABLE}
+            ).scalar()
+            # Before the first refresh the rollup cannot be proven current
+            full = full or refreshed_at is None
+            if full:
+                conn.execute(text(f"TRUNCATE {ROLLUP_TABLE}"))
+                conn.execute(text(f"DELETE FROM {CHANGES_TABLE}"))
+                rows = conn.execute(text(REBUILD_SQL)).rowcount
+            elif conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {CHANGES_TABLE})")).scalar():
+                rows = conn.execute(text(REFRESH_SQL)).rowcount
+            else:
+                return {'success': True, 'rows': 0, 'full': False, 'seconds': time.time() - start}
+            conn.execute(
+                text(f"UPDATE {STATE_TABLE} SET refreshed_at = now() WHERE table_name = :name"), {'name': ROLLUP_TABLE}
+            )
+            conn.execute(text("SELECT pg_notify(:channel, :table)"), {'channel': CHANGES_CHANNEL, 'table': ROLLUP_TABLE})
+        summary = {'success': True, 'rows': rows, 'full': full, 'seconds': time.time() - start}
+        print(f"Refreshed {ROLLUP_TABLE}{' (full)' if full else ''}: {rows} rows in {summary['seconds']:.2f}s")
+        return summary
+
+    def is_fresh(self):
+        """Check whether the rollup was built and no write to sampledb is waiting to be aggregated"""
+        with self.engine.connect() as conn:
+            return conn.execute(text(
+                f"SELECT refreshed_at IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {CHANGES_TABLE}) "
+                f"FROM {STATE_TABLE} WHERE table_name = :name"
+            ), {'name': ROLLUP_TABLE}).scalar() is True
+
+    def _refresh_in_background(self):
+        """Start a refresh unless one is already running in this process"""
+        if not self._refreshing.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing {ROLLUP_TABLE}: {str(e)}")
+            finally:
+                self._refreshing.release()
+
+        threading.Thread(target=run, name='rollup-refresh', daemon=True).start()
+
+    @staticmethod
+    def _measure(node):
+        """Rollup expression replacing an aggregate of the base table, or None if it has none"""
+        if isinstance(node, exp.Count) and isinstance(node.this, exp.Star):
+            return exp.cast(exp.func('COALESCE', exp.func('SUM', exp.column('row_count')), exp.Literal.number(0)), 'BIGINT')
+        if not isinstance(node, exp.Sum):
+            return None
+        argument = node.this.unnest()
+        if isinstance(argument, exp.Column) and argument.name.lower() in ('units', 'total'):
+            measure = exp.func('SUM', exp.column(f"{argument.name.lower()}_sum"))
+            # SUM of the integer units is a bigint on the base table, keep the same type
+            return exp.cast(measure, 'BIGINT') if argument.name.lower() == 'units' else measure
+        if isinstance(argument, exp.Mul):
+            factors = {factor.unnest().name.lower() for factor in (argument.this, argument.expression)
+                       if isinstance(factor.unnest(), exp.Column)}
+            if factors == {'units', 'unit_cost'}:
+                return exp.func('SUM', exp.column('sales_sum'))
+        return None
+
+    def _rewrite_tree(self, tree):
+        """Rewrite a parsed query to read the rollup, or return None if it is not eligible"""
+        if not isinstance(tree, exp.Select) or tree.args.get('with') or tree.args.get('joins'):
+            return None
+        if any(True for _ in tree.find_all(exp.Subquery, exp.Window, exp.Filter)) \
+                or any(select is not tree for select in tree.find_all(exp.Select)):
+            return None
+        source = tree.find(exp.From)
+        if source is None or not isinstance(source.this, exp.Table) or source.this.name.lower() != 'sampledb':
+            return None
+        if not tree.args.get('group') and not any(True for _ in tree.find_all(exp.AggFunc)):
+            return None
+
+        # SELECT * would expose the rollup columns, and only COUNT(*) has a rollup equivalent
+        if any(not isinstance(star.parent, exp.Count) for star in tree.find_all(exp.Star)):
+            return None
+
+        query = tree.copy()
+        # Keep the output column names of the original query
+        for projection in list(query.expressions):
+            if not isinstance(projection, exp.Alias) and projection.find(exp.AggFunc):
+                projection.replace(exp.alias_(projection.copy(), _column_name(projection), quoted=True))
+        aliases = {projection.alias.lower() for projection in query.expressions if isinstance(projection, exp.Alias)}
+
+        for node in list(query.find_all(exp.AggFunc)):
+            replacement = self._measure(node)
+            if replacement is not None:
+                node.replace(replacement)
+            elif not (isinstance(node, (exp.Min, exp.Max)) or
+                      (isinstance(node, exp.Count) and isinstance(node.this, exp.Distinct))):
+                return None
+
+        # Anything else must only read the dimensions; output aliases may appear in ORDER BY and HAVING
+        for column in query.find_all(exp.Column):
+            name = column.name.lower()
+            if name in DIMENSIONS or name in ('units_sum', 'total_sum', 'sales_sum', 'row_count'):
+                continue
+            if name in aliases and not column.table and column.find_ancestor(exp.Where) is None:
+                continue
+            return None
+
+        table = query.find(exp.From).this
+        table.replace(exp.alias_(exp.table_(ROLLUP_TABLE), table.alias or 'sampledb', table=True))
+        return query
+
+    def rewrite(self, sql_query):
+        """
+        Answer an aggregate query from the rollup when it can be
+
+        Args:
+            sql_query (str): SQL query on sampledb
+
+        Returns:
+            tuple: (SQL to run, 'rewritten', 'ineligible' or 'stale')
+        """
+        if sqlglot is None:
+            return sql_query, 'ineligible'
+        try:
+            statements = sqlglot.parse(sql_query.strip().rstrip(';'), read='postgres')
+            query = self._rewrite_tree(statements[0]) if len(statements) == 1 else None
+        except Exception:
+            query = None
+        if query is None:
+            return sql_query, 'ineligible'
+
+        try:
+            fresh = self.is_fresh()
+        except Exception as e:
+            print(f"Error checking {ROLLUP_TABLE} freshness: {str(e)}")
+            return sql_query, 'stale'
+        if not fresh:
+            if self.auto_refresh:
+                self._refresh_in_background()
+            return sql_query, 'stale'
+        return query.sql(dialect='postgres'), 'rewritten'
+
+
+if __name__ == '__main__':
+    # Run from sql_engine/: python -m utils.rollup [--full]
+    from config import config
+    from utils.db_engine import get_engine
+
+    parser = argparse.ArgumentParser(description=f'Create and refresh {ROLLUP_TABLE}')
+    parser.add_argument('--full', action='store_true', help='rebuild the whole rollup')
+    args = parser.parse_args()
+
+    settings = config[os.getenv('FLASK_CONFIG', 'default')]
+    rollup = SalesRollup(get_engine(settings.SQLALCHEMY_DATABASE_URI, settings.SQLALCHEMY_ENGINE_OPTIONS))
+    rollup.create()
+    print(rollup.refresh(full=args.full))
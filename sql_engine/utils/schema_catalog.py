@@ -0,0 +1,218 @@
+import time
+import threading
+from sqlalchemy import inspect, text
+
+# One catalog query whose result changes whenever a table, column, column comment or index of the schema does
+FINGERPRINT_SQL = """
+    SELECT md5(
+        COALESCE((
+            SELECT string_agg(c.relname || '.' || a.attname || ':' || format_type(a.atttypid, a.atttypmod)
+                              || ':' || a.attnotnull || ':' || COALESCE(col_description(c.oid, a.attnum), ''),
+                              ',' ORDER BY c.relname, a.attnum)
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            JOIN pg_attribute a ON a.attrelid = c.oid
+            WHERE n.nspname = :schema AND c.relkind IN ('r', 'p', 'v', 'm')
+              AND a.attnum > 0 AND NOT a.attisdropped
+        ), '') || '|' ||
+        COALESCE((
+            SELECT string_agg(i.indexrelid::regclass::text, ',' ORDER BY i.indexrelid)
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = :schema
+        ), '')
+    )
+"""
+
+ROW_ESTIMATES_SQL = """
+    SELECT c.relname, c.reltuples::bigint
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = :schema AND c.relkind IN ('r', 'p', 'm')
+"""
+
+
+def column_category(column_type):
+    """
+    Classify a column type the way the LLM prompts describe columns
+
+    Args:
+        column_type (str): SQL type of the column
+
+    Returns:
+        str: 'Categorical', 'Numeric', 'Date' or 'Other'
+    """
+    column_type = column_type.upper()
+    if column_type.startswith(('VARCHAR', 'CHAR', 'TEXT')):
+        return 'Categorical'
+    if column_type.startswith(('INTEGER', 'BIGINT', 'SMALLINT', 'NUMERIC', 'DECIMAL', 'REAL', 'DOUBLE', 'FLOAT')):
+        return 'Numeric'
+    if column_type.startswith(('DATE', 'TIMESTAMP')):
+        return 'Date'
+    return 'Other'
+
+
+class SchemaCatalog:
+    """
+    A cache of the reflected database schema.
+
+    Tables, columns (type, nullability, comment), primary keys, indexes and
+    row-count estimates are reflected once and reused until a single catalog
+    fingerprint query, run at most every `check_interval` seconds, reports a
+    DDL change. The fingerprint doubles as the version of the schema.
+    """
+    def __init__(self, engine, schema='public', check_interval=5):
+        """
+        Initialize the SchemaCatalog class
+
+        Args:
+            engine (Engine): SQLAlchemy engine of the database
+            schema (str): Database schema to reflect
+            check_interval (int): Minimum seconds between two DDL checks
+        """
+        self.engine = engine
+        self.schema = schema
+        self.check_interval = check_interval
+
+        self.version = None
+        self.tables = {}
+        self._checked_at = 0
+        self._prompts = {}
+        self._lock = threading.Lock()
+
+    def _reflect(self, conn):
+        """Reflect every table of the schema"""
+        inspector = inspect(conn)
+        row_estimates = dict(conn.execute(text(ROW_ESTIMATES_SQL), {'schema': self.schema}).fetchall())
+
+        tables = {}
+        for table in inspector.get_table_names(schema=self.schema):
+            tables[table] = {
+                'columns': [
+                    {
+                        'name': col['name'],
+                        'type': str(col['type']),
+                        'nullable': col.get('nullable', True),
+                        'comment': col.get('comment')
+                    }
+                    for col in inspector.get_columns(table, schema=self.schema)
+                ],
+                'primary_key': inspector.get_pk_constraint(table, schema=self.schema).get('constrained_columns', []),
+                'indexes': [
+                    {
+                        'name': index['name'],
+                        'columns': index['column_names'],
+                        'unique': index.get('unique', False)
+                    }
+                    for index in inspector.get_indexes(table, schema=self.schema)
+                ],
+                'row_estimate': max(row_estimates.get(table, 0), 0)
+            }
+        return tables
+
+    def refresh(self, force=False):
+        """
+        Re-reflect the schema if its fingerprint changed
+
+        Args:
+            force (bool): Skip the check interval and always compare fingerprints
+
+        Returns:
+            str: Current schema version
+        """
+        with self._lock:
+            if not force and self.version and time.time() - self._checked_at < self.check_interval:
+                return self.version
+            with self.engine.connect() as conn:
+                version = conn.execute(text(FINGERPRINT_SQL), {'schema': self.schema}).scalar()
+                if version != self.version:
+                    self.tables = self._reflect(conn)
+                    self.version = version
+                    print(f"Schema catalog reflected {len(self.tables)} tables (version {version})")
+            self._checked_at = time.time()
+            return self.version
+
+    def snapshot(self):
+        """
+        Get the reflected schema
+
+        Returns:
+            dict: Schema version and table metadata
+        """
+        version = self.refresh()
+        return {'version': version, 'tables': self.tables}
+
+    def get_columns(self, table):
+        """
+        Get the column names of a table
+
+        Args:
+            table (str): Table name
+
+        Returns:
+            list: Column names, empty if the table does not exist
+        """
+        self.refresh()
+        return [col['name'] for col in self.tables.get(table, {}).get('columns', [])]
+
+    def prompt_schema(self, tables, samples=None):
+        """
+        Describe tables for the LLM prompts
+
+        The block starts every prompt, so Ollama can reuse it from its KV cache
+        only while it stays byte-identical: it is built once per schema version,
+        with the example values sorted, and reused until the next DDL change.
+
+        Args:
+            tables (list): Tables to describe
+            samples (callable, optional): Function () -> {table: {column: example values}}, e.g. reading
+                the value dictionary, called once per schema version
+
+        Returns:
+            str: Schema block listing each column with its type, description, examples or
+            literal format, and category
+        """
+        version = self.refresh()
+        key = tuple(tables)
+        with self._lock:
+            cached = self._prompts.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+        examples = samples() if samples else {}
+        prompt = self._describe(tables, examples)
+        # Without examples (e.g. the value dictionary failed to load), try again on the next call
+        if not samples or any(examples.values()):
+            with self._lock:
+                self._prompts[key] = (version, prompt)
+        return prompt
+
+    def _describe(self, tables, samples):
+        """Build the schema block of prompt_schema()"""
+        lines = []
+        for table in tables:
+            info = self.tables.get(table)
+            if not info:
+                continue
+            lines.append(f"Table Schema ({table}):")
+            categories = {}
+            examples = (samples or {}).get(table, {})
+            for col in info['columns']:
+                if col['name'] in info['primary_key']:
+                    continue
+                description = f": {col['comment']}" if col['comment'] else ''
+                if examples.get(col['name']):
+                    values = ', '.join("'" + str(value).replace("'", "''") + "'"
+                                       for value in sorted(examples[col['name']], key=str))
+                    description += f" (e.g. {values})"
+                elif column_category(col['type']) == 'Date':
+                    description += " (format 'YYYY-MM-DD')"
+                lines.append(f"- {col['name']} ({col['type']}){description}")
+                categories.setdefault(column_category(col['type']), []).append(col['name'])
+            lines.append("")
+            lines.append("Column Categories:")
+            for category in ('Categorical', 'Numeric', 'Date', 'Other'):
+                if category in categories:
+                    lines.append(f"- {category}: {', '.join(categories[category])}")
+            lines.append("")
+        return "\n".join(lines).strip()
@@ -0,0 +1,14 @@
+import re
+
+
+def normalize_sql(sql_query):
+    """
+    Normalize a SQL statement so trivially different copies compare equal
+
+    Args:
+        sql_query (str): SQL statement
+
+    Returns:
+        str: Statement with collapsed whitespace and no trailing semicolon
+    """
+    return re.sub(r'\s+', ' ', (sql_query or '').strip()).rstrip(' ;')
@@ -0,0 +1,169 @@
+from sqlalchemy import text
+
+try:
+    import sqlglot
+    from sqlglot import exp
+except ImportError:  # sqlglot is optional, without it every query goes through the checker model
+    sqlglot = None
+    exp = None
+
+# Nodes that write data, change the schema or take row locks, rejected anywhere in a query,
+# e.g. in a data-modifying CTE (WITH d AS (DELETE ... RETURNING *) SELECT ...) or SELECT ... INTO
+WRITE_NODES = ('Insert', 'Update', 'Delete', 'Merge', 'Create', 'Drop', 'Alter', 'AlterTable', 'TruncateTable',
+               'Command', 'Grant', 'Revoke', 'Copy', 'Into', 'Lock', 'Set', 'Transaction', 'Commit')
+
+
+def sqlglot_available():
+    """Check whether the SQL parser needed for local validation is installed"""
+    return sqlglot is not None
+
+
+class SQLValidator:
+    """
+    Deterministic checks of generated SQL, run before the checker model.
+
+    A query passes when it is a single SELECT, with no data-modifying or
+    DDL statement nested anywhere in it, that only references known
+    tables and columns, applies every selected value as an IN / = filter,
+    projects every selected column, avoids the constructs the checker rewrites
+    (case-sensitive LIKE) and is accepted by the Postgres planner (EXPLAIN).
+    Queries that pass do not need the second LLM generation; anything else is
+    escalated to the checker.
+    """
+    def __init__(self, engine, schema_catalog, explain=True):
+        """
+        Initialize the SQLValidator class
+
+        Args:
+            engine (Engine): Engine, or ReplicaRouter, used for EXPLAIN
+            schema_catalog (SchemaCatalog): Source of the known tables and columns
+            explain (bool): Also validate the query with EXPLAIN against the database
+        """
+        self.engine = engine
+        self.schema_catalog = schema_catalog
+        self.explain = explain
+
+    @staticmethod
+    def _result(valid, reason=''):
+        return {'valid': valid, 'reason': reason}
+
+    def _known_columns(self, tree):
+        """Get the columns a query may reference: table columns plus the aliases it defines"""
+        tables = self.schema_catalog.snapshot()['tables']
+        cte_names = {cte.alias.lower() for cte in tree.find_all(exp.CTE)}
+        columns = set()
+        for table in tree.find_all(exp.Table):
+            name = table.name.lower()
+            if name in cte_names:
+                continue
+            if name not in tables:
+                return None, f"unknown table '{table.name}'"
+            columns.update(col['name'].lower() for col in tables[name]['columns'])
+        columns.update(alias.alias.lower() for alias in tree.find_all(exp.Alias))
+        for table_alias in tree.find_all(exp.TableAlias):
+            columns.update(col.name.lower() for col in table_alias.columns)
+        return columns, ''
+
+    @staticmethod
+    def _conjuncts(condition):
+        """Split a condition on its top-level ANDs, without looking inside OR, NOT, CASE or subqueries"""
+        condition = condition.unnest()
+        if isinstance(condition, exp.And):
+            return SQLValidator._conjuncts(condition.this) + SQLValidator._conjuncts(condition.expression)
+        return [condition]
+
+    @staticmethod
+    def _filters_on(tree, column, values):
+        """Check that the outermost SELECT filters a column on exactly the selected values in a WHERE conjunct"""
+        where = tree.args.get('where') if isinstance(tree, exp.Select) else None
+        if where is None:
+            return False
+        for node in SQLValidator._conjuncts(where.this):
+            if isinstance(node, exp.In):
+                if not isinstance(node.this, exp.Column) or node.this.name.lower() != column:
+                    continue
+                literals = node.expressions
+            elif isinstance(node, exp.EQ):
+                sides = [node.this, node.expression]
+                columns = [side for side in sides if isinstance(side, exp.Column)]
+                if len(columns) != 1 or columns[0].name.lower() != column:
+                    continue
+                literals = [side for side in sides if side is not columns[0]]
+            else:
+                continue
+            if literals and all(isinstance(literal, exp.Literal) for literal in literals) \
+                    and {literal.name for literal in literals} == values:
+                return True
+        return False
+
+    @staticmethod
+    def _projects(tree, column):
+        """Check that the outermost SELECT returns the column, directly or inside an expression"""
+        for projection in tree.expressions:
+            if isinstance(projection, exp.Star):
+                return True
+            if any(col.name.lower() == column for col in projection.find_all(exp.Column)):
+                return True
+        return False
+
+    def _explain(self, sql):
+        """Let the planner parse and plan the query without running it"""
+        with self.engine.connect() as conn:
+            conn.execute(text(f"EXPLAIN {sql}"))
+
+    def check(self, sql, columns, selected_values):
+        """
+        Check whether generated SQL can be used without the checker model
+
+        Args:
+            sql (str): SQL generated by the first model
+            columns (list): Selected columns
+            selected_values (dict): Selected filter values
+
+        Returns:
+            dict: 'valid' flag and the 'reason' the query was escalated
+        """
+        if sqlglot is None:
+            return self._result(False, 'sqlglot is not installed')
+
+        sql = (sql or '').strip().rstrip(';')
+        try:
+            statements = sqlglot.parse(sql, read='postgres')
+        except Exception as e:
+            return self._result(False, f"unparseable SQL: {str(e).splitlines()[0]}")
+        if len(statements) != 1 or not isinstance(statements[0], (exp.Select, exp.Union)):
+            return self._result(False, 'not a single SELECT statement')
+        tree = statements[0]
+        write_types = tuple(getattr(exp, name) for name in WRITE_NODES if hasattr(exp, name))
+        write = next(tree.find_all(*write_types), None)
+        if write is not None:
+            return self._result(False, f"{write.key.upper()} inside the query")
+
+        known_columns, reason = self._known_columns(tree)
+        if known_columns is None:
+            return self._result(False, reason)
+        for column in tree.find_all(exp.Column):
+            if isinstance(column.this, exp.Star):
+                continue
+            if column.name.lower() not in known_columns:
+                return self._result(False, f"unknown column '{column.name}'")
+
+        if any(True for _ in tree.find_all(exp.Like)):
+            return self._result(False, 'case-sensitive LIKE')
+
+        for column, values in (selected_values or {}).items():
+            values = values if isinstance(values, (list, tuple)) else [values]
+            if values and not self._filters_on(tree, column.lower(), {str(v) for v in values}):
+                return self._result(False, f"missing filter on '{column}'")
+
+        for column in columns or []:
+            if not isinstance(tree, exp.Select) or not self._projects(tree, column.lower()):
+                return self._result(False, f"selected column '{column}' not returned")
+
+        if self.explain:
+            try:
+                self._explain(sql)
+            except Exception as e:
+                return self._result(False, f"rejected by EXPLAIN: {str(e).splitlines()[0]}")
+
+        return self._result(True)
@@ -0,0 +1,245 @@
+import json
+import time
+import hashlib
+import threading
+from sqlalchemy import text
+
+TEXT_TYPES = ('character varying', 'character', 'text')
+
+
+class ValueDictionary:
+    """
+    A cache of the distinct values (with counts) of the categorical columns of a table.
+
+    Categorical columns are discovered from the schema: text columns whose
+    estimated number of distinct values is small. Values are computed with a
+    single GROUPING SETS scan, on a TABLESAMPLE for large tables, and kept
+    fresh by incremental refreshes that only aggregate rows with an id above
+    the last one seen. Refreshes run in a background thread on a schedule or
+    when a load is reported through notify_load().
+    """
+    def __init__(self, engine, table='sampledb', id_column='id', max_distinct=1000,
+                 sample_threshold=1000000, sample_percent=1.0,
+                 refresh_interval=300, full_refresh_interval=86400):
+        """
+        Initialize the ValueDictionary class
+
+        Args:
+            engine (Engine): SQLAlchemy engine of the database
+            table (str): Table whose categorical columns are tracked
+            id_column (str): Monotonically increasing column used for incremental refreshes
+            max_distinct (int): Maximum number of distinct values for a column to count as categorical
+            sample_threshold (int): Estimated row count above which values are computed on a sample
+            sample_percent (float): Percentage of pages read by TABLESAMPLE SYSTEM on large tables
+            refresh_interval (int): Seconds between incremental refreshes in the background
+            full_refresh_interval (int): Seconds between full refreshes, which pick up deletes and updates
+        """
+        self.engine = engine
+        self.table = table
+        self.id_column = id_column
+        self.max_distinct = max_distinct
+        self.sample_threshold = sample_threshold
+        self.sample_percent = sample_percent
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+
+        self.columns = []
+        self.counts = {}
+        self.approximate = False
+        self.etag = None
+        self.refreshed_at = None
+        self._last_id = None
+        self._last_full_refresh = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def _row_estimate(self, conn):
+        """Get the planner's row count estimate of the table from pg_class"""
+        estimate = conn.execute(text(
+            "SELECT reltuples::bigint FROM pg_class WHERE relname = :table"
+        ), {'table': self.table}).scalar()
+        return max(estimate or 0, 0)
+
+    def discover_columns(self, conn):
+        """
+        Find the categorical columns of the table
+
+        Text columns are categorical when pg_stats estimates at most max_distinct
+        values; columns without statistics are checked with a bounded DISTINCT.
+
+        Args:
+            conn (Connection): Open SQLAlchemy connection
+
+        Returns:
+            list: Names of the categorical columns
+        """
+        candidates = [row[0] for row in conn.execute(text("""
+            SELECT column_name, data_type FROM information_schema.columns
+            WHERE table_name = :table
+            ORDER BY ordinal_position
+        """), {'table': self.table}) if row[1] in TEXT_TYPES]
+        stats = dict(conn.execute(text("""
+            SELECT attname, n_distinct FROM pg_stats WHERE tablename = :table
+        """), {'table': self.table}).fetchall())
+        row_estimate = self._row_estimate(conn)
+
+        columns = []
+        for column in candidates:
+            n_distinct = stats.get(column)
+            if n_distinct is not None:
+                # Negative n_distinct is a fraction of the row count
+                distinct = n_distinct if n_distinct >= 0 else -n_distinct * row_estimate
+            else:
+                distinct = conn.execute(text(
+                    f'SELECT COUNT(*) FROM (SELECT DISTINCT "{column}" FROM {self.table} LIMIT :limit) AS d'
+                ), {'limit': self.max_distinct + 1}).scalar()
+            if distinct <= self.max_distinct:
+                columns.append(column)
+        return columns
+
+    def _aggregate(self, conn, columns, where='', sample_clause='', params=None):
+        """Count the values of every column in one GROUPING SETS scan"""
+        select_list = ', '.join(f'"{column}"' for column in columns)
+        grouping_sets = ', '.join(f'("{column}")' for column in columns)
+        grouping_flags = ', '.join(f'GROUPING("{column}")' for column in columns)
+        result = conn.execute(text(f"""
+            SELECT {select_list}, {grouping_flags}, COUNT(*)
+            FROM {self.table} {sample_clause} {where}
+            GROUP BY GROUPING SETS ({grouping_sets})
+        """), params or {})
+
+        counts = {column: {} for column in columns}
+        for row in result:
+            values, flags, count = row[:len(columns)], row[len(columns):-1], row[-1]
+            for column, value, flag in zip(columns, values, flags):
+                # GROUPING() is 0 for the column this row is grouped by
+                if flag == 0 and value is not None:
+                    counts[column][str(value)] = count
+        return counts
+
+    def _update_etag(self):
+        """Recompute the version tag of the dictionary (lock must be held)"""
+        payload = json.dumps(self.counts, sort_keys=True)
+        self.etag = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+        self.refreshed_at = time.time()
+
+    def refresh_full(self):
+        """Rediscover the categorical columns and recount all of their values"""
+        with self.engine.connect() as conn:
+            columns = self.discover_columns(conn)
+            last_id = conn.execute(text(f"SELECT MAX({self.id_column}) FROM {self.table}")).scalar()
+            approximate = self._row_estimate(conn) > self.sample_threshold
+            counts = {}
+            if columns:
+                sample_clause = f"TABLESAMPLE SYSTEM ({self.sample_percent})" if approximate else ''
+                where = f"WHERE {self.id_column} <= :last_id" if last_id is not None else ''
+                counts = self._aggregate(conn, columns, where, sample_clause, {'last_id': last_id})
+                if approximate:
+                    scale = 100.0 / self.sample_percent
+                    counts = {column: {value: int(count * scale) for value, count in values.items()}
+                              for column, values in counts.items()}
+
+        with self._lock:
+            self.columns = columns
+            self.counts = counts
+            self.approximate = approximate
+            self._last_id = last_id
+            self._last_full_refresh = time.time()
+            self._update_etag()
+        print(f"Value dictionary refreshed: {', '.join(columns)} ({'approximate' if approximate else 'exact'})")
+
+    def refresh_incremental(self):
+        """Add the values of rows inserted since the last refresh"""
+        if self._last_id is None or not self.columns:
+            return self.refresh_full()
+
+        with self.engine.connect() as conn:
+            last_id = conn.execute(text(f"SELECT MAX({self.id_column}) FROM {self.table}")).scalar()
+            if last_id is None or last_id <= self._last_id:
+                return
+            new_counts = self._aggregate(
+                conn, self.columns,
+                f"WHERE {self.id_column} > :since AND {self.id_column} <= :last_id",
+                params={'since': self._last_id, 'last_id': last_id}
+            )
+
+        with self._lock:
+            for column, values in new_counts.items():
+                column_counts = self.counts.setdefault(column, {})
+                for value, count in values.items():
+                    column_counts[value] = column_counts.get(value, 0) + count
+            self._last_id = last_id
+            self._update_etag()
+
+    def refresh(self, full=False):
+        """
+        Refresh the dictionary, falling back to a full refresh when due
+
+        Args:
+            full (bool): Force a full refresh
+        """
+        with self._refresh_lock:
+            if full or time.time() - self._last_full_refresh > self.full_refresh_interval:
+                self.refresh_full()
+            else:
+                self.refresh_incremental()
+
+    def notify_load(self):
+        """Report that rows were loaded so the background thread refreshes now"""
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.refresh_interval)
+            self._wakeup.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing value dictionary: {str(e)}")
+
+    def start(self):
+        """Start refreshing in a background thread"""
+        if self._thread is None and self.refresh_interval > 0:
+            self._thread = threading.Thread(target=self._run, name='value-dictionary', daemon=True)
+            self._thread.start()
+
+    def snapshot(self):
+        """
+        Get the current dictionary, computing it on first use
+
+        Returns:
+            dict: Sorted unique values and counts per column, with the version tag
+        """
+        if self.etag is None:
+            self.refresh(full=True)
+        with self._lock:
+            return {
+                'unique_values': {column: sorted(values) for column, values in self.counts.items()},
+                'counts': {column: dict(values) for column, values in self.counts.items()},
+                'approximate': self.approximate,
+                'etag': self.etag,
+                'refreshed_at': self.refreshed_at
+            }
+
+    def samples(self, limit=5):
+        """
+        Get the most frequent values of each categorical column, e.g. as examples for the LLM prompts
+
+        Args:
+            limit (int): Maximum number of values per column
+
+        Returns:
+            dict: Column -> values, most frequent first
+        """
+        if self.etag is None:
+            self.refresh(full=True)
+        with self._lock:
+            return {
+                column: [value for value, _ in sorted(
+                    ((value, count) for value, count in values.items() if value is not None),
+                    key=lambda item: (-item[1], str(item[0]))
+                )[:limit]]
+                for column, values in self.counts.items()
+            }